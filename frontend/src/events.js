@@ -0,0 +1,32 @@
+// Live updates pushed by the management API through server-sent events (`GET /events`)
+
+// Applies a patch of the `stats` or `async` events, where the lists are patched by index and `null` removes a key
+export const applyPatch = (target, patch) => {
+  for (const [key, value] of Object.entries(patch)) {
+    if (value === null) {
+      delete target[key]
+    } else if (typeof value === 'object' && !Array.isArray(value) && target[key] !== null && typeof target[key] === 'object') {
+      applyPatch(target[key], value)
+    } else {
+      target[key] = value
+    }
+  }
+}
+
+// Keeps `state.value` up to date with the snapshots and patches of a `stats` or `async` event
+export const applyStateEvent = (state, data) => {
+  if (data.snapshot !== undefined) {
+    state.value = data.snapshot
+  } else if (state.value) {
+    applyPatch(state.value, data.patch)
+  }
+}
+
+// Subscribes the `handlers` to their topics, returns the `EventSource` to close once done
+export const subscribe = (handlers) => {
+  const source = new EventSource(`/api/events?topics=${Object.keys(handlers).join(',')}`)
+  for (const [topic, handler] of Object.entries(handlers)) {
+    source.addEventListener(topic, (event) => handler(JSON.parse(event.data)))
+  }
+  return source
+}
@@ -16,7 +16,6 @@ import sys
 from os import path, environ
 from typing import (
     Union,
-    Tuple,
     List,
     Dict,
     Any,
@@ -31,8 +30,9 @@ from .definition import Definition
 from .helpers import _nostderr, _import_from
 from .replicas import Request, Response  # noqa: F401
 from .servers import HttpServer, TornadoImpl
-from .templating import RenderingQueue, RenderingJob
+from .templating import RenderingQueue
 from .transpilers import OASToConfigTranspiler
+from .workers import fork_workers
 
 __location__ = path.abspath(path.dirname(__file__))
 with open(os.path.join(__location__, "res", "version.txt")) as fp:
@@ -68,16 +68,12 @@ def import_interceptors(interceptors: Optional[List[List[str]]]) -> List[Any]:
     return imported_interceptors
 
 
-def start_render_queue() -> Tuple[RenderingQueue, RenderingJob]:
-    """Start the rendering queue and job thread."""
-    queue = RenderingQueue()
-    render_job = RenderingJob(queue)
-    render_job.daemon = True
-    render_job.start()
-    return queue, render_job
+def start_render_queue() -> RenderingQueue:
+    """Start the rendering engine (and its worker pool, if configured)."""
+    return RenderingQueue()
 
 
-def setup_signal_handlers(http_server: HttpServer, render_thread: RenderingJob) -> List[bool]:
+def setup_signal_handlers(http_server: HttpServer, rendering_queue: RenderingQueue) -> List[bool]:
     """Setup signal handlers for graceful shutdown and restart."""
     do_restart = [False]  # mutable list for closure
     
@@ -88,7 +84,7 @@ def setup_signal_handlers(http_server: HttpServer, render_thread: RenderingJob)
             """Handle SIGHUP signal for graceful restart."""
             logging.info("Received SIGHUP")
             http_server.stop()
-            render_thread.kill()
+            rendering_queue.shutdown()
             signal.signal(signal.SIGHUP, prev_handler)
             do_restart[0] = True
 
@@ -115,7 +111,7 @@ def run(
     if tags is None:
         tags = []
     
-    queue, render_thread = start_render_queue()
+    queue = start_render_queue()
 
     if address:
         logging.info('Bind address: %s', address)
@@ -138,7 +134,7 @@ def run(
         with _nostderr():
             raise
 
-    do_restart = setup_signal_handlers(http_server, render_thread)
+    do_restart = setup_signal_handlers(http_server, queue)
     http_server.run()
     return do_restart[0]
 
@@ -241,7 +237,9 @@ def run_server(
     interceptors: Optional[List[str]] = None,
     bind_address: Optional[str] = None,
     tags: Optional[List[str]] = None,
-    load_override: Optional[Dict[str, Any]] = None
+    load_override: Optional[Dict[str, Any]] = None,
+    workers: int = 1,
+    cpu_affinity: bool = False
 ) -> int:
     """Run the Mockintosh server with the given configuration."""
     # Setup coverage if enabled
@@ -258,6 +256,11 @@ def run_server(
     
     logging.info("%s v%s is starting...", PROGRAM.capitalize(), __version__)
 
+    if workers > 1 and not cov_no_run:
+        # Only the workers return from here, the supervisor process exits when they are all gone
+        worker_index = fork_workers(workers, cpu_affinity=cpu_affinity)
+        logging.info("Worker #%d (pid %d) is starting...", worker_index, os.getpid())
+
     if not cov_no_run:
         while run(config_file, debug=bool(debug_mode), interceptors=tuple(interceptors or ()), 
                   address=bind_address or '', services_list=services, tags=tags, 
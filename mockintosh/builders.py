@@ -28,6 +28,10 @@ from mockintosh.config import (
     ConfigMultiResponse,
     ConfigBody,
     ConfigEndpoint,
+    ConfigFallbackTo,
+    ConfigFallbackToCache,
+    ConfigFallbackToCircuitBreaker,
+    ConfigFallbackToGroup,
     ConfigHttpService,
     ConfigManagement,
     ConfigGlobals,
@@ -143,11 +147,15 @@ class ConfigRootBuilder:
         response_data = data
         if isinstance(data, str):
             response_data = {'body': data}
+
+        body = response_data.get('body', None)
+        if isinstance(body, str) and body.startswith('@'):
+            body = self.build_config_external_file_path(body, service=service)
         
         config_response = ConfigResponse(
             headers=self.build_config_headers(response_data.get('headers', None), service=service),
             status=response_data.get('status', 200),
-            body=response_data.get('body', None),
+            body=body,
             use_templating=response_data.get('useTemplating', True),
             templating_engine=response_data.get('templatingEngine', PYBARS),
             tag=response_data.get('tag', None),
@@ -187,7 +195,7 @@ class ConfigRootBuilder:
 
         return ConfigEndpoint(
             path=endpoint['path'],
-            _id=endpoint.get('id', None),
+            id=endpoint.get('id', None),
             comment=endpoint.get('comment', None),
             method=endpoint.get('method', 'GET'),
             query_string=endpoint.get('queryString', {}),
@@ -197,7 +205,76 @@ class ConfigRootBuilder:
             response=response,
             multi_responses_looped=endpoint.get('multiResponsesLooped', True),
             dataset_looped=endpoint.get('datasetLooped', True),
-            performance_profile=endpoint.get('performanceProfile', None)
+            performance_profile=endpoint.get('performanceProfile', None),
+            compress=endpoint.get('compress', None),
+            weak_etag=endpoint.get('weakEtag', None)
+        )
+
+    def build_config_fallback_to_cache(self, cache: Union[bool, dict, None]) -> Union[ConfigFallbackToCache, None]:
+        if cache is None or cache is False:
+            return None
+        if cache is True:
+            return ConfigFallbackToCache()
+        return ConfigFallbackToCache(
+            ttl=cache.get('ttl', 0),
+            max_size=cache.get('maxSize', 16 * 1024 * 1024),
+            key_headers=cache.get('keyHeaders', []),
+            key_body=cache.get('keyBody', True),
+            path=cache.get('path', None)
+        )
+
+    def build_config_fallback_to_circuit_breaker(
+        self,
+        circuit_breaker: Union[bool, dict, None]
+    ) -> Union[ConfigFallbackToCircuitBreaker, None]:
+        if circuit_breaker is None or circuit_breaker is False:
+            return None
+        if circuit_breaker is True:
+            return ConfigFallbackToCircuitBreaker()
+        return ConfigFallbackToCircuitBreaker(
+            failure_threshold=circuit_breaker.get('failureThreshold', 5),
+            error_rate=circuit_breaker.get('errorRate', 0.5),
+            min_requests=circuit_breaker.get('minRequests', 20),
+            window=circuit_breaker.get('window', 10),
+            open_duration=circuit_breaker.get('openDuration', 30)
+        )
+
+    def build_config_fallback_to(
+        self,
+        fallback_to: Union[str, dict, list, None]
+    ) -> Union[ConfigFallbackTo, ConfigFallbackToGroup, None]:
+        if fallback_to is None:
+            return None
+        if isinstance(fallback_to, list):
+            fallback_to = {'targets': fallback_to}
+        if isinstance(fallback_to, dict) and 'targets' in fallback_to:
+            return ConfigFallbackToGroup(
+                targets=[self.build_config_fallback_to_target(target, in_group=True) for target in fallback_to['targets']],
+                strategy=fallback_to.get('strategy', 'roundRobin'),
+                coalesce=fallback_to.get('coalesce', True),
+                cache=self.build_config_fallback_to_cache(fallback_to.get('cache', None))
+            )
+        return self.build_config_fallback_to_target(fallback_to)
+
+    def build_config_fallback_to_target(self, fallback_to: Union[str, dict], in_group: bool = False) -> ConfigFallbackTo:
+        if isinstance(fallback_to, str):
+            fallback_to = {'url': fallback_to}
+        # The targets of a group are health checked by their circuit breakers unless it is disabled
+        circuit_breaker = fallback_to.get('circuitBreaker', True if in_group else None)
+        return ConfigFallbackTo(
+            url=fallback_to['url'],
+            max_connections=fallback_to.get('maxConnections', 100),
+            max_keepalive_connections=fallback_to.get('maxKeepaliveConnections', 20),
+            keepalive_expiry=fallback_to.get('keepaliveExpiry', 5.0),
+            connect_timeout=fallback_to.get('connectTimeout', None),
+            read_timeout=fallback_to.get('readTimeout', None),
+            http2=fallback_to.get('http2', False),
+            dns_cache_ttl=fallback_to.get('dnsCacheTtl', 0),
+            stream=fallback_to.get('stream', False),
+            coalesce=fallback_to.get('coalesce', True),
+            cache=self.build_config_fallback_to_cache(fallback_to.get('cache', None)),
+            circuit_breaker=self.build_config_fallback_to_circuit_breaker(circuit_breaker),
+            weight=fallback_to.get('weight', 1)
         )
 
     def build_config_http_service(self, service: dict, internal_service_id: Union[int, None] = None) -> ConfigHttpService:
@@ -213,7 +290,9 @@ class ConfigRootBuilder:
             oas=oas,
             endpoints=[],
             performance_profile=service.get('performanceProfile', None),
-            fallback_to=service.get('fallbackTo', None),
+            fallback_to=self.build_config_fallback_to(service.get('fallbackTo', None)),
+            compress=service.get('compress', False),
+            weak_etag=service.get('weakEtag', False),
             internal_service_id=internal_service_id
         )
 
@@ -75,8 +75,18 @@ def convert(source: str, output: str, format: str):
 @click.option('--services', '-s', multiple=True, help='Specific services to run')
 @click.option('--interceptors', '-i', multiple=True, help='Interceptor modules to load')
 @click.option('--tags', '-t', multiple=True, help='Tags to enable')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=1, help='Number of worker processes sharing the ports')
+@click.option('--cpu-affinity', is_flag=True, help='Pin each worker process to a CPU')
 @click.pass_context
-def serve(ctx, config_file: str, services: List[str], interceptors: List[str], tags: List[str]):
+def serve(
+    ctx,
+    config_file: str,
+    services: List[str],
+    interceptors: List[str],
+    tags: List[str],
+    workers: int,
+    cpu_affinity: bool
+):
     """Start the Mockintosh server with a configuration file."""
     debug_mode = ctx.obj.get('debug', False)
     bind_address = ctx.obj.get('bind_address')
@@ -90,7 +100,9 @@ def serve(ctx, config_file: str, services: List[str], interceptors: List[str], t
         debug=bool(debug_mode),
         interceptors=interceptors,
         bind_address=bind_address,
-        tags=tags
+        tags=tags,
+        workers=workers,
+        cpu_affinity=cpu_affinity
     ))
 
 
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: __init__
+    :synopsis: module that contains the response compression.
+"""
+
+import os
+import gzip
+import mmap
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import (
+    Hashable,
+    Union
+)
+
+from tornado.ioloop import IOLoop
+
+try:
+    import brotli
+except ModuleNotFoundError:
+    brotli = None
+
+COMPRESSION_THRESHOLD = int(os.environ.get('MOCKINTOSH_COMPRESSION_THRESHOLD', 1024))
+COMPRESSION_LEVEL = int(os.environ.get('MOCKINTOSH_COMPRESSION_LEVEL', 6))
+COMPRESSION_CACHE_SIZE = int(os.environ.get('MOCKINTOSH_COMPRESSION_CACHE_SIZE', 16 * 1024 * 1024))
+COMPRESSION_OFFLOAD_THRESHOLD = int(os.environ.get('MOCKINTOSH_COMPRESSION_OFFLOAD_THRESHOLD', 256 * 1024))
+COMPRESSION_MAX_SIZE = int(os.environ.get('MOCKINTOSH_COMPRESSION_MAX_SIZE', 8 * 1024 * 1024))
+
+
+def _encodings() -> tuple:
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding: Union[str, None]) -> Union[str, None]:
+    """Picks the supported content coding with the highest quality in an `Accept-Encoding` header."""
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    encodings = _encodings()
+    best = None
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[0]):
+            best = (quality, encoding)
+    return None if best is None else best[1]
+
+
+class EncodingStats:
+
+    def __init__(self):
+        self.reset()
+
+    def json(self) -> dict:
+        return {
+            'count': self.count,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.bytes_out / self.bytes_in if self.bytes_in != 0 else 0,
+            'cpu_time': self.cpu_time
+        }
+
+    def reset(self) -> None:
+        self.count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+
+
+class Compressor:
+    """Compresses the response bodies and keeps the results of the static ones in a byte-bounded LRU cache.
+
+    `compress_async()` compresses the bodies of `offload_threshold` bytes or more in an executor, so that
+    large templated bodies and the first request of a large external file do not block the IOLoop. The
+    concurrent requests of the same uncached body wait for a single compression. The bodies larger than
+    `max_size` are left to be served uncompressed.
+    """
+
+    def __init__(
+        self,
+        threshold: int,
+        level: int,
+        cache_size: int,
+        offload_threshold: int = COMPRESSION_OFFLOAD_THRESHOLD,
+        max_size: int = COMPRESSION_MAX_SIZE
+    ):
+        self.threshold = threshold
+        self.level = level
+        self.cache_size = cache_size
+        self.offload_threshold = offload_threshold
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.stats = {encoding: EncodingStats() for encoding in ('br', 'gzip')}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def compressible(self, data: Union[str, bytes, mmap.mmap]) -> bool:
+        """Tells whether `data` is large enough to be worth compressing and small enough to be compressed at once."""
+        return self.threshold <= len(data) <= self.max_size
+
+    def _compress(self, data: Union[str, bytes, mmap.mmap], encoding: str) -> bytes:
+        if isinstance(data, str):
+            data = data.encode()
+        start = time.thread_time()
+        if encoding == 'br':
+            compressed = brotli.compress(data if isinstance(data, bytes) else data[:], quality=min(self.level, 11))
+        else:
+            compressed = gzip.compress(data, compresslevel=min(self.level, 9), mtime=0)
+        cpu_time = time.thread_time() - start
+        with self.lock:
+            stats = self.stats[encoding]
+            stats.count += 1
+            stats.bytes_in += len(data)
+            stats.bytes_out += len(compressed)
+            stats.cpu_time += cpu_time
+        return compressed
+
+    def cached(self, cache_key: Union[Hashable, None], encoding: str) -> Union[bytes, None]:
+        """Returns the cached compressed form of the data identified by `cache_key`, if there is one."""
+        if cache_key is None:
+            return None
+        key = (cache_key, encoding)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def compress(self, data: Union[str, bytes, mmap.mmap], encoding: str, cache_key: Union[Hashable, None] = None) -> bytes:
+        """Compresses `data` with `encoding`; the result is cached if a `cache_key` identifies the data."""
+        if cache_key is None:
+            return self._compress(data, encoding)
+
+        compressed = self.cached(cache_key, encoding)
+        if compressed is not None:
+            return compressed
+        with self.lock:
+            self.misses += 1
+
+        compressed = self._compress(data, encoding)
+
+        key = (cache_key, encoding)
+        if len(compressed) <= self.cache_size:
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = compressed
+                    self.size += len(compressed)
+                while self.size > self.cache_size:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return compressed
+
+    async def compress_async(
+        self,
+        data: Union[str, bytes, mmap.mmap],
+        encoding: str,
+        cache_key: Union[Hashable, None] = None,
+        executor: Union[Executor, None] = None
+    ) -> bytes:
+        """Same as `compress()` but a large body that is not cached is compressed in `executor`.
+
+        The default executor of the IOLoop is used if `executor` is `None`.
+        """
+        if len(data) < self.offload_threshold:
+            return self.compress(data, encoding, cache_key=cache_key)
+        compressed = self.cached(cache_key, encoding)
+        if compressed is not None:
+            return compressed
+        if cache_key is None:
+            return await IOLoop.current().run_in_executor(executor, self._compress, data, encoding)
+
+        key = (cache_key, encoding)
+        future = self.pending.get(key, None)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            compressed = await IOLoop.current().run_in_executor(executor, self.compress, data, encoding, cache_key)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case there is no one waiting for it
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(compressed)
+            return compressed
+        finally:
+            del self.pending[key]
+
+    def json(self) -> dict:
+        data = {encoding: stats.json() for encoding, stats in self.stats.items() if encoding in _encodings()}
+        data['cache'] = {
+            'entries': len(self.entries),
+            'size': self.size,
+            'max_size': self.cache_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced
+        }
+        return data
+
+    def reset(self) -> None:
+        for stats in self.stats.values():
+            stats.reset()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+
+compressor = Compressor(COMPRESSION_THRESHOLD, COMPRESSION_LEVEL, COMPRESSION_CACHE_SIZE)
@@ -177,7 +177,7 @@ class ConfigResponse(BaseModel):
 
 class ConfigMultiResponse(BaseModel):
     """Configuration for multiple responses."""
-    responses: List[ConfigResponse] = Field(default_factory=list, alias='response')
+    payload: List[Union[ConfigResponse, ConfigExternalFilePath, str]] = Field(default_factory=list)
 
 
 class ConfigEndpoint(BaseModel):
@@ -194,6 +194,68 @@ class ConfigEndpoint(BaseModel):
     multi_responses_looped: bool = True
     dataset_looped: bool = True
     performance_profile: Optional[str] = None
+    compress: Optional[bool] = None
+    weak_etag: Optional[bool] = None
+
+
+class ConfigFallbackToCache(BaseModel):
+    """Configuration for the record-and-replay cache of an upstream."""
+    ttl: float = 0
+    max_size: int = 16 * 1024 * 1024
+    key_headers: List[str] = Field(default_factory=list)
+    key_body: bool = True
+    path: Optional[str] = None
+
+
+class ConfigFallbackToCircuitBreaker(BaseModel):
+    """Configuration for the circuit breaker of an upstream."""
+    failure_threshold: int = 5
+    error_rate: float = 0.5
+    min_requests: int = 20
+    window: float = 10
+    open_duration: float = 30
+
+
+class ConfigFallbackTo(BaseModel):
+    """Configuration for the upstream that unhandled requests are forwarded to."""
+    url: str
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 5.0
+    connect_timeout: Optional[float] = None
+    read_timeout: Optional[float] = None
+    http2: bool = False
+    dns_cache_ttl: float = 0
+    stream: bool = False
+    coalesce: bool = True
+    cache: Optional[ConfigFallbackToCache] = None
+    circuit_breaker: Optional[ConfigFallbackToCircuitBreaker] = None
+    weight: int = 1
+
+
+class ConfigFallbackToGroup(BaseModel):
+    """Configuration for the upstreams that unhandled requests are balanced across."""
+    targets: List[ConfigFallbackTo]
+    strategy: str = 'roundRobin'
+    coalesce: bool = True
+    cache: Optional[ConfigFallbackToCache] = None
+
+    @field_validator('targets')
+    @classmethod
+    def validate_targets(cls, v):
+        """Validate that the cache and the coalescing are left to the group."""
+        for target in v:
+            if target.cache is not None or not target.coalesce:
+                raise ValueError("Cache and coalesce must be set on the group, not on its targets")
+        return v
+
+    @field_validator('strategy')
+    @classmethod
+    def validate_strategy(cls, v):
+        """Validate load balancing strategy."""
+        if v not in ['roundRobin', 'leastOutstanding', 'weighted']:
+            raise ValueError("Strategy must be one of: roundRobin, leastOutstanding, weighted")
+        return v
 
 
 class ConfigHttpService(BaseModel):
@@ -208,7 +270,9 @@ class ConfigHttpService(BaseModel):
     oas: Optional[Union[str, List[str], ConfigExternalFilePath]] = None
     endpoints: List[ConfigEndpoint] = []
     performance_profile: Optional[str] = None
-    fallback_to: Optional[str] = None
+    fallback_to: Optional[Union[ConfigFallbackTo, ConfigFallbackToGroup]] = None
+    compress: bool = False
+    weak_etag: bool = False
     internal_service_id: Optional[int] = None
     templating_engine: str = PYBARS
     
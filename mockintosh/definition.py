@@ -7,6 +7,7 @@
 """
 
 import os
+import re
 import sys
 import logging
 from collections import OrderedDict
@@ -24,7 +25,7 @@ import graphql
 from graphql import parse as graphql_parse
 from graphql.language.printer import print_ast as graphql_print_ast
 
-from mockintosh.constants import PROGRAM, WARN_GPUBSUB_PACKAGE, WARN_AMAZONSQS_PACKAGE
+from mockintosh.constants import PROGRAM, SPECIAL_CONTEXT, WARN_GPUBSUB_PACKAGE, WARN_AMAZONSQS_PACKAGE
 from mockintosh.builders import ConfigRootBuilder
 from mockintosh.helpers import _detect_engine, _urlsplit, _graphql_escape_templating, _graphql_undo_escapes
 from mockintosh.config import (
@@ -51,7 +52,8 @@ from mockintosh.recognizers import (
 from mockintosh.services.http import (
     HttpService,
     HttpEndpoint,
-    HttpBody
+    HttpBody,
+    HttpMatcher
 )
 from mockintosh.services.asynchronous.kafka import (  # noqa: F401
     KafkaService,
@@ -115,14 +117,23 @@ from mockintosh.exceptions import (
     UnrecognizedConfigFileFormat,
     AsyncProducerListQueueMismatch
 )
-from mockintosh.templating import RenderingQueue
+from mockintosh.templating import RenderingQueue, template_caches
+from mockintosh.files import file_cache
+from mockintosh.compression import compressor
+from mockintosh.upstreams import upstreams
 from mockintosh.stats import Stats
-from mockintosh.logs import Logs
+from mockintosh.logs import Logs, create_sink
 
 graphql.language.printer.MAX_LINE_LENGTH = -1
 
 stats = Stats()
-logs = Logs()
+stats.add_component('template_cache', template_caches)
+stats.add_component('file_cache', file_cache)
+stats.add_component('compression', compressor)
+stats.add_component('upstreams', upstreams)
+logs = Logs(sink=create_sink())
+if logs.sink is not None:
+    stats.add_component('traffic_sink', logs.sink)
 
 
 class Definition:
@@ -347,6 +358,15 @@ class Definition:
                     is_grapql_query=True if graphql_query is not None else False
                 )
 
+            matchers = {
+                'headers': HttpMatcher.build_all(headers),
+                'queryString': HttpMatcher.build_all(query_string),
+                'bodyUrlencoded': HttpMatcher.build_all(None if http_body is None else http_body.urlencoded),
+                'bodyMultipart': HttpMatcher.build_all(None if http_body is None else http_body.multipart),
+                'graphqlVariables': HttpMatcher.build_all(None if http_body is None else http_body.graphql_variables)
+            }
+            self.compile_context_regexes(context)
+
             http_service.add_endpoint(
                 HttpEndpoint(
                     endpoint.id,
@@ -364,12 +384,27 @@ class Definition:
                     endpoint.dataset,
                     endpoint.response,
                     endpoint.multi_responses_looped,
-                    endpoint.dataset_looped
+                    endpoint.dataset_looped,
+                    matchers=matchers,
+                    compress=service.compress if endpoint.compress is None else endpoint.compress,
+                    weak_etag=service.weak_etag if endpoint.weak_etag is None else endpoint.weak_etag
                 )
             )
 
         return http_service
 
+    @staticmethod
+    def compile_context_regexes(context: OrderedDict) -> None:
+        """Stores the compiled pattern next to each `regEx` capture of the request components."""
+        for component in context.get(SPECIAL_CONTEXT, {}).values():
+            for value in component.values():
+                if not isinstance(value, dict) or value.get('type', None) != 'regex':
+                    continue
+                try:
+                    value['pattern'] = re.compile(value['regex'])
+                except re.error:
+                    pass
+
     def analyze_async_service(
         self,
         service: ConfigAsyncService
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: __init__
+    :synopsis: module that contains the live push of the management data to the UI.
+"""
+
+import os
+import json
+import asyncio
+import logging
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Union
+)
+
+from tornado.httputil import HTTPServerRequest
+
+MANAGEMENT_PUSH_INTERVAL = float(os.environ.get('MOCKINTOSH_MANAGEMENT_PUSH_INTERVAL', 1))
+MANAGEMENT_PUSH_BACKLOG = int(os.environ.get('MOCKINTOSH_MANAGEMENT_PUSH_BACKLOG', 100))
+MANAGEMENT_PUSH_TRAFFIC_LIMIT = int(os.environ.get('MOCKINTOSH_MANAGEMENT_PUSH_TRAFFIC_LIMIT', 1000))
+KEEP_ALIVE_INTERVAL = 15
+
+_SAME = object()
+
+
+def diff(old, new):
+    """Returns the JSON merge patch that turns `old` into `new`, or `_SAME` if they are equal.
+
+    Unlike RFC 7396, the lists of the same length are patched item by item with their indexes as keys.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        patch = {}
+        for key, value in new.items():
+            if key not in old:
+                patch[key] = value
+                continue
+            item = diff(old[key], value)
+            if item is not _SAME:
+                patch[key] = item
+        for key in old:
+            if key not in new:
+                patch[key] = None
+        return patch if patch else _SAME
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        patch = {}
+        for i, (old_item, new_item) in enumerate(zip(old, new)):
+            item = diff(old_item, new_item)
+            if item is not _SAME:
+                patch[str(i)] = item
+        return patch if patch else _SAME
+    return _SAME if old == new else new
+
+
+def _event(topic: str, data: dict) -> bytes:
+    return ('event: %s\ndata: %s\n\n' % (topic, json.dumps(data))).encode()
+
+
+class Subscriber:
+    """A UI connected to the push channel, with the events waiting to be sent to it."""
+
+    def __init__(self, request: HTTPServerRequest, topics: List[str], since: Union[str, None] = None):
+        self.request = request
+        self.topics = topics
+        self.cursor = since if since else ''
+        # Without a cursor, the first traffic event carries the whole traffic log
+        self.reset = not since
+        self.synced = set()
+        self.enabled = None
+        self.queue = asyncio.Queue(maxsize=MANAGEMENT_PUSH_BACKLOG)
+        self.closed = False
+
+    def restart(self) -> None:
+        """Makes the next traffic event replace the records of the UI, e.g. after the traffic log is cleared."""
+        self.cursor = ''
+        self.reset = True
+        self.enabled = None
+
+    def send(self, message: bytes) -> None:
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A UI that cannot keep up is disconnected, `EventSource` reconnects and starts over
+            logging.debug('Disconnecting a management UI that does not keep up with the events.')
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventHub:
+    """Pushes the changes of the management data to the subscribed UIs.
+
+    Every `interval` seconds, as long as a UI is subscribed, the data of each subscribed topic is
+    collected once and compared with the previous collection. The `states` topics push a merge patch
+    of what changed (a snapshot to the new subscribers) and `traffic` pushes the traffic log records
+    added since the cursor of the subscriber; the subscribers at the same cursor share the query. The
+    events are encoded once for all of their subscribers, so the cost of a tick does not grow with the
+    number of open UIs.
+
+    A traffic event carries at most the `traffic_limit` most recent records, which is also the number of
+    records a UI keeps. When the `traffic_resets` counter changes, the traffic log was cleared and the
+    next traffic event of every subscriber replaces its records.
+    """
+
+    def __init__(
+        self,
+        states: Dict[str, Callable[[HTTPServerRequest], Awaitable[dict]]],
+        traffic: Callable[[HTTPServerRequest, str, int], Awaitable[dict]],
+        interval: float = MANAGEMENT_PUSH_INTERVAL,
+        traffic_limit: int = MANAGEMENT_PUSH_TRAFFIC_LIMIT,
+        traffic_resets: Union[Callable[[], int], None] = None
+    ):
+        self.states = states
+        self.traffic = traffic
+        self.interval = interval
+        self.traffic_limit = traffic_limit
+        self.traffic_resets = traffic_resets
+        self.resets = traffic_resets() if traffic_resets is not None else 0
+        self.subscribers = []
+        self.last = {}
+        self.task = None
+
+    @property
+    def topics(self) -> tuple:
+        return tuple(self.states) + ('traffic',)
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.append(subscriber)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        subscriber.close()
+
+    async def _run(self) -> None:
+        try:
+            while self.subscribers:
+                try:
+                    await self.tick()
+                except Exception as e:  # pragma: no cover
+                    logging.warning('Could not collect the management events: %s', e)
+                await asyncio.sleep(self.interval)
+        finally:
+            self.task = None
+            self.last.clear()
+
+    async def tick(self) -> None:
+        subscribers = [subscriber for subscriber in self.subscribers if not subscriber.closed]
+        if not subscribers:
+            return
+        # Any open request serves as the template of the requests to the other workers
+        request = subscribers[0].request
+
+        for topic, collect in self.states.items():
+            watchers = [subscriber for subscriber in subscribers if topic in subscriber.topics]
+            if not watchers:
+                self.last.pop(topic, None)
+                continue
+            state = await collect(request)
+            patch = diff(self.last[topic], state) if topic in self.last else _SAME
+            self.last[topic] = state
+            snapshot = message = None
+            for subscriber in watchers:
+                if topic not in subscriber.synced:
+                    snapshot = snapshot or _event(topic, {'snapshot': state})
+                    subscriber.send(snapshot)
+                    subscriber.synced.add(topic)
+                elif patch is not _SAME:
+                    message = message or _event(topic, {'patch': patch})
+                    subscriber.send(message)
+
+        resets = self.traffic_resets() if self.traffic_resets is not None else 0
+        if resets != self.resets:
+            self.resets = resets
+            for subscriber in self.subscribers:
+                subscriber.restart()
+
+        groups = {}
+        for subscriber in subscribers:
+            if 'traffic' in subscriber.topics:
+                groups.setdefault(subscriber.cursor, []).append(subscriber)
+        for cursor, members in groups.items():
+            log = (await self.traffic(request, cursor, self.traffic_limit))['log']
+            # The records of the workers are merged, keep the most recent ones of all of them
+            entries = log['entries'][-self.traffic_limit:]
+            messages = {}
+            for subscriber in members:
+                if subscriber.enabled is None or entries or subscriber.enabled != log['_enabled']:
+                    reset = subscriber.enabled is None and subscriber.reset
+                    if reset not in messages:
+                        messages[reset] = _event('traffic', {
+                            'reset': reset,
+                            'enabled': log['_enabled'],
+                            'limit': self.traffic_limit,
+                            'entries': entries
+                        })
+                    subscriber.send(messages[reset])
+                subscriber.cursor = log['_cursor']
+                subscriber.enabled = log['_enabled']
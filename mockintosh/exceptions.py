@@ -80,3 +80,12 @@ class InternalResourcePathCheckError(Exception):
 
     def __init__(self):
         super().__init__(None)
+
+
+class UpstreamCircuitOpen(Exception):
+    """Raised in case of a request is sent to a `fallbackTo` upstream while its circuit breaker is open.
+    """
+
+    def __init__(self, url, retry_after):
+        self.retry_after = retry_after
+        super().__init__('Circuit breaker is open for upstream: %s' % url)
@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: __init__
+    :synopsis: module that contains the cache of the files read while serving requests.
+"""
+
+import os
+import json
+import stat as _stat
+import hashlib
+import mmap
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Tuple,
+    Union
+)
+
+FILE_CACHE_SIZE = int(os.environ.get('MOCKINTOSH_FILE_CACHE_SIZE', 64 * 1024 * 1024))
+FILE_CACHE_MMAP_THRESHOLD = int(os.environ.get('MOCKINTOSH_FILE_CACHE_MMAP_THRESHOLD', 1024 * 1024))
+FILE_CACHE_CHECK_INTERVAL = float(os.environ.get('MOCKINTOSH_FILE_CACHE_CHECK_INTERVAL', 1))
+FILE_CACHE_MMAP_ENTRIES = int(os.environ.get('MOCKINTOSH_FILE_CACHE_MMAP_ENTRIES', 64))
+
+
+class FileCacheEntry:
+
+    def __init__(self, signature: tuple, value: Any, size: int, checked_at: float, mapped: bool = False):
+        self.signature = signature
+        self.value = value
+        self.size = size
+        self.checked_at = checked_at
+        self.mapped = mapped
+        self.etag = None
+
+
+class FileCache:
+    """LRU cache of file contents bounded by the total size in bytes.
+
+    An entry is revalidated against the inode, size and modification time of the file at most once per
+    `check_interval` seconds, so a hot file costs no system calls in between. Binary files larger than
+    `mmap_threshold` are memory-mapped and do not count against the byte budget; since every mapping
+    holds a file descriptor, at most `mmap_max_entries` of them are kept. An evicted mapping is closed by
+    the garbage collector once the responses streaming from it are done.
+    """
+
+    def __init__(self, max_size: int, mmap_threshold: int, check_interval: float, mmap_max_entries: int = FILE_CACHE_MMAP_ENTRIES):
+        self.max_size = max_size
+        self.mmap_threshold = mmap_threshold
+        self.check_interval = check_interval
+        self.mmap_max_entries = mmap_max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+        self.mapped = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _signature(stat: os.stat_result) -> tuple:
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _lookup(self, key: tuple) -> Union[FileCacheEntry, None]:
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+            now = time.monotonic()
+            if now - entry.checked_at < self.check_interval:
+                self.entries.move_to_end(key)
+                return entry
+
+        try:
+            signature = self._signature(os.stat(key[0]))
+        except OSError:
+            signature = None
+
+        with self.lock:
+            if signature != entry.signature:
+                self._remove(key)
+                return None
+            entry.checked_at = now
+            self.entries.move_to_end(key)
+            return entry
+
+    def _remove(self, key: tuple) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+            self.mapped -= entry.mapped
+
+    def _store(self, key: tuple, entry: FileCacheEntry) -> None:
+        if entry.size > self.max_size or (entry.mapped and self.mmap_max_entries <= 0):
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = entry
+            self.size += entry.size
+            self.mapped += entry.mapped
+            while self.size > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+            if self.mapped > self.mmap_max_entries:
+                self._remove(next(mapped_key for mapped_key, item in self.entries.items() if item.mapped))
+                self.evictions += 1
+
+    def get(self, path: str, kind: str, load: Callable[[Union[bytes, mmap.mmap]], Any]) -> Any:
+        """Returns `load()` applied on the contents of the file at `path`, cached per `kind` of value."""
+        key = (path, kind)
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry.value
+        self.misses += 1
+
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            if self.mmap_threshold > 0 and stat.st_size >= self.mmap_threshold:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = file.read()
+        logging.debug('Read file into the cache: %s', path)
+
+        value = load(data)
+        mapped = isinstance(data, mmap.mmap) and (
+            value is data or (isinstance(value, tuple) and any(item is data for item in value))
+        )
+        if isinstance(data, mmap.mmap) and not mapped:
+            data.close()
+        size = 0 if mapped else stat.st_size
+        self._store(key, FileCacheEntry(self._signature(stat), value, size, time.monotonic(), mapped))
+        return value
+
+    def is_file(self, path: str) -> bool:
+        """Tells whether `path` is a regular file, revalidated at most once per `check_interval` like the contents."""
+        key = (path, 'stat')
+        if self._lookup(key) is not None:
+            return True
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if not _stat.S_ISREG(stat.st_mode):
+            return False
+        # The path stands for the size of the entry, so that the checked paths are bounded by the byte budget
+        self._store(key, FileCacheEntry(self._signature(stat), True, len(path), time.monotonic()))
+        return True
+
+    def read_bytes(self, path: str) -> Union[bytes, mmap.mmap]:
+        return self.get(path, 'bytes', lambda data: data)
+
+    def read_text(self, path: str) -> Tuple[Union[str, bytes, mmap.mmap], bool]:
+        """Returns the decoded text of the file, or its bytes and `True` if it is binary."""
+        def load(data):
+            try:
+                return str(data, 'utf-8'), False
+            except UnicodeDecodeError:
+                return data, True
+        return self.get(path, 'text', load)
+
+    def read_json(self, path: str) -> Any:
+        """Returns the parsed JSON document, which is shared between the callers and must not be mutated."""
+        return self.get(path, 'json', lambda data: json.loads(data if isinstance(data, bytes) else data[:]))
+
+    def last_modified(self, path: str) -> Union[float, None]:
+        """Returns the modification time of a cached file as of its last validation."""
+        for kind in ('bytes', 'text', 'json'):
+            entry = self.entries.get((path, kind), None)
+            if entry is not None:
+                return entry.signature[2] / 1e9
+        return None
+
+    def etag(self, path: str) -> Union[str, None]:
+        """Returns the strong entity tag of a cached file, hashed once per version of the file."""
+        for kind in ('bytes', 'text'):
+            entry = self.entries.get((path, kind), None)
+            if entry is None:
+                continue
+            if entry.etag is None:
+                data = entry.value[0] if isinstance(entry.value, tuple) else entry.value
+                entry.etag = '"%s"' % hashlib.sha1(data.encode() if isinstance(data, str) else data).hexdigest()
+            return entry.etag
+        return None
+
+    def invalidate(self, path: Union[str, None] = None) -> None:
+        with self.lock:
+            for key in [key for key in self.entries if path is None or key[0] == path]:
+                self._remove(key)
+
+    def json(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'size': self.size,
+            'max_size': self.max_size,
+            'mapped': self.mapped,
+            'max_mapped': self.mmap_max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def reset(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+file_cache = FileCache(FILE_CACHE_SIZE, FILE_CACHE_MMAP_THRESHOLD, FILE_CACHE_CHECK_INTERVAL)
@@ -10,11 +10,16 @@ import json
 import logging
 import os
 import re
+import math
 import time
 import socket
 import struct
 import traceback
+import uuid
 import copy
+import email.utils
+import hashlib
+import mmap
 import threading
 from urllib.parse import quote_plus, urlparse, unquote
 from datetime import datetime, timezone
@@ -33,6 +38,7 @@ from accept_types import parse_header
 from tornado.concurrent import Future
 from tornado.http1connection import HTTP1Connection, HTTP1ServerConnection
 from tornado import httputil
+from tornado.iostream import StreamClosedError
 import graphql
 from graphql import parse as graphql_parse
 from graphql.language.printer import print_ast as graphql_print_ast
@@ -47,12 +53,14 @@ from mockintosh.config import (
     ConfigMultiResponse
 )
 from mockintosh.services.http import (
-    HttpAlternative
+    HttpAlternative,
+    HttpStaticResponse,
+    HttpRouteIndex
 )
 from mockintosh.replicas import Request, Response
 from mockintosh.hbs.methods import Random as hbs_Random, Date as hbs_Date
 from mockintosh.j2.methods import Random as j2_Random, Date as j2_Date
-from mockintosh.helpers import _detect_engine, _b64encode
+from mockintosh.helpers import _detect_engine, _b64encode, _parse_byte_ranges
 from mockintosh.params import (
     HeaderParam,
     QueryStringParam,
@@ -62,11 +70,17 @@ from mockintosh.params import (
 )
 from mockintosh.logs import Logs, LogRecord
 from mockintosh.stats import Stats
+from mockintosh.files import file_cache
+from mockintosh.compression import compressor, choose_encoding
+from mockintosh.state import counters
+from mockintosh.upstreams import Upstream, UpstreamGroup
+from mockintosh.recordings import CachedResponse
 from mockintosh.templating import TemplateRenderer, RenderingQueue
 from mockintosh.exceptions import (
     AsyncProducerListHasNoPayloadsMatchingTags,
     AsyncProducerPayloadLoopEnd,
-    AsyncProducerDatasetLoopEnd
+    AsyncProducerDatasetLoopEnd,
+    UpstreamCircuitOpen
 )
 
 OPTIONS = 'options'
@@ -98,7 +112,9 @@ IMAGE_EXTENSIONS = [
     '.webp'
 ]
 
-FALLBACK_TO_TIMEOUT = int(os.environ.get('MOCKINTOSH_FALLBACK_TO_TIMEOUT', 30))
+STREAM_THRESHOLD = int(os.environ.get('MOCKINTOSH_STREAM_THRESHOLD', 1024 * 1024))
+STREAM_CHUNK_SIZE = int(os.environ.get('MOCKINTOSH_STREAM_CHUNK_SIZE', 64 * 1024))
+FALLBACK_TO_RECORD_SIZE = int(os.environ.get('MOCKINTOSH_FALLBACK_TO_RECORD_SIZE', 64 * 1024))
 CONTENT_TYPE = 'Content-Type'
 
 graphql.language.printer.MAX_LINE_LENGTH = -1
@@ -109,8 +125,6 @@ j2_random = j2_Random()
 hbs_date = hbs_Date()
 j2_date = j2_Date()
 
-client = httpx.AsyncClient()
-
 __location__ = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -119,14 +133,6 @@ class NewHTTPError(Exception):
     pass
 
 
-class Counters:
-    def __init__(self):
-        self.data = {}
-
-
-counters = Counters()
-
-
 class BaseHandler:
 
     def __init__(self):
@@ -134,13 +140,13 @@ class BaseHandler:
         self.counters = counters
         self.replica_request = None
         self.replica_response = None
+        self.custom_endpoint_id = None
 
     def resolve_relative_path(self, source_text: str) -> Tuple[str, str]:
         """Method to resolve the relative path (relative to the config file)."""
         orig_relative_path = source_text[1:]
 
         orig_relative_path, context = self.common_template_renderer(self.definition_engine, orig_relative_path)
-        self.populate_counters(context)
 
         if orig_relative_path[0] == '/':
             orig_relative_path = orig_relative_path[1:]
@@ -148,6 +154,26 @@ class BaseHandler:
 
     def common_template_renderer(self, template_engine: str, text: str) -> Tuple[str, dict]:
         """Common method to initialize `TemplateRenderer` and call `render()`."""
+        renderer = TemplateRenderer()
+        return renderer.render(
+            template_engine,
+            text,
+            self.rendering_queue,
+            **self.common_template_renderer_kwargs(template_engine)
+        )
+
+    async def common_template_renderer_async(self, template_engine: str, text: str) -> Tuple[str, dict]:
+        """Awaitable version of `common_template_renderer()`."""
+        renderer = TemplateRenderer()
+        return await renderer.render_async(
+            template_engine,
+            text,
+            self.rendering_queue,
+            **self.common_template_renderer_kwargs(template_engine)
+        )
+
+    def common_template_renderer_kwargs(self, template_engine: str) -> dict:
+        """Method that prepares the objects and methods to be injected into the templates."""
         if template_engine == PYBARS:
             from mockintosh.hbs.methods import fake, counter, json_path, escape_html, env
             self.custom_context['random'] = hbs_random
@@ -157,11 +183,7 @@ class BaseHandler:
             self.custom_context['random'] = j2_random
             self.custom_context['date'] = j2_date
 
-        renderer = TemplateRenderer()
-        return renderer.render(
-            template_engine,
-            text,
-            self.rendering_queue,
+        return dict(
             inject_objects=self.custom_context,
             inject_methods=[
                 fake,
@@ -174,12 +196,6 @@ class BaseHandler:
             counters=self.counters
         )
 
-    def populate_counters(self, context: [None, dict]) -> None:
-        """Method that retrieves counters from template engine contexts."""
-        if SPECIAL_CONTEXT in context and 'counters' in context[SPECIAL_CONTEXT]:
-            for key, value in context[SPECIAL_CONTEXT]['counters'].items():
-                self.counters.data[key] = value
-
     def analyze_counters(self) -> None:
         """Method that injects counters into template engine contexts."""
         for key, value in self.counters.data.items():
@@ -195,8 +211,8 @@ class BaseHandler:
         server_connection: Union[HTTP1ServerConnection, None]
     ) -> LogRecord:
         """Method that creates a log record and inserts it to log tracking system."""
-        if not self.logs.services[self.service_id].is_enabled():
-            logging.debug('Not logging the request because logging is disabled.')
+        if not self.logs.services[self.service_id].should_record():
+            logging.debug('Not logging the request because logging is disabled or the request is not sampled.')
             return
 
         log_record = LogRecord(
@@ -205,7 +221,8 @@ class BaseHandler:
             elapsed_time_in_milliseconds,
             self.replica_request,
             self.replica_response,
-            server_connection
+            server_connection,
+            endpoint_id=self.custom_endpoint_id
         )
         self.logs.services[self.service_id].add_record(log_record)
 
@@ -265,13 +282,15 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         )
         self.set_default_headers()
         self._write_buffer = []
+        self.body_size = 0
         self._status_code = 200
         self._reason = httputil.responses[200]
 
     def write(self, chunk: Union[str, bytes, dict]) -> None:
         super().write(chunk)
+        self.body_size += len(self._write_buffer[-1])
         if self.replica_response is not None:
-            self.replica_response.bodySize = len(b"".join(self._write_buffer))
+            self.replica_response.bodySize = self.body_size
 
     def set_elapsed_time(self, elapsed_time_in_seconds: float) -> None:
         """Method to calculate and store the elapsed time of the request handling to be used in stats."""
@@ -285,12 +304,13 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         config_dir: str,
         service_id: int,
         path_methods: Tuple[str, Dict[str, HttpAlternative]],
+        route_index: HttpRouteIndex,
         _globals: dict,
         definition_engine: str,
         rendering_queue: RenderingQueue,
         interceptors: list,
         unhandled_data: None,
-        fallback_to: Union[str, None],
+        fallback_to: Union[Upstream, UpstreamGroup, None],
         tags: list
     ) -> None:
         """Overriden method of tornado.web.RequestHandler"""
@@ -304,20 +324,17 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
             self.logs = self.http_server.definition.logs
             self.service_id = service_id
             self.internal_endpoint_id = None
+            self.custom_endpoint_id = None
             self.unhandled_data = unhandled_data
             self.fallback_to = fallback_to
             self.tags = tags
             self.alternative = None
+            self.multi_responses_index = 0
+            self.file_body_path = None
 
-            for path, methods in self.path_methods:
-                if re.fullmatch(path, self.request.path):
-                    groups = re.findall(path, self.request.path)
-                    if isinstance(groups[0], tuple):
-                        self.custom_args = groups[0]
-                    elif isinstance(groups, list) and groups:
-                        self.custom_args = tuple(groups)
-                    self.methods = {k.lower(): v for k, v in methods.items()}
-                    break
+            route = route_index.lookup(self.request.path)
+            if route is not None:
+                self.methods, self.custom_args = route
 
             self.alternatives = None
             self.globals = _globals
@@ -363,21 +380,38 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
             self.custom_dataset = dataset
             self.performance_profile = performance_profile
 
+            static_response = None if self.interceptors else self.alternative.get_static_response(self.multi_responses_index)
+            if static_response is not None:
+                self.log_request()
+                self.write_static_response(static_response)
+                return
+
             self.populate_context(*args)
-            self.determine_status_code()
-            self.determine_headers()
+            await self.determine_status_code()
+            await self.determine_headers()
             self.log_request()
 
             if response.trigger_async_producer is not None:
                 self.trigger_async_producer(response.trigger_async_producer)
 
-            self.rendered_body = self.render_template()
+            body = await self.render_template()
 
-            if self.rendered_body is None:
+            if body is None:
+                return
+            if isinstance(body, mmap.mmap) and self.interceptors:
+                body = body[:]
+            # A memory-mapped file is streamed from the mapping and left out of the traffic log
+            self.rendered_body = b'' if isinstance(body, mmap.mmap) else body
+            if self.is_not_modified(self.set_validators(body)):
+                self.write_not_modified()
                 return
+            ranges = self.determine_byte_ranges(body) if self.should_write() else None
             self.replica_response = self.build_replica_response()
             if self.should_write():
-                self.write(self.rendered_body)
+                if ranges is None:
+                    await self.write_body(await self.compress_body(body))
+                else:
+                    await self.write_byte_ranges(body, ranges)
         except NewHTTPError:
             return
         except Exception as e:  # pragma: no cover
@@ -454,6 +488,8 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
 
     def log_request(self) -> None:
         """Method that logs the request."""
+        if not logging.getLogger().isEnabledFor(logging.DEBUG):
+            return
         logging.debug('Received request:\n%s', self._request_object_to_dict(self.request))
 
     def add_params(self, context: [None, dict]) -> [None, dict]:
@@ -489,7 +525,7 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
                 context[key] = self.request.files[param.key][0].body.decode()
         return context
 
-    def render_template(self) -> str:
+    async def render_template(self) -> str:
         """Method that handles response template rendering."""
         is_binary = False
         template_engine = _detect_engine(self.custom_response, 'response', default=self.definition_engine)
@@ -500,23 +536,23 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
 
         if isinstance(source_text, ConfigExternalFilePath):
             template_path, _ = self.resolve_relative_path(source_text.path)
-            with open(template_path, 'rb') as file:
-                logging.debug('Reading external file from path: %s', template_path)
-                source_text = file.read()
-                try:
-                    source_text = source_text.decode()
-                    logging.debug('Template file text: %s', source_text)
-                except UnicodeDecodeError:
-                    is_binary = True
-                    logging.debug('Template file is binary. Templating disabled.')
+            logging.debug('Reading external file from path: %s', template_path)
+            if not self.custom_response.use_templating:
+                source_text, is_binary = file_cache.read_bytes(template_path), True
+            else:
+                source_text, is_binary = file_cache.read_text(template_path)
+            if is_binary:
+                self.file_body_path = template_path
+                logging.debug('Template file is binary or templating is disabled.')
+            else:
+                logging.debug('Template file text: %s', source_text)
 
         compiled = None
         context = None
         if is_binary or not self.custom_response.use_templating:
             compiled = source_text
         else:
-            compiled, context = self.common_template_renderer(template_engine, source_text)
-            self.populate_counters(context)
+            compiled, context = await self.common_template_renderer_async(template_engine, source_text)
 
         if not is_binary:
             logging.debug('Render output: %s', compiled)
@@ -600,6 +636,7 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         if not hasattr(self, 'rendered_body'):
             self.rendered_body = None
         response.body = self.rendered_body
+        response.bodySize = self.body_size
 
         return response
 
@@ -609,21 +646,21 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         self._headers = self.replica_response.headers
         self.rendered_body = self.replica_response.body
         self._write_buffer = []
+        self.body_size = 0
         if self.rendered_body is None:
             self.rendered_body = ''
         if self.should_write():
             self.write(self.rendered_body)
 
-    def determine_status_code(self) -> None:
+    async def determine_status_code(self) -> None:
         """Method to determine the status code of the response."""
         status_code = None
         if self.custom_response.status is not None:
             if isinstance(self.custom_response.status, str):
-                compiled, context = self.common_template_renderer(
+                compiled, context = await self.common_template_renderer_async(
                     self.definition_engine,
                     self.custom_response.status
                 )
-                self.populate_counters(context)
                 try:
                     status_code = int(compiled)
                 except ValueError:
@@ -634,7 +671,7 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
             status_code = 200
 
         if self.performance_profile is not None:
-            status_code = self.performance_profile.trigger(status_code)
+            status_code = await self.performance_profile.trigger_async(status_code)
 
         if isinstance(status_code, str) and status_code.lower() == 'rst':
             self.request.server_connection.stream.socket.setsockopt(
@@ -679,7 +716,7 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         if _key in payload or component == 'bodyText':
             if value['type'] == 'regex':
                 match_string = None
-                regex = value['regex']
+                pattern = value['pattern'] if 'pattern' in value else re.compile(value['regex'])
                 if component == 'headers':
                     match_string = self.request.headers.get(key)
                 elif component == 'queryString':
@@ -687,7 +724,8 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
                 elif component == 'bodyText':
                     match_string = payload
                     if self.alternative is not None and self.alternative.body is not None:
-                        regex = self.alternative.body.text
+                        body = self.alternative.body
+                        pattern = body.text_pattern if body.text_pattern is not None else re.compile(body.text)
                     if self.alternative.body.is_graphql_query:
                         json_data = json.loads(payload)
                         logging.debug('[inject] GraphQL original request:\n%s', json_data['query'])
@@ -703,13 +741,13 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
                 elif component == 'bodyMultipart':
                     match_string = self.request.files[key][0].body.decode()
 
-                match = re.search(regex, match_string)
+                match = pattern.search(match_string)
                 if match is not None:
                     for i, key in enumerate(value['args']):
                         self.custom_context[key] = match.group(i + 1)
 
-    def determine_headers(self) -> None:
-        """Method to determine the headers of the response."""
+    def set_endpoint_and_global_headers(self) -> None:
+        """Method that sets the endpoint ID header and the global headers."""
         if self.custom_endpoint_id is not None:
             self.set_header('x-%s-endpoint-id' % PROGRAM.lower(), self.custom_endpoint_id)
 
@@ -717,6 +755,10 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
             for key, value in self.globals['headers'].items():
                 self.set_header(key, value)
 
+    async def determine_headers(self) -> None:
+        """Method to determine the headers of the response."""
+        self.set_endpoint_and_global_headers()
+
         if self.custom_response.headers is None:
             return
 
@@ -730,8 +772,7 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
 
             new_value_list = []
             for value in value_list:
-                new_value, context = self.common_template_renderer(self.definition_engine, value)
-                self.populate_counters(context)
+                new_value, context = await self.common_template_renderer_async(self.definition_engine, value)
                 new_value_list.append(new_value)
 
             for value in new_value_list:
@@ -742,6 +783,211 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
                 else:
                     self.set_header(key, value)
 
+    async def write_body(self, body: Union[str, bytes, mmap.mmap]) -> None:
+        """Method that writes the response body, in flushed chunks if it is large.
+
+        Interceptors need the whole body, so the chunks are only used without them.
+        """
+        if self.interceptors or (not isinstance(body, mmap.mmap) and len(body) < STREAM_THRESHOLD):
+            self.write(body)
+            return
+
+        if isinstance(body, str):
+            body = body.encode()
+        await self.write_slices([(body, 0, len(body))])
+
+    async def write_slices(self, slices: list) -> None:
+        """Method that streams the `(data, start, end)` slices as the response body in flushed chunks."""
+        self.set_header('Content-Length', sum(end - start for _, start, end in slices))
+        if self.request.method == 'HEAD':
+            return
+
+        try:
+            for data, start, end in slices:
+                for offset in range(start, end, STREAM_CHUNK_SIZE):
+                    self.write(data[offset:min(offset + STREAM_CHUNK_SIZE, end)])
+                    await self.flush()
+        except StreamClosedError:
+            logging.debug('Client closed the connection while streaming the response body.')
+
+    def determine_byte_ranges(self, body: Union[str, bytes, mmap.mmap]) -> Union[list, None]:
+        """Method that decides whether the `Range` header of the request applies to an external file body.
+
+        Returns the ranges to be sent with `206`, an empty list for `416` or `None` for the whole body.
+        """
+        if self.file_body_path is None or self.interceptors or self._status_code != 200:
+            return None
+        self.set_header('Accept-Ranges', 'bytes')
+
+        range_header = self.request.headers.get('Range', None)
+        if range_header is None or self.request.method not in ('GET', 'HEAD') or not self.is_if_range_fresh():
+            return None
+        ranges = _parse_byte_ranges(range_header, len(body))
+        if ranges is None:
+            return None
+
+        if not ranges:
+            self.set_status(416)
+            self.set_header('Content-Range', 'bytes */%d' % len(body))
+        else:
+            self.set_status(206)
+        return ranges
+
+    def is_if_range_fresh(self) -> bool:
+        """Method that tells whether the validator in the `If-Range` header still matches the file."""
+        if_range = self.request.headers.get('If-Range', None)
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            etag = self._headers.get('Etag', None)
+            return etag is not None and not if_range.startswith('W/') and if_range == etag
+
+        last_modified = file_cache.last_modified(self.file_body_path)
+        try:
+            date = email.utils.parsedate_to_datetime(if_range)
+        except (TypeError, ValueError):
+            return False
+        return last_modified is not None and int(last_modified) == int(date.timestamp())
+
+    async def write_byte_ranges(self, body: Union[str, bytes, mmap.mmap], ranges: list) -> None:
+        """Method that writes the ranges of the body with `206`, as `multipart/byteranges` if there are several."""
+        size = len(body)
+        if not ranges:
+            return
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.set_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, size))
+            await self.write_slices([(body, start, end)])
+            return
+
+        boundary = uuid.uuid4().hex
+        content_type = self._headers.get(CONTENT_TYPE, 'application/octet-stream')
+        self.set_header(CONTENT_TYPE, 'multipart/byteranges; boundary=%s' % boundary)
+        slices = []
+        for start, end in ranges:
+            part_headers = (
+                '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+                    boundary, content_type, start, end - 1, size
+                )
+            ).encode()
+            slices.append((part_headers, 0, len(part_headers)))
+            slices.append((body, start, end))
+        closing = ('\r\n--%s--\r\n' % boundary).encode()
+        slices.append((closing, 0, len(closing)))
+        await self.write_slices(slices)
+
+    def write_static_response(self, static_response: HttpStaticResponse) -> None:
+        """Method that writes a pre-encoded response without populating the context or rendering."""
+        self.set_status(static_response.status)
+        self.set_endpoint_and_global_headers()
+        for key, value in static_response.headers:
+            self.set_header(key, value)
+
+        self.rendered_body = static_response.text
+        if static_response.body is not None:
+            body = static_response.body
+            encoding = self.determine_content_encoding()
+            if self.is_not_modified(static_response.last_modified):
+                self.write_not_modified()
+                return
+            if encoding is not None and compressor.compressible(body):
+                body = compressor.compress(body, encoding, cache_key=static_response)
+                self.set_content_encoding(encoding)
+            self.write(body)
+
+    def set_validators(self, body: Union[str, bytes, mmap.mmap]) -> Union[float, None]:
+        """Method that sets the `Etag` and `Last-Modified` headers of a `200` response.
+
+        External file bodies get the strong entity tag and modification time kept in the file cache, the
+        other bodies get a weak entity tag of the rendered bytes if the alternative enables `weakEtag`.
+        Returns the modification time to compare `If-Modified-Since` with.
+        """
+        if self.interceptors or self._status_code != 200 or not self.should_write():
+            return None
+
+        if self.file_body_path is not None:
+            # Files left out of the cache have no precomputed validators
+            etag = file_cache.etag(self.file_body_path)
+            last_modified = file_cache.last_modified(self.file_body_path)
+            if etag is not None and 'Etag' not in self._headers:
+                self.set_header('Etag', etag)
+            if last_modified is not None and 'Last-Modified' not in self._headers:
+                self.set_header('Last-Modified', httputil.format_timestamp(last_modified))
+            return last_modified
+
+        if self.alternative.weak_etag and 'Etag' not in self._headers:
+            data = body.encode() if isinstance(body, str) else body
+            self.set_header('Etag', 'W/"%s"' % hashlib.sha1(data).hexdigest())
+        return None
+
+    def is_not_modified(self, last_modified: Union[float, None]) -> bool:
+        """Method that evaluates the `If-None-Match` or else the `If-Modified-Since` header of a `GET` or
+        `HEAD` request against the validators of a `200` response."""
+        if self.interceptors or self._status_code != 200 or self.request.method not in ('GET', 'HEAD'):
+            return False
+        if 'If-None-Match' in self.request.headers:
+            return self.check_etag_header()
+
+        if_modified_since = self.request.headers.get('If-Modified-Since', None)
+        if if_modified_since is None or last_modified is None:
+            return False
+        try:
+            date = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= date.timestamp()
+
+    def write_not_modified(self) -> None:
+        """Method that answers a conditional request with `304` and without the body."""
+        self.set_status(304)
+        self.rendered_body = ''
+        self.replica_response = self.build_replica_response()
+
+    def compute_etag(self) -> Optional[str]:
+        """Overriden method of tornado.web.RequestHandler
+
+        The validators are precomputed by `set_validators()` and `HttpStaticResponse` instead of hashing
+        the write buffer of every response.
+        """
+        return None
+
+    def set_content_encoding(self, encoding: str) -> None:
+        """Method that marks the response as compressed, weakening a strong `Etag` since the bytes differ."""
+        self.set_header('Content-Encoding', encoding)
+        etag = self._headers.get('Etag', None)
+        if etag is not None and not etag.startswith('W/'):
+            self.set_header('Etag', 'W/%s' % etag)
+
+    def determine_content_encoding(self) -> Union[str, None]:
+        """Method that negotiates the content coding of the response if the alternative enables `compress`."""
+        if self.alternative is None or not self.alternative.compress or self.interceptors:
+            return None
+        if self._status_code in (204, 304) or 'Content-Encoding' in self._headers:
+            return None
+        self.add_header('Vary', 'Accept-Encoding')
+        return choose_encoding(self.request.headers.get('Accept-Encoding', None))
+
+    async def compress_body(self, body: Union[str, bytes, mmap.mmap]) -> Union[str, bytes, mmap.mmap]:
+        """Method that compresses the response body, caching the result for external files.
+
+        An external file, memory-mapped or not, is compressed once per modification time. The large
+        bodies are compressed in the rendering thread pool, or the default executor without it, and the
+        ones beyond `MOCKINTOSH_COMPRESSION_MAX_SIZE` are served as they are.
+        """
+        encoding = self.determine_content_encoding()
+        if encoding is None or not compressor.compressible(body):
+            return body
+
+        cache_key = None
+        if self.file_body_path is not None:
+            cache_key = (self.file_body_path, file_cache.last_modified(self.file_body_path))
+        elif isinstance(body, mmap.mmap):  # pragma: no cover
+            return body
+        body = await compressor.compress_async(body, encoding, cache_key=cache_key, executor=self.rendering_queue.executor)
+        self.set_content_encoding(encoding)
+        return body
+
     async def match_alternative(self) -> tuple:
         """Method to handles all the request matching logic.
 
@@ -849,24 +1095,20 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         reason = None
         fail = False
         if alternative.headers is not None:
-            for key, value in alternative.headers.items():
+            for key, matcher in alternative.matchers['headers'].items():
                 request_header_val = self.request.headers.get(key.title())
                 if key.title() not in self.request.headers._dict:
                     self.internal_endpoint_id = alternative.internal_endpoint_id
                     fail = True
                     reason = '%r not in the request headers!' % key.title()
                     break
-                if value == request_header_val:
-                    continue
-                value = '^%s$' % value
-                match = re.search(value, request_header_val)
-                if match is None:
+                if not matcher.match(request_header_val):
                     self.internal_endpoint_id = alternative.internal_endpoint_id
                     fail = True
                     reason = 'Request header value %r on key %r does not match to regex: %s' % (
                         request_header_val,
                         key.title(),
-                        value
+                        matcher.regex
                     )
                     break
         return fail, reason
@@ -875,7 +1117,7 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         reason = None
         fail = False
         if alternative.query_string is not None:
-            for key, value in alternative.query_string.items():
+            for key, matcher in alternative.matchers['queryString'].items():
                 # To prevent 400, default=None
                 default = None
                 request_query_val = self.get_query_argument(key, default=default)
@@ -892,19 +1134,15 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
                         fail = True
                         reason = 'Key %r couldn\'t found in the query string!' % key
                         break
-                if value == request_query_val:
-                    continue
                 if request_query_val is default:
                     continue
-                value = '^%s$' % value
-                match = re.search(value, request_query_val)
-                if match is None:
+                if not matcher.match(request_query_val):
                     self.internal_endpoint_id = alternative.internal_endpoint_id
                     fail = True
                     reason = 'Request query parameter value %r on key %r does not match to regex: %s' % (
                         request_query_val,
                         key,
-                        value
+                        matcher.regex
                     )
                     break
         return fail, reason
@@ -916,17 +1154,16 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
             json_schema = None
             if isinstance(alternative.body.schema.payload, ConfigExternalFilePath):
                 json_schema_path, _ = self.resolve_relative_path(alternative.body.schema.payload.path)
-                with open(json_schema_path, 'r') as file:
-                    logging.info('Reading JSON schema file from path: %s', json_schema_path)
-                    try:
-                        json_schema = json.load(file)
-                    except json.decoder.JSONDecodeError:
-                        self.send_error(
-                            500,
-                            message='JSON decode error of the JSON schema file: %s' % alternative.body.schema.payload.path
-                        )
-                        return fail, reason, True
-                    logging.debug('JSON schema: %s', json_schema)
+                logging.debug('Reading JSON schema file from path: %s', json_schema_path)
+                try:
+                    json_schema = file_cache.read_json(json_schema_path)
+                except json.decoder.JSONDecodeError:
+                    self.send_error(
+                        500,
+                        message='JSON decode error of the JSON schema file: %s' % alternative.body.schema.payload.path
+                    )
+                    return fail, reason, True
+                logging.debug('JSON schema: %s', json_schema)
             else:
                 json_schema = alternative.body.schema.payload
             json_data = None
@@ -970,7 +1207,8 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
             logging.debug('GraphQL parsed/unparsed request JSON dump:\n%s', body)
             logging.debug('GraphQL regex:\n%s', value)
             if not body == value:
-                match = re.search(value, body)
+                pattern = alternative.body.text_pattern if alternative.body.text_pattern is not None else re.compile(value)
+                match = pattern.search(body)
                 if match is None:
                     self.internal_endpoint_id = alternative.internal_endpoint_id
                     fail = True
@@ -981,7 +1219,7 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         reason = None
         fail = False
         if alternative.body.urlencoded is not None:
-            for key, value in alternative.body.urlencoded.items():
+            for key, matcher in alternative.matchers['bodyUrlencoded'].items():
                 # To prevent 400, default=None
                 default = None
                 body_argument = self.get_body_argument(key, default=default)
@@ -990,17 +1228,13 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
                     fail = True
                     reason = 'Key %r couldn\'t found in the form data!' % key
                     break
-                if value == body_argument:
-                    continue
-                value = '^%s$' % value
-                match = re.search(value, body_argument)
-                if match is None:
+                if not matcher.match(body_argument):
                     self.internal_endpoint_id = alternative.internal_endpoint_id
                     fail = True
                     reason = 'Form field value %r on key %r does not match to regex: %s' % (
                         body_argument,
                         key,
-                        value
+                        matcher.regex
                     )
                     break
         return fail, reason
@@ -1009,24 +1243,20 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         reason = None
         fail = False
         if alternative.body.multipart:
-            for key, value in alternative.body.multipart.items():
+            for key, matcher in alternative.matchers['bodyMultipart'].items():
                 if key not in self.request.files:
                     self.internal_endpoint_id = alternative.internal_endpoint_id
                     fail = True
                     reason = 'Key %r couldn\'t found in the multipart data!' % key
                     break
                 multipart_argument = self.request.files[key][0].body.decode()
-                if value == multipart_argument:
-                    continue
-                value = '^%s$' % value
-                match = re.search(value, multipart_argument)
-                if match is None:
+                if not matcher.match(multipart_argument):
                     self.internal_endpoint_id = alternative.internal_endpoint_id
                     fail = True
                     reason = 'Multipart field value %r on key %r does not match to regex: %s' % (
                         multipart_argument,
                         key,
-                        value
+                        matcher.regex
                     )
                     break
         return fail, reason
@@ -1035,8 +1265,8 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         reason = None
         fail = False
         if alternative.body.graphql_variables:
-            for key, value in alternative.body.graphql_variables.items():
-                json_data = json.loads(body)
+            json_data = json.loads(body)
+            for key, matcher in alternative.matchers['graphqlVariables'].items():
                 if 'variables' not in json_data:
                     fail = True
                     reason = '`variables` JSON field does not exist in the request body!'
@@ -1048,17 +1278,13 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
                     reason = 'Key %r couldn\'t found in the GraphQL variables!' % key
                     break
                 graphql_variable_value = str(graphql_variables[key])
-                if value == graphql_variable_value:
-                    continue
-                value = '^%s$' % value
-                match = re.search(value, graphql_variable_value)
-                if match is None:
+                if not matcher.match(graphql_variable_value):
                     self.internal_endpoint_id = alternative.internal_endpoint_id
                     fail = True
                     reason = 'GraphQL variable value %r on key %r does not match to regex: %s' % (
                         graphql_variable_value,
                         key,
-                        value
+                        matcher.regex
                     )
                     break
         return fail, reason
@@ -1070,7 +1296,7 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
 
     def finish(self, chunk: Optional[Union[str, bytes, dict]] = None) -> "Future[None]":
         """Overriden method of tornado.web.RequestHandler"""
-        if self.replica_response is None:
+        if self.replica_response is None and (self.interceptors or self.logs.services[self.service_id].is_enabled()):
             self.replica_response = self.build_replica_response()
         if self._status_code not in (204, 500, 'RST', 'FIN'):
             self.trigger_interceptors()
@@ -1091,11 +1317,9 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
     def resolve_relative_path(self, source_text: str) -> [None, str]:
         relative_path, orig_relative_path = super().resolve_relative_path(source_text)
         error_msg = 'External template file %r couldn\'t be accessed or found!' % orig_relative_path
-        if not os.path.isfile(relative_path):
-            self.send_error(500, message=error_msg)
-            return None
+        # `config_dir` is absolute, so `abspath()` only normalizes the path without a system call
         relative_path = os.path.abspath(relative_path)
-        if not relative_path.startswith(self.config_dir):
+        if not relative_path.startswith(self.config_dir) or not file_cache.is_file(relative_path):
             self.send_error(500, message=error_msg)
             return None
 
@@ -1146,25 +1370,20 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
 
     def loop_alternative(self, alternative: dict, key: str, subkey: str) -> dict:
         """Method that contains the logic to loop through the alternatives."""
-        index_attr = '%s_index' % subkey
-        loop_attr = '%s_looped' % subkey
-        if getattr(alternative, index_attr) is None:
-            setattr(alternative, index_attr, 0)
-        else:
-            setattr(alternative, index_attr, getattr(alternative, index_attr) + 1)
+        payload = getattr(alternative, key).payload
+        position = getattr(alternative, '%s_cursor' % subkey).advance()
 
-        resetted = False
-        if getattr(alternative, index_attr) > len(getattr(alternative, key).payload) - 1:
-            if getattr(alternative, loop_attr):
-                setattr(alternative, index_attr, 0)
-                resetted = True
-            else:
-                self.internal_endpoint_id = alternative.internal_endpoint_id
-                self.set_status(410)
-                self.finish()
-                return False
+        if position > len(payload) - 1 and not getattr(alternative, '%s_looped' % subkey):
+            self.internal_endpoint_id = alternative.internal_endpoint_id
+            self.set_status(410)
+            self.finish()
+            return False
+
+        index = position % len(payload)
+        resetted = position > len(payload) - 1 and index == 0
+        setattr(self, '%s_index' % subkey, index)
 
-        selection = getattr(alternative, key).payload[getattr(alternative, index_attr)]  # type: Union[ConfigResponse, dict]
+        selection = payload[index]  # type: Union[ConfigResponse, dict]
         tag = None
         if isinstance(selection, ConfigResponse):
             tag = selection.tag
@@ -1189,11 +1408,10 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         self.set_status(status_code)
 
         if status_code == 404 and self.is_request_image_like():
-            with open(os.path.join(__location__, 'res/mock.png'), 'rb') as file:
-                image = file.read()
-                self.set_header(CONTENT_TYPE, 'image/png')
-                self.write(image)
-                self.rendered_body = image
+            image = file_cache.read_bytes(os.path.join(__location__, 'res/mock.png'))
+            self.set_header(CONTENT_TYPE, 'image/png')
+            self.write(image)
+            self.rendered_body = image
 
         raise NewHTTPError()
 
@@ -1202,12 +1420,12 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         for key, value in self.request.headers._dict.items():
             if key.title() in (
                 'Host',
-                'Content-Length'
+                'Content-Length',
+                'Transfer-Encoding'
             ):
                 continue
             headers[key] = value
         headers['Cache-Control'] = 'no-cache'
-        headers['If-None-Match'] = '0'
         return headers
 
     def resolve_unhandled_request_query_string(self) -> str:
@@ -1243,6 +1461,17 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
                 self.insert_unhandled_data((self.request, None))
             return
 
+        method = self.request.method.upper()
+        # The cache of a group is shared by its targets, it is looked up before one is picked
+        cache = self.fallback_to.cache
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.key(method, self.request.path, self.request.query, self.request.headers, self.request.body)
+            cached = await cache.get_async(cache_key)
+            if cached is not None:
+                self.write_cached_response(cached)
+                raise NewHTTPError()
+
         # Headers
         headers = self.resolve_unhandled_request_headers()
 
@@ -1250,52 +1479,144 @@ class GenericHandler(tornado.web.RequestHandler, BaseHandler):
         query_string = self.resolve_unhandled_request_query_string()
 
         # Body
-        data, files = self.resolve_unhandled_request_body()
+        # Interceptors rewrite the whole response, so it cannot be streamed while they are loaded
+        stream = self.fallback_to.stream and not self.interceptors
+        coalesce = method in ('GET', 'HEAD', 'OPTIONS') and not self.request.body and not stream
+        if coalesce:
+            # A group picks the target of the first of the identical requests only
+            upstream = self.fallback_to
+        else:
+            # The targets of a group that do not stream buffer the responses
+            upstream = self.fallback_to.choose()
+            stream = upstream.stream and not self.interceptors
+        if stream:
+            kwargs = {'content': self.request.body} if self.request.body else {}
+        elif method in ('POST', 'PUT', 'PATCH'):
+            data, files = self.resolve_unhandled_request_body()
+            kwargs = {'data': data, 'files': files}
+        else:
+            kwargs = {}
 
-        url = self.fallback_to.rstrip('/') + self.request.path + query_string
+        url = upstream.url + self.request.path + query_string
 
         # The service is external
         logging.info('Forwarding the unhandled request to: %s %s', self.request.method, url)
 
-        http_verb = getattr(client, self.request.method.lower())
         try:
-            if self.request.method.upper() in ('POST', 'PUT', 'PATCH'):
-                resp = await http_verb(url, headers=headers, timeout=FALLBACK_TO_TIMEOUT, data=data, files=files)
+            if stream:
+                resp = await upstream.request(method, self.request.path + query_string, headers, stream=True, **kwargs)
+            elif coalesce:
+                resp = await upstream.request_coalesced(method, self.request.path + query_string, headers)
             else:
-                resp = await http_verb(url, headers=headers, timeout=FALLBACK_TO_TIMEOUT)
+                resp = await upstream.request(method, self.request.path + query_string, headers, **kwargs)
         except httpx.TimeoutException:  # pragma: no cover
             self.set_status(504)
             self.write('Forwarded request to: %s %s is timed out!' % (self.request.method, url))
             raise NewHTTPError()
         except httpx.ConnectError:  # pragma: no cover
             self.set_status(502)
-            self.write('Name or service not known: %s' % self.fallback_to.rstrip('/'))
+            self.write('Name or service not known: %s' % upstream.url)
+            raise NewHTTPError()
+        except UpstreamCircuitOpen as e:
+            self.set_status(503)
+            self.set_header('Retry-After', str(max(1, math.ceil(e.retry_after))))
+            self.write(str(e))
             raise NewHTTPError()
 
         logging.debug('Returned back from the forwarded request.')
 
-        self.set_status(resp.status_code if resp.status_code != 304 else 200)
-        for key, value in resp.headers.items():
-            if key.title() in (
-                'Transfer-Encoding',
-                'Content-Length',
-                'Content-Encoding',
-                'Access-Control-Allow-Methods',
-                'Access-Control-Allow-Origin'
-            ):
-                continue
-            self.set_header(key, value)
+        try:
+            self.set_status(resp.status_code)
+            response_headers = []
+            for key, value in resp.headers.multi_items():
+                if key.title() in (
+                    'Transfer-Encoding',
+                    'Access-Control-Allow-Methods',
+                    'Access-Control-Allow-Origin'
+                ):
+                    continue
+                # A streamed body is relayed as it is encoded, a buffered one is already decoded by httpx
+                if not stream and key.title() in ('Content-Length', 'Content-Encoding'):
+                    continue
+                if key.title() == 'Set-Cookie':
+                    self.add_header(key, value)
+                else:
+                    self.set_header(key, value)
+                response_headers.append((key, value))
+            if cache_key is not None:
+                self.set_header('x-%s-cache' % PROGRAM.lower(), 'MISS')
+
+            if ORIGIN in self.request.headers:
+                self.set_cors_headers()
+
+            if resp.status_code == 304:
+                # The upstream validated the client's cached copy, there is no body to tunnel or record
+                if not self.is_request_image_like():
+                    self.insert_unhandled_data((self.request, None))
+                raise NewHTTPError()
 
+            if stream:
+                body = await self.write_upstream_stream(resp)
+            else:
+                body = resp.content
+                self.write(body)
+                # Upstream errors are not replayed, the upstream gets another chance on the next request
+                if cache_key is not None and resp.status_code < 500:
+                    cache.put(cache_key, CachedResponse(
+                        method,
+                        self.request.path + query_string,
+                        resp.status_code,
+                        [(key, value) for key, value in response_headers if key.title() != 'Date'],
+                        body
+                    ))
+        finally:
+            if stream:
+                await resp.aclose()
+
+        self.replica_response = self.build_replica_response()
+        self.replica_response.body = body
+
+        if not self.is_request_image_like():
+            self.insert_unhandled_data((self.request, self.replica_response))
+        raise NewHTTPError()
+
+    def write_cached_response(self, cached: CachedResponse) -> None:
+        """Method that replays a response recorded from the upstream."""
+        self.set_status(cached.status)
+        for key, value in cached.headers:
+            if key.title() == 'Set-Cookie':
+                self.add_header(key, value)
+            else:
+                self.set_header(key, value)
+        self.set_header('x-%s-cache' % PROGRAM.lower(), 'HIT')
         if ORIGIN in self.request.headers:
             self.set_cors_headers()
 
-        self.write(resp.content)
+        if self.request.method != 'HEAD':
+            self.write(cached.body)
         self.replica_response = self.build_replica_response()
-        self.replica_response.body = resp.content
+        self.replica_response.body = cached.body
 
         if not self.is_request_image_like():
             self.insert_unhandled_data((self.request, self.replica_response))
-        raise NewHTTPError()
+
+    async def write_upstream_stream(self, resp: httpx.Response) -> bytes:
+        """Method that relays the raw chunks of a streamed upstream response to the client.
+
+        Returns the first `FALLBACK_TO_RECORD_SIZE` bytes of the body to be recorded, or nothing if the
+        body is compressed since a compressed prefix cannot be shown.
+        """
+        limit = FALLBACK_TO_RECORD_SIZE if 'Content-Encoding' not in resp.headers else 0
+        prefix = bytearray()
+        try:
+            async for chunk in resp.aiter_raw(STREAM_CHUNK_SIZE):
+                if len(prefix) < limit:
+                    prefix += chunk[:limit - len(prefix)]
+                self.write(chunk)
+                await self.flush()
+        except StreamClosedError:
+            logging.debug('Client closed the connection while streaming the upstream response.')
+        return bytes(prefix)
 
     def insert_unhandled_data(self, row: tuple) -> None:
         if self.unhandled_data is None:
@@ -1441,22 +1762,19 @@ class AsyncHandler(BaseHandler):
         is_binary = False
         if isinstance(value, ConfigExternalFilePath):
             template_path, context = self.resolve_relative_path(value.path)
-            with open(template_path, 'rb') as file:
-                logging.debug('Reading external file from path: %s', template_path)
-                value = file.read()
-                try:
-                    value = value.decode()
-                    logging.debug('Template file text: %s', value)
-                except UnicodeDecodeError:
-                    is_binary = True
-                    logging.debug('Template file is binary. Templating disabled.')
+            logging.debug('Reading external file from path: %s', template_path)
+            value, is_binary = file_cache.read_text(template_path)
+            if is_binary:
+                value = value[:]
+                logging.debug('Template file is binary. Templating disabled.')
+            else:
+                logging.debug('Template file text: %s', value)
         compiled = None
         context = None
         if is_binary:
             compiled = value
         else:
             compiled, context = self.common_template_renderer(self.definition_engine, value)
-            self.populate_counters(context)
 
         if not is_binary:
             logging.debug('Render output: %s', compiled)
@@ -23,6 +23,7 @@ from pybars import PybarsError
 from faker import Faker
 
 from mockintosh.helpers import _handlebars_add_to_context
+from mockintosh.state import counters
 
 
 def fake():
@@ -67,17 +68,7 @@ def json_path(this, data, path):
 
 
 def counter(this, name):
-    number = 0
-    if name in this.context:
-        number = this.context[name]
-    number += 1
-    _handlebars_add_to_context(
-        this.context,
-        'counters',
-        name,
-        number
-    )
-    return number
+    return counters.increment(name)
 
 
 def escape_html(this, text):
@@ -8,6 +8,7 @@
 
 import sys
 import io
+import asyncio
 import re
 import time
 import logging
@@ -15,6 +16,7 @@ from contextlib import contextmanager
 from base64 import b64encode
 from urllib.parse import _coerce_args, SplitResult, _splitnetloc, scheme_chars
 from typing import (
+    List,
     Tuple,
     Callable,
     Union
@@ -203,6 +205,53 @@ def _delay(seconds: int) -> None:
     time.sleep(seconds)
 
 
+async def _delay_async(seconds: int) -> None:
+    """Non-blocking version of `_delay()` to be awaited from the IOLoop."""
+    logging.debug('Sleeping for %d seconds.', seconds)
+    await asyncio.sleep(seconds)
+
+
+def _parse_byte_ranges(value: str, size: int) -> Union[List[Tuple[int, int]], None]:
+    """Parses a `Range` header into the sorted and merged `[start, end)` ranges of a body of `size` bytes.
+
+    Returns `None` if the header is not a valid byte range set, in which case the whole body is sent,
+    and an empty list if none of the ranges can be satisfied.
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, separator, last = part.partition('-')
+        if not separator or (not first and not last):
+            return None
+        try:
+            if not first:
+                start, end = max(size - int(last), 0), size
+            else:
+                start = int(first)
+                end = size if not last else int(last) + 1
+                if last and end <= start:
+                    return None
+        except ValueError:
+            return None
+        end = min(end, size)
+        if start < end:
+            ranges.append((start, end))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
 def _graphql_escape_templating(text: str) -> str:
     RegexEscapeBase.count = -1
     text = re.sub(r'(?<!\")({{[^{}]*}})', RegexEscape1(), text)
@@ -22,6 +22,7 @@ from jinja2 import pass_context
 from jinja2.exceptions import TemplateSyntaxError
 
 from mockintosh.helpers import _jinja_add_varname, _jinja_add_to_context
+from mockintosh.state import counters
 
 
 def fake():
@@ -68,17 +69,7 @@ def json_path(data, path):
 
 @pass_context
 def counter(context, name):
-    number = 0
-    if name in context:
-        number = context[name]
-    number += 1
-    _jinja_add_to_context(
-        context,
-        'counters',
-        name,
-        number
-    )
-    return number
+    return counters.increment(name)
 
 
 def escape_html(text):
@@ -6,16 +6,48 @@
     :synopsis: module that contains logging related classes.
 """
 
+import os
+import re
+import gzip
+import json
+import mmap
+import heapq
+import queue
+import sqlite3
+import hashlib
+import atexit
+import shutil
+import logging
+import threading
 from datetime import datetime
+from collections import deque
 from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
     Union
 )
 
 from tornado.http1connection import HTTP1ServerConnection
+from tornado.ioloop import IOLoop
 
 import mockintosh
 from mockintosh.constants import PROGRAM
 from mockintosh.replicas import Request, Response
+from mockintosh.workers import workers
+
+TRAFFIC_LOG_SIZE = int(os.environ.get('MOCKINTOSH_TRAFFIC_LOG_SIZE', 10000))
+TRAFFIC_LOG_BODY_SIZE = int(os.environ.get('MOCKINTOSH_TRAFFIC_LOG_BODY_SIZE', 64 * 1024))
+TRAFFIC_LOG_SAMPLING = int(os.environ.get('MOCKINTOSH_TRAFFIC_LOG_SAMPLING', 1))
+TRAFFIC_SINK = os.environ.get('MOCKINTOSH_TRAFFIC_SINK', '')
+TRAFFIC_SINK_PATH = os.environ.get('MOCKINTOSH_TRAFFIC_SINK_PATH', '')
+TRAFFIC_SINK_MAX_SIZE = int(os.environ.get('MOCKINTOSH_TRAFFIC_SINK_MAX_SIZE', 100 * 1024 * 1024))
+TRAFFIC_SINK_BACKUPS = int(os.environ.get('MOCKINTOSH_TRAFFIC_SINK_BACKUPS', 10))
+TRAFFIC_SINK_COMPRESS = int(os.environ.get('MOCKINTOSH_TRAFFIC_SINK_COMPRESS', 1))
+TRAFFIC_SINK_QUEUE_SIZE = int(os.environ.get('MOCKINTOSH_TRAFFIC_SINK_QUEUE_SIZE', 10000))
+TRAFFIC_SINK_FORMATS = ('jsonl', 'har')
 
 
 def _get_log_root(enabled) -> dict:
@@ -32,7 +64,196 @@ def _get_log_root(enabled) -> dict:
     }
 
 
+def har_envelope() -> Tuple[str, str]:
+    """Returns the text of a HAR document before and after its entries."""
+    root = _get_log_root(True)
+    del root['log']['_enabled']
+    head, tail = json.dumps(root).rsplit('[]', 1)
+    return head + '[\n', ']' + tail + '\n'
+
+
+_last_sequence = 0
+
+
+def _next_sequence() -> int:
+    global _last_sequence
+    _last_sequence += 1
+    return _last_sequence
+
+
+def _resume_sequence(sequence: int) -> None:
+    global _last_sequence
+    _last_sequence = max(_last_sequence, sequence)
+
+
+def _parse_time(value: str) -> datetime:
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        # The start times of the records are naive local times
+        return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo is not None else parsed
+
+
+class LogFilter:
+    """Selects the traffic log records returned by `/traffic-log`.
+
+    The `since` cursor is the `_cursor` of a previous response, the sequence numbers of the last
+    records seen on each worker process joined by dots, so the records can be polled incrementally.
+    At most `limit` records are returned per worker process, the oldest ones first, or with `latest`
+    the most recent ones, in which case the cursor moves past all the records.
+    """
+
+    def __init__(
+        self,
+        since: Union[str, None] = None,
+        limit: Union[int, None] = None,
+        latest: Union[int, None] = None,
+        methods: Union[List[str], None] = None,
+        path: Union[str, None] = None,
+        status: Union[List[str], None] = None,
+        start: Union[datetime, None] = None,
+        end: Union[datetime, None] = None,
+        endpoint: Union[str, None] = None
+    ):
+        self.cursor = [int(part) for part in since.split('.')] if since else []
+        self.limit = limit
+        self.latest = latest
+        self.methods = None if methods is None else [method.upper() for method in methods]
+        self.path = None if path is None else re.compile(path)
+        self.status = status
+        self.start = start
+        self.end = end
+        self.endpoint = endpoint
+
+    @classmethod
+    def from_query(cls, query: Dict[str, Union[str, None]]) -> 'LogFilter':
+        """Builds the filter from the query arguments, raises `ValueError` if one of them is invalid."""
+        limit = query.get('limit', None)
+        if limit is not None:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError('limit must be a positive integer')
+        latest = query.get('latest', None)
+        if latest is not None:
+            latest = int(latest)
+            if latest < 1:
+                raise ValueError('latest must be a positive integer')
+            if limit is not None:
+                raise ValueError('limit and latest cannot be combined')
+        status = None
+        if query.get('status', None):
+            status = [value.strip().lower() for value in query['status'].split(',')]
+            if not all(re.fullmatch(r'[1-5]([0-9]{2}|xx)', value) for value in status):
+                raise ValueError('status must be a list of status codes or classes like 5xx')
+        try:
+            path = query.get('path', None)
+            if path is not None:
+                re.compile(path)
+        except re.error as e:
+            raise ValueError('path is not a valid regular expression: %s' % e)
+        return cls(
+            since=query.get('since', None),
+            limit=limit,
+            latest=latest,
+            methods=query['method'].split(',') if query.get('method', None) else None,
+            path=path,
+            status=status,
+            start=_parse_time(query['from']) if query.get('from', None) else None,
+            end=_parse_time(query['to']) if query.get('to', None) else None,
+            endpoint=query.get('endpoint', None)
+        )
+
+    @property
+    def since(self) -> int:
+        since = self.cursor[workers.index] if workers.index < len(self.cursor) else 0
+        # A cursor ahead of this process comes from before a restart of the worker
+        return 0 if since > _last_sequence else since
+
+    def next_cursor(self, sequence: int) -> str:
+        cursor = self.cursor + [0] * (workers.index + 1 - len(self.cursor))
+        cursor[workers.index] = sequence
+        return '.'.join(str(part) for part in cursor)
+
+    def match(self, record: 'LogRecord') -> bool:
+        if self.methods is not None and record._request[0] not in self.methods:
+            return False
+        if self.path is not None and (record._request[4] is None or self.path.search(record._request[4]) is None):
+            return False
+        if self.status is not None:
+            status = str(record._response[0])
+            if not any(status == value or (value.endswith('xx') and status[0] == value[0]) for value in self.status):
+                return False
+        if self.start is not None and record.request_start_datetime < self.start:
+            return False
+        if self.end is not None and record.request_start_datetime > self.end:
+            return False
+        if self.endpoint is not None and record.endpoint_id != self.endpoint:
+            return False
+        return True
+
+
+def _select(enabled: bool, records: Iterable['LogRecord'], log_filter: Union[LogFilter, None]) -> dict:
+    data = _get_log_root(enabled)
+    if log_filter is None:
+        log_filter = LogFilter()
+
+    since = log_filter.since
+    sequence = since
+    latest = None if log_filter.latest is None else deque(maxlen=log_filter.latest)
+    for record in records:
+        if record.sequence <= since:
+            continue
+        if log_filter.match(record):
+            if latest is not None:
+                latest.append(record)
+            elif log_filter.limit is not None and len(data['log']['entries']) >= log_filter.limit:
+                break
+            else:
+                data['log']['entries'].append(record.json())
+        sequence = record.sequence
+    if latest is not None:
+        data['log']['entries'] = [record.json() for record in latest]
+    data['log']['_cursor'] = log_filter.next_cursor(sequence)
+    return data
+
+
+def _truncate(value: Union[str, bytes, None], limit: int) -> Union[bytes, None]:
+    """Encodes the body into bytes, keeping at most `limit` bytes of it."""
+    if value is None:
+        return None
+    if not isinstance(value, (bytes, bytearray, memoryview, mmap.mmap)):
+        value = str(value)
+    if isinstance(value, str):
+        # A character is at most 4 bytes, so there is no need to encode the rest of a long text
+        return value[:limit].encode()[:limit]
+    return bytes(value[:limit])
+
+
+def _truncate_text(value: Union[str, list], limit: int) -> Union[str, tuple]:
+    if isinstance(value, list):
+        return tuple(_truncate_text(item, limit) for item in value)
+    return value if len(value) <= limit else value[:limit]
+
+
 class LogRecord:
+    """A traffic log entry, stored compactly and converted into HAR only when it is read.
+
+    The request and the response replicas are reduced to tuples of their fields, with the header
+    duplicates left out and the bodies kept as bytes truncated to `TRAFFIC_LOG_BODY_SIZE`.
+    """
+
+    __slots__ = (
+        'service_name',
+        'request_start_datetime',
+        'elapsed_time_in_milliseconds',
+        'server_ip_address',
+        'connection',
+        'endpoint_id',
+        'sequence',
+        '_request',
+        '_response'
+    )
 
     def __init__(
         self,
@@ -41,13 +262,16 @@ class LogRecord:
         elapsed_time_in_milliseconds: int,
         request: Request,
         response: Response,
-        server_connection: Union[HTTP1ServerConnection, None]
+        server_connection: Union[HTTP1ServerConnection, None],
+        endpoint_id: Union[str, None] = None
     ):
         self.service_name = service_name
         self.request_start_datetime = request_start_datetime
         self.elapsed_time_in_milliseconds = elapsed_time_in_milliseconds
-        self.request = request
-        self.response = response
+        self.endpoint_id = endpoint_id
+        self.sequence = 0
+        self._request = self._compact_request(request)
+        self._response = self._compact_response(response)
         if server_connection is not None and server_connection.stream.socket is not None:
             self.server_ip_address = server_connection.stream.socket.getsockname()[0]
             self.connection = str(server_connection.stream.socket.getsockname()[1])
@@ -57,6 +281,86 @@ class LogRecord:
             self.server_ip_address = ''
             self.connection = ''
 
+    @staticmethod
+    def _compact_request(request: Request) -> tuple:
+        headers = []
+        seen = set()
+        for key, value in request.headers.items():
+            if key.lower() in seen:
+                continue
+            seen.add(key.lower())
+            headers.append((key, str(value)))
+
+        if isinstance(request.body, dict):
+            body = tuple(
+                (key, _truncate_text(value, TRAFFIC_LOG_BODY_SIZE), request.bodyType[key])
+                for key, value in request.body.items()
+            )
+            body_type = None
+        else:
+            body = _truncate(request.body, TRAFFIC_LOG_BODY_SIZE)
+            body_type = request.bodyType
+
+        return (
+            request.method,
+            request.protocol,
+            request.hostName,
+            request.port,
+            None if request.path is None else str(request.path),
+            tuple(
+                (key, tuple(value) if isinstance(value, list) else value)
+                for key, value in request.queryString.items()
+            ),
+            tuple(headers),
+            body,
+            body_type,
+            request.bodySize,
+            request.mimeType
+        )
+
+    @staticmethod
+    def _compact_response(response: Response) -> tuple:
+        return (
+            response.status,
+            tuple((key, str(value)) for key, value in response.headers.items()),
+            _truncate(response.body, TRAFFIC_LOG_BODY_SIZE),
+            isinstance(response.body, str),
+            response.bodySize
+        )
+
+    @property
+    def request(self) -> Request:
+        method, protocol, host_name, port, path, query_string, headers, body, body_type, body_size, mime_type = self._request
+        request = Request()
+        request.method = method
+        request.protocol = protocol
+        request.hostName = host_name
+        request.port = port
+        if path is not None:
+            request.set_path(path)
+        request.queryString = {key: list(value) if isinstance(value, tuple) else value for key, value in query_string}
+        request.headers = dict(headers)
+        if body_type is None:
+            request.body = {key: list(value) if isinstance(value, tuple) else value for key, value, _ in body}
+            request.bodyType = {key: _body_type for key, _, _body_type in body}
+        else:
+            # A truncated body may end in the middle of a character
+            request.body = None if body is None else body.decode(errors='ignore')
+            request.bodyType = body_type
+        request.bodySize = body_size
+        request.mimeType = mime_type
+        return request
+
+    @property
+    def response(self) -> Response:
+        status, headers, body, is_text, body_size = self._response
+        response = Response()
+        response.status = status
+        response.headers = dict(headers)
+        response.body = body.decode(errors='ignore') if is_text and body is not None else body
+        response.bodySize = body_size
+        return response
+
     def json(self) -> dict:
         data = {
             '_serviceName': self.service_name,
@@ -83,38 +387,83 @@ class LogRecord:
 
 
 class ServiceLogs():
-    def __init__(self, name: str):
-        self.records = []
+    """The traffic log of a service, a ring buffer that keeps the last `capacity` records.
+
+    With a `sampling` rate of N, only one in every N requests is recorded.
+    """
+
+    def __init__(self, name: str, capacity: int = TRAFFIC_LOG_SIZE, sampling: int = TRAFFIC_LOG_SAMPLING):
+        self.records = deque(maxlen=capacity)
         self.enabled = False
         self.name = name
+        self.sampling = sampling
+        self.counter = 0
+        self.parent = None
 
     def is_enabled(self) -> bool:
         return self.enabled
 
-    def add_record(self, record: LogRecord) -> None:
-        self.records.append(record)
+    def should_record(self) -> bool:
+        """Tells whether the current request is logged, counting the requests for the sampling."""
+        if not self.enabled:
+            return False
+        self.counter += 1
+        return self.sampling <= 1 or (self.counter - 1) % self.sampling == 0
 
-    def json(self) -> dict:
-        data = _get_log_root(self.is_enabled())
+    @property
+    def sink(self) -> Union['TrafficSink', None]:
+        return None if self.parent is None else self.parent.sink
 
-        for record in self.records:
-            data['log']['entries'].append(record.json())
+    def add_record(self, record: LogRecord) -> None:
+        sink = self.sink
+        if sink is not None:
+            # A queryable sink may continue the sequence of a previous run
+            sink.start()
+        record.sequence = _next_sequence()
+        if sink is None or not sink.queryable:
+            self.records.append(record)
+        if sink is not None:
+            sink.write(record)
 
-        return data
+    def json(self, log_filter: Union[LogFilter, None] = None) -> dict:
+        if self.sink is not None and self.sink.queryable:
+            return self.sink.select(self.is_enabled(), log_filter, service=self.name)
+        return _select(self.is_enabled(), self.records, log_filter)
 
     def reset(self) -> None:
-        self.records = []
+        self.records.clear()
+        self.counter = 0
+        if self.sink is not None and self.sink.queryable:
+            self.sink.delete(service=self.name)
+        if self.parent is not None:
+            self.parent.resets += 1
+
+    async def json_async(self, log_filter: Union[LogFilter, None] = None) -> dict:
+        """Same as `json()` but the queries of a queryable sink run in an executor instead of the IOLoop."""
+        if self.sink is not None and self.sink.queryable:
+            return await IOLoop.current().run_in_executor(None, self.json, log_filter)
+        return self.json(log_filter)
+
+    async def reset_async(self) -> None:
+        """Same as `reset()` but the deletion from a queryable sink runs in an executor instead of the IOLoop."""
+        if self.sink is not None and self.sink.queryable:
+            await IOLoop.current().run_in_executor(None, self.reset)
+            return
+        self.reset()
 
 
 class Logs():
-    def __init__(self):
+    def __init__(self, sink: Union['TrafficSink', None] = None):
         self.services = []
+        self.sink = sink
+        # Counts the clean-ups, so that the live views of the traffic log know when to start over
+        self.resets = 0
 
     def is_enabled(self) -> bool:
         return any(service.is_enabled() for service in self.services)
 
-    def add_service(self, name: str) -> None:
-        service_logs = ServiceLogs(name)
+    def add_service(self, name: str, capacity: int = TRAFFIC_LOG_SIZE) -> None:
+        service_logs = ServiceLogs(name, capacity=capacity)
         service_logs.parent = self
         self.services.append(service_logs)
 
@@ -122,17 +471,571 @@ class Logs():
         service_logs = self.services[index]
         service_logs.name = name
 
-    def json(self) -> dict:
-        data = _get_log_root(self.is_enabled())
+    def json(self, log_filter: Union[LogFilter, None] = None) -> dict:
+        if self.sink is not None and self.sink.queryable:
+            return self.sink.select(self.is_enabled(), log_filter)
+        # The records of every service are in insertion order already, they only need to be interleaved
+        records = heapq.merge(*[service.records for service in self.services], key=lambda record: record.sequence)
+        return _select(self.is_enabled(), records, log_filter)
 
+    def reset(self) -> None:
         for service in self.services:
-            for record in service.records:
-                data['log']['entries'].append(record.json())
+            service.records.clear()
+            service.counter = 0
+        if self.sink is not None and self.sink.queryable:
+            # One pass over the bodies instead of one per service
+            self.sink.delete()
+        self.resets += 1
+
+    async def json_async(self, log_filter: Union[LogFilter, None] = None) -> dict:
+        """Same as `json()` but the queries of a queryable sink run in an executor instead of the IOLoop."""
+        if self.sink is not None and self.sink.queryable:
+            return await IOLoop.current().run_in_executor(None, self.json, log_filter)
+        return self.json(log_filter)
+
+    async def reset_async(self) -> None:
+        """Same as `reset()` but the deletions from a queryable sink run in an executor instead of the IOLoop."""
+        if self.sink is not None and self.sink.queryable:
+            await IOLoop.current().run_in_executor(None, self.reset)
+            return
+        self.reset()
+
+
+_STARTED_DATE_TIME = re.compile(r'"startedDateTime": "([^"]+)"')
+
+
+class TrafficSink:
+    """Receives every record added to the traffic log, to keep the history that the ring buffers drop.
+
+    A `queryable` sink also answers the traffic log queries in place of the ring buffers.
+    """
+
+    format = 'jsonl'
+    queryable = False
+
+    def start(self) -> None:
+        """Prepares the sink in the process that writes to it, so after the fork in `--workers` mode."""
+
+    def write(self, record: LogRecord) -> None:
+        """Takes the record without waiting for it to be stored."""
+        raise NotImplementedError
+
+    def export(self, start: Union[datetime, None] = None, end: Union[datetime, None] = None) -> Iterator[str]:
+        """Yields the HAR entries of the records started between `start` and `end` as JSON texts."""
+        raise NotImplementedError
+
+    def scan(
+        self,
+        start: Union[datetime, None] = None,
+        end: Union[datetime, None] = None
+    ) -> Iterator[Union[str, None]]:
+        """Same as `export`, but also yields `None` for every record that is left out of the time range."""
+        return self.export(start, end)
+
+    def close(self) -> None:
+        pass
+
+    def json(self) -> dict:
+        return {}
+
+    def reset(self) -> None:
+        pass
+
+
+class QueuedTrafficSink(TrafficSink):
+    """Stores the records from a background thread that takes them from a bounded queue.
+
+    The request path never waits for the storage, the records that arrive while the queue is full are
+    dropped and counted. The records that pile up while one is stored are stored together.
+    """
+
+    batch_size = 1000
+
+    def __init__(self, queue_size: int = TRAFFIC_SINK_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.queue = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.reset()
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self._open()
+            self.thread = threading.Thread(target=self._run, name='traffic-sink', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def write(self, record: LogRecord) -> None:
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        running = True
+        while running:
+            records = [self.queue.get()]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in records:
+                records = records[:records.index(None)]
+                running = False
+            if not records:
+                continue
+            try:
+                self._store(records)
+                self.written += len(records)
+            except Exception as e:  # pragma: no cover
+                self.errors += 1
+                logging.error('Could not store %d traffic log records: %s', len(records), e)
+        self._close()
+
+    def _open(self) -> None:
+        raise NotImplementedError
+
+    def _store(self, records: List[LogRecord]) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Stores the queued records and stops the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def json(self) -> dict:
+        return {
+            'queued': 0 if self.queue is None else self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
+
+    def reset(self) -> None:
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+
+class FileTrafficSink(QueuedTrafficSink):
+    """Appends the records to a file, one HAR entry per line, as JSON lines or inside a HAR document.
+
+    Once the file reaches `max_size` bytes, it is rotated to `<path>.1` (gzip-compressed into
+    `<path>.1.gz` with `compress`), the older files are shifted and at most `backups` of them are kept.
+    A HAR document is completed when its file is rotated or closed. In `--workers` mode, each worker
+    writes its own files, with the worker index inserted before the extension.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fmt: str = 'jsonl',
+        max_size: int = TRAFFIC_SINK_MAX_SIZE,
+        backups: int = TRAFFIC_SINK_BACKUPS,
+        compress: bool = True,
+        queue_size: int = TRAFFIC_SINK_QUEUE_SIZE
+    ):
+        self.base_path = path
+        self.format = fmt
+        self.max_size = max_size
+        self.backups = backups
+        self.compress = compress
+        self.file = None
+        self.entries = 0
+        super().__init__(queue_size=queue_size)
+
+    def worker_path(self, index: int) -> str:
+        if not workers.is_enabled():
+            return self.base_path
+        base, extension = os.path.splitext(self.base_path)
+        return '%s.%d%s' % (base, index, extension)
+
+    @property
+    def path(self) -> str:
+        return self.worker_path(workers.index)
+
+    def _store(self, records: List[LogRecord]) -> None:
+        for record in records:
+            self._write(record)
+        self.file.flush()
+
+    def _write(self, record: LogRecord) -> None:
+        line = json.dumps(record.json())
+        if self.format == 'har' and self.entries > 0:
+            line = ',' + line
+        self.file.write(line.encode() + b'\n')
+        self.entries += 1
+        if self.file.tell() >= self.max_size:
+            self._close()
+            self._rotate()
+            self._open_file()
+
+    def _open(self) -> None:
+        path = self.path
+        if self.format == 'har' and os.path.exists(path) and os.path.getsize(path) > 0:
+            # The document of a previous run is completed and rotated instead of appended to
+            tail = har_envelope()[1].encode()
+            with open(path, 'rb+') as f:
+                f.seek(max(f.seek(0, os.SEEK_END) - len(tail), 0))
+                if f.read() != tail:
+                    f.write(tail)
+            self._rotate()
+        self._open_file()
+
+    def _open_file(self) -> None:
+        self.file = open(self.path, 'ab')
+        self.entries = 0
+        if self.format == 'har' and self.file.tell() == 0:
+            self.file.write(har_envelope()[0].encode())
 
-        data['log']['entries'] = sorted(data['log']['entries'], key=lambda x: x['startedDateTime'], reverse=False)
+    def _close(self) -> None:
+        if self.file is None:
+            return
+        if self.format == 'har':
+            self.file.write(har_envelope()[1].encode())
+        self.file.close()
+        self.file = None
 
+    def _rotate(self) -> None:
+        path = self.path
+        for i in range(self.backups - 1, 0, -1):
+            for suffix in ('', '.gz'):
+                source = '%s.%d%s' % (path, i, suffix)
+                if os.path.exists(source):
+                    os.replace(source, '%s.%d%s' % (path, i + 1, suffix))
+        if self.backups < 1:
+            os.remove(path)
+        elif self.compress:
+            with open(path, 'rb') as source, gzip.open('%s.1.gz' % path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(path)
+        else:
+            os.replace(path, '%s.1' % path)
+        self.rotations += 1
+
+    @staticmethod
+    def files(path: str) -> List[str]:
+        """Returns the files of a sink, from the oldest rotated one to the active one."""
+        directory, name = os.path.split(os.path.abspath(path))
+        pattern = re.compile(re.escape(name) + r'\.([0-9]+)(\.gz)?')
+        rotated = []
+        for item in os.listdir(directory):
+            match = pattern.fullmatch(item)
+            if match is not None:
+                rotated.append((int(match.group(1)), os.path.join(directory, item)))
+        return [item for _, item in sorted(rotated, reverse=True)] + ([path] if os.path.exists(path) else [])
+
+    @staticmethod
+    def _read(
+        path: str,
+        start: Union[datetime, None],
+        end: Union[datetime, None]
+    ) -> Iterator[Tuple[str, Union[str, None]]]:
+        # The records left out are keyed on the last time read, to keep the order that the merge expects
+        last = ''
+        for file_path in FileTrafficSink.files(path):
+            try:
+                # A file is written after the requests of its records have started
+                if start is not None and datetime.fromtimestamp(os.path.getmtime(file_path)) < start:
+                    continue
+                f = gzip.open(file_path, 'rb') if file_path.endswith('.gz') else open(file_path, 'rb')
+            except FileNotFoundError:
+                # Rotated away in the meantime
+                continue
+            with f:
+                for line in f:
+                    line = line.decode().lstrip(',')
+                    # The last line of the active file may not be complete yet
+                    if not line.startswith('{"_serviceName"') or not line.endswith('\n'):
+                        continue
+                    match = _STARTED_DATE_TIME.search(line)
+                    if match is None:  # pragma: no cover
+                        continue
+                    started = _parse_time(match.group(1))
+                    if (start is not None and started < start) or (end is not None and started > end):
+                        yield last, None
+                        continue
+                    last = match.group(1)
+                    yield last, line.rstrip()
+
+    def export(self, start: Union[datetime, None] = None, end: Union[datetime, None] = None) -> Iterator[str]:
+        return (entry for entry in self.scan(start, end) if entry is not None)
+
+    def scan(
+        self,
+        start: Union[datetime, None] = None,
+        end: Union[datetime, None] = None
+    ) -> Iterator[Union[str, None]]:
+        # Every worker can read the files of the others
+        paths = [self.worker_path(index) for index in range(workers.count)]
+        for _, entry in heapq.merge(*[self._read(path, start, end) for path in paths], key=lambda x: x[0]):
+            yield entry
+
+    def json(self) -> dict:
+        data = super().json()
+        data['format'] = self.format
+        data['rotations'] = self.rotations
         return data
 
     def reset(self) -> None:
-        for service in self.services:
-            service.records = []
+        super().reset()
+        self.rotations = 0
+
+
+class SqliteTrafficSink(QueuedTrafficSink):
+    """Stores the records in an SQLite database that answers the traffic log queries.
+
+    The writer thread inserts the records in batches. The HAR entries are stored without their bodies,
+    which are stored once per content in a separate table, and the columns that the traffic log is
+    filtered on are indexed. The `--workers` processes share the database, each one answers for its own
+    records. The sequence numbers continue from the records of a previous run, so that the database
+    keeps the traffic history across the restarts.
+    """
+
+    queryable = True
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS bodies (hash TEXT PRIMARY KEY, content TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS records (worker INTEGER NOT NULL, sequence INTEGER NOT NULL, '
+        'service TEXT NOT NULL, endpoint TEXT, method TEXT, path TEXT, status INTEGER, started REAL NOT NULL, '
+        'entry TEXT NOT NULL, request_body TEXT, response_body TEXT, PRIMARY KEY (worker, sequence))',
+        'CREATE INDEX IF NOT EXISTS records_service ON records (service, worker, sequence)',
+        'CREATE INDEX IF NOT EXISTS records_endpoint ON records (endpoint)',
+        'CREATE INDEX IF NOT EXISTS records_path ON records (path)',
+        'CREATE INDEX IF NOT EXISTS records_status ON records (status)',
+        'CREATE INDEX IF NOT EXISTS records_started ON records (started)'
+    )
+
+    def __init__(self, path: str, queue_size: int = TRAFFIC_SINK_QUEUE_SIZE):
+        self.path = path
+        self.connection = None
+        self.writer = None
+        super().__init__(queue_size=queue_size)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.create_function(
+            'REGEXP', 2, lambda pattern, value: value is not None and re.search(pattern, value) is not None
+        )
+        return connection
+
+    def _open(self) -> None:
+        self.writer = self._connect()
+        for statement in self.SCHEMA:
+            self.writer.execute(statement)
+        self.connection = self._connect()
+        _resume_sequence(self.connection.execute(
+            'SELECT COALESCE(MAX(sequence), 0) FROM records WHERE worker = ?', (workers.index,)
+        ).fetchone()[0])
+
+    @staticmethod
+    def _body(texts: dict, data: dict, key: str) -> Union[str, None]:
+        text = data.get(key, None)
+        if not text:
+            return None
+        del data[key]
+        digest = hashlib.sha1(text.encode()).hexdigest()
+        texts[digest] = text
+        return digest
+
+    def _store(self, records: List[LogRecord]) -> None:
+        texts = {}
+        rows = []
+        for record in records:
+            entry = record.json()
+            request_body = self._body(texts, entry['request'].get('postData', {}), 'text')
+            response_body = self._body(texts, entry['response']['content'], 'text')
+            rows.append((
+                workers.index,
+                record.sequence,
+                record.service_name,
+                record.endpoint_id,
+                record._request[0],
+                record._request[4],
+                record._response[0],
+                record.request_start_datetime.timestamp(),
+                json.dumps(entry),
+                request_body,
+                response_body
+            ))
+        # The bodies and the records that refer to them are committed together
+        self.writer.execute('BEGIN IMMEDIATE')
+        try:
+            self.writer.executemany('INSERT OR IGNORE INTO bodies (hash, content) VALUES (?, ?)', texts.items())
+            self.writer.executemany(
+                'INSERT INTO records (worker, sequence, service, endpoint, method, path, status, started, entry, '
+                'request_body, response_body) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self.writer.execute('COMMIT')
+        except BaseException:
+            self.writer.execute('ROLLBACK')
+            raise
+
+    def _close(self) -> None:
+        self.writer.close()
+        self.writer = None
+
+    @staticmethod
+    def _entry(entry: str, request_body: Union[str, None], response_body: Union[str, None]) -> str:
+        if request_body is None and response_body is None:
+            return entry
+        data = json.loads(entry)
+        if request_body is not None:
+            data['request']['postData']['text'] = request_body
+        if response_body is not None:
+            data['response']['content']['text'] = response_body
+        return json.dumps(data)
+
+    def select(self, enabled: bool, log_filter: Union[LogFilter, None], service: Union[str, None] = None) -> dict:
+        """Same as the traffic log of `Logs` and `ServiceLogs` but filtered by the database."""
+        self.start()
+        data = _get_log_root(enabled)
+        if log_filter is None:
+            log_filter = LogFilter()
+
+        scope = 'worker = ?'
+        scope_params = [workers.index]
+        if service is not None:
+            scope += ' AND service = ?'
+            scope_params.append(service)
+        clauses = [scope, 'sequence > ?']
+        params = scope_params + [log_filter.since]
+        if log_filter.methods is not None:
+            clauses.append('method IN (%s)' % ', '.join('?' * len(log_filter.methods)))
+            params += log_filter.methods
+        if log_filter.path is not None:
+            clauses.append('path REGEXP ?')
+            params.append(log_filter.path.pattern)
+        if log_filter.status is not None:
+            statuses = []
+            for value in log_filter.status:
+                if value.endswith('xx'):
+                    statuses.append('status BETWEEN ? AND ?')
+                    params += [int(value[0]) * 100, int(value[0]) * 100 + 99]
+                else:
+                    statuses.append('status = ?')
+                    params.append(int(value))
+            clauses.append('(%s)' % ' OR '.join(statuses))
+        if log_filter.endpoint is not None:
+            clauses.append('endpoint = ?')
+            params.append(log_filter.endpoint)
+        if log_filter.start is not None:
+            clauses.append('started >= ?')
+            params.append(log_filter.start.timestamp())
+        if log_filter.end is not None:
+            clauses.append('started <= ?')
+            params.append(log_filter.end.timestamp())
+
+        query = (
+            'SELECT sequence, entry, (SELECT content FROM bodies WHERE hash = request_body), '
+            '(SELECT content FROM bodies WHERE hash = response_body) FROM records WHERE %s ORDER BY sequence%s'
+        ) % (' AND '.join(clauses), '' if log_filter.latest is None else ' DESC')
+        if log_filter.latest is not None:
+            query += ' LIMIT %d' % log_filter.latest
+        elif log_filter.limit is not None:
+            query += ' LIMIT %d' % log_filter.limit
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+            if log_filter.latest is not None:
+                rows.reverse()
+            if log_filter.latest is None and log_filter.limit is not None and len(rows) >= log_filter.limit:
+                sequence = rows[-1][0]
+            else:
+                # Everything stored so far was looked at, the queued records come after it
+                sequence = self.connection.execute(
+                    'SELECT COALESCE(MAX(sequence), 0) FROM records WHERE %s' % scope, scope_params
+                ).fetchone()[0]
+
+        data['log']['entries'] = [json.loads(self._entry(entry, request_body, response_body)) for _, entry, request_body, response_body in rows]
+        data['log']['_cursor'] = log_filter.next_cursor(max(sequence, log_filter.since))
+        return data
+
+    def delete(self, service: Union[str, None] = None) -> None:
+        """Deletes the records of this worker and the bodies that are no longer referred to."""
+        self.start()
+        query = 'DELETE FROM records WHERE worker = ?'
+        params = [workers.index]
+        if service is not None:
+            query += ' AND service = ?'
+            params.append(service)
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.execute(query, params)
+                self.connection.execute(
+                    'DELETE FROM bodies WHERE hash NOT IN (SELECT request_body FROM records WHERE request_body IS NOT NULL '
+                    'UNION SELECT response_body FROM records WHERE response_body IS NOT NULL)'
+                )
+                self.connection.execute('COMMIT')
+            except BaseException:
+                # The connection also serves the queries, it must not stay in the transaction
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def export(self, start: Union[datetime, None] = None, end: Union[datetime, None] = None) -> Iterator[str]:
+        clauses = ['1']
+        params = []
+        if start is not None:
+            clauses.append('started >= ?')
+            params.append(start.timestamp())
+        if end is not None:
+            clauses.append('started <= ?')
+            params.append(end.timestamp())
+        # A connection of its own, so the rows are fetched lazily while the other queries go on
+        connection = self._connect()
+        try:
+            cursor = connection.execute(
+                'SELECT entry, (SELECT content FROM bodies WHERE hash = request_body), '
+                '(SELECT content FROM bodies WHERE hash = response_body) FROM records WHERE %s ORDER BY started'
+                % ' AND '.join(clauses),
+                params
+            )
+            for entry, request_body, response_body in cursor:
+                yield self._entry(entry, request_body, response_body)
+        finally:
+            connection.close()
+
+
+def take_entries(entries: Iterator[Union[str, None]], size: int) -> Union[List[str], None]:
+    """Takes the entries out of the next `size` records of a `TrafficSink.scan`, `None` once it is over.
+
+    The batch can be empty if none of the records scanned were in the time range.
+    """
+    batch = []
+    for i, entry in enumerate(entries):
+        if entry is not None:
+            batch.append(entry)
+        if i + 1 >= size:
+            return batch
+    return batch if batch else None
+
+
+def create_sink(name: str = TRAFFIC_SINK, path: str = TRAFFIC_SINK_PATH) -> Union[TrafficSink, None]:
+    """Creates the traffic sink selected by `MOCKINTOSH_TRAFFIC_SINK`, if any."""
+    if not name:
+        return None
+    if name == 'sqlite':
+        return SqliteTrafficSink(path if path else '%s-traffic.db' % PROGRAM)
+    if name not in TRAFFIC_SINK_FORMATS:
+        raise ValueError('Unknown traffic sink: %r' % name)
+    return FileTrafficSink(
+        path if path else '%s-traffic.%s' % (PROGRAM, name),
+        fmt=name,
+        compress=bool(TRAFFIC_SINK_COMPRESS)
+    )
@@ -11,6 +11,7 @@ import re
 import json
 import copy
 import shutil
+import asyncio
 import logging
 import threading
 from typing import (
@@ -28,13 +29,15 @@ import jsonschema
 import tornado.web
 from tornado.util import unicode_type
 from tornado.escape import utf8
+from tornado.iostream import StreamClosedError
+from tornado.ioloop import IOLoop
 
 import mockintosh
 from mockintosh.constants import PROGRAM
 from mockintosh.config import ConfigExternalFilePath
-from mockintosh.services.http import HttpService
+from mockintosh.services.http import HttpService, HttpRouteIndex
 from mockintosh.builders import ConfigRootBuilder
-from mockintosh.handlers import GenericHandler
+from mockintosh.handlers import GenericHandler, STREAM_CHUNK_SIZE
 from mockintosh.helpers import _safe_path_split, _b64encode, _urlsplit
 from mockintosh.exceptions import (
     RestrictedFieldError,
@@ -46,6 +49,11 @@ from mockintosh.exceptions import (
 from mockintosh.services.asynchronous import AsyncService, AsyncProducer, AsyncConsumer
 from mockintosh.services.asynchronous._looping import run_loops as async_run_loops, stop_loops
 from mockintosh.replicas import Request, Response
+from mockintosh.workers import workers, merge_stats, merge_logs, merge_unhandled, ASYNC_ACTORS_WORKER
+from mockintosh.logs import LogFilter, TRAFFIC_SINK_FORMATS, har_envelope, take_entries
+from mockintosh.events import EventHub, Subscriber, KEEP_ALIVE_INTERVAL
+from mockintosh.files import file_cache
+from mockintosh.upstreams import upstreams
 
 POST_CONFIG_RESTRICTED_FIELDS = ('port', 'hostname', 'ssl', 'sslCertFile', 'sslKeyFile')
 UNHANDLED_SERVICE_KEYS = ('name', 'port', 'hostname')
@@ -94,11 +102,63 @@ def _reset_iterators(app):
             for _, methods in path_methods:
                 for _, alternatives in methods.items():
                     for alternative in alternatives:
-                        alternative.multi_responses_index = None
-                        alternative.dataset_index = None
+                        alternative.reset_cursors()
             break
 
 
+def _parse_sampling(value: Union[str, None]) -> Union[int, None]:
+    """Parses the `sampling` argument of the traffic log, one in every N requests is logged."""
+    if value is None:
+        return None
+    sampling = int(value)
+    if sampling < 1:
+        raise ValueError(value)
+    return sampling
+
+
+def _async_actors() -> dict:
+    return {
+        'producers': [producer.info() for producer in AsyncProducer.producers],
+        'consumers': [consumer.info() for consumer in AsyncConsumer.consumers]
+    }
+
+
+def create_event_hub(http_server) -> EventHub:
+    """Creates the hub of `/events` that collects the data of the whole instance, like the REST endpoints."""
+    stats = http_server.definition.stats
+    logs = http_server.definition.logs
+
+    async def collect_stats(request) -> dict:
+        responses = await workers.fan_out_json(request, path='/stats') if workers.is_enabled() else []
+        return merge_stats(
+            stats.json(histograms=workers.is_enabled()),
+            [response.json() for response in responses],
+            histograms=False
+        )
+
+    async def collect_async(request) -> dict:
+        if not workers.runs_async_actors():
+            response = await workers.forward(request, ASYNC_ACTORS_WORKER, path='/async')
+            if response is not None and response.status_code == 200:
+                return response.json()
+        return _async_actors()
+
+    async def collect_traffic(request, cursor: str, limit: int) -> dict:
+        data = await logs.json_async(LogFilter(since=cursor, latest=limit))
+        responses = await workers.fan_out_json(
+            request,
+            query={'since': cursor, 'latest': str(limit)},
+            path='/traffic-log'
+        ) if workers.is_enabled() else []
+        return merge_logs(data, [response.json() for response in responses])
+
+    return EventHub(
+        {'stats': collect_stats, 'async': collect_async},
+        collect_traffic,
+        traffic_resets=lambda: logs.resets
+    )
+
+
 class ManagementBaseHandler(tornado.web.RequestHandler):
     def write(self, chunk: Union[str, bytes, dict]) -> None:
         if self._finished:  # pragma: no cover
@@ -124,13 +184,58 @@ class ManagementBaseHandler(tornado.web.RequestHandler):
     def data_received(self, chunk: bytes) -> Optional[Awaitable[None]]:
         pass
 
+    async def replay_on_workers(self, query: Union[dict, None] = None) -> list:
+        """Replays the request on the other workers and returns their successful JSON responses.
+
+        Returns an empty list if not running in worker mode or if the request is itself a replay.
+        """
+        if workers.is_local_request(self.request):
+            return []
+        return await workers.fan_out_json(self.request, query=query)
+
+    async def forward_to_async_actors(self) -> bool:
+        """Relays the request to the worker that runs the async actors, returns `False` if this is the one.
+
+        In worker mode the async actors only run in one worker, the others would report or trigger idle copies.
+        """
+        if workers.runs_async_actors() or workers.is_local_request(self.request):
+            return False
+        response = await workers.forward(self.request, ASYNC_ACTORS_WORKER)
+        if response is None:
+            self.set_status(503)
+            self.write('The worker that runs the async actors could not be reached!')
+            return True
+        self.set_status(response.status_code)
+        if 'Content-Type' in response.headers:
+            self.set_header('Content-Type', response.headers['Content-Type'])
+        if response.content:
+            self.write(response.content)
+        return True
+
+    def wants_histograms(self) -> bool:
+        """Tells whether the `/stats` output should carry the histograms of the response times.
+
+        The replays of the other workers need them to merge the percentiles, the other requests only get
+        them with the `histogram=true` query parameter.
+        """
+        if workers.is_enabled() and workers.is_local_request(self.request):
+            return True
+        return self.get_query_argument('histogram', 'false').lower() == 'true'
+
+    def get_log_filter(self) -> Union[LogFilter, None]:
+        try:
+            return LogFilter.from_query({key: self.get_query_argument(key) for key in self.request.query_arguments})
+        except ValueError as e:
+            self.set_status(400)
+            self.write('Invalid traffic log query: %s' % str(e))
+            return None
+
 
 class ManagementRootHandler(ManagementBaseHandler):
 
     async def get(self):
-        with open(os.path.join(__location__, 'res/management.html'), 'r') as file:
-            html = file.read()
-            self.write(html)
+        html, _ = file_cache.read_text(os.path.join(__location__, 'res/management.html'))
+        self.write(html)
 
 
 class ManagementConfigHandler(ManagementBaseHandler):
@@ -173,8 +278,10 @@ class ManagementConfigHandler(ManagementBaseHandler):
 
         self.update_globals()
 
-        async_run_loops()
+        if workers.runs_async_actors():
+            async_run_loops()
 
+        await self.replay_on_workers()
         self.set_status(204)
 
     def update_service(self, service: HttpService, service_index: int) -> None:
@@ -191,10 +298,15 @@ class ManagementConfigHandler(ManagementBaseHandler):
         path_methods = []
         for http_path in http_path_list:
             path_methods.append((http_path.path, http_path.methods))
+            for alternatives in http_path.methods.values():
+                for alternative in alternatives:
+                    alternative.reset_cursors()
 
         for rule in self.http_server._apps.apps[service.internal_http_service_id].default_router.rules[0].target.rules:
             if rule.target == GenericHandler:
                 rule.target_kwargs['path_methods'] = path_methods
+                rule.target_kwargs['route_index'] = HttpRouteIndex(path_methods)
+                rule.target_kwargs['fallback_to'] = upstreams.get(service.fallback_to)
                 break
 
         mockintosh.servers.HttpServer.log_path_methods(path_methods)
@@ -264,10 +376,14 @@ class ManagementStatsHandler(ManagementBaseHandler):
         self.stats = stats
 
     async def get(self):
-        self.write(self.stats.json())
+        histograms = self.wants_histograms()
+        data = self.stats.json(histograms=histograms or workers.is_enabled())
+        responses = await self.replay_on_workers()
+        self.write(merge_stats(data, [response.json() for response in responses], histograms=histograms))
 
     async def delete(self):
         self.stats.reset()
+        await self.replay_on_workers()
         self.set_status(204)
 
 
@@ -277,17 +393,134 @@ class ManagementLogsHandler(ManagementBaseHandler):
         self.logs = logs
 
     async def get(self):
-        self.write(self.logs.json())
+        log_filter = self.get_log_filter()
+        if log_filter is None:
+            return
+        data = await self.logs.json_async(log_filter)
+        responses = await self.replay_on_workers()
+        self.write(merge_logs(data, [response.json() for response in responses]))
 
     async def post(self):
         enabled = not self.get_body_argument('enable', default='True') in ('false', 'False', '0')
+        try:
+            sampling = _parse_sampling(self.get_body_argument('sampling', default=None))
+        except ValueError:
+            self.set_status(400)
+            self.write('Sampling rate must be a positive integer!')
+            return
         for service in self.logs.services:
             service.enabled = enabled
+            if sampling is not None:
+                service.sampling = sampling
+        await self.replay_on_workers()
         self.set_status(204)
 
     async def delete(self):
-        self.write(self.logs.json())
-        self.logs.reset()
+        data = await self.logs.json_async()
+        await self.logs.reset_async()
+        responses = await self.replay_on_workers()
+        self.write(merge_logs(data, [response.json() for response in responses]))
+
+
+class ManagementLogsExportHandler(ManagementBaseHandler):
+    """Streams the records of the traffic sink files that started in a time range, one chunk at a time."""
+
+    batch_size = 100
+
+    def initialize(self, logs):
+        self.logs = logs
+
+    async def get(self):
+        sink = self.logs.sink
+        if sink is None:
+            self.set_status(400)
+            self.write('Traffic sink is not enabled! Set MOCKINTOSH_TRAFFIC_SINK to enable it.')
+            return
+
+        log_filter = self.get_log_filter()
+        if log_filter is None:
+            return
+        fmt = self.get_query_argument('format', sink.format)
+        if fmt not in TRAFFIC_SINK_FORMATS:
+            self.set_status(400)
+            self.write('Format must be one of: %s' % ', '.join(TRAFFIC_SINK_FORMATS))
+            return
+
+        head, tail = har_envelope()
+        self.set_header('Content-Type', 'application/json; charset=UTF-8' if fmt == 'har' else 'application/x-ndjson')
+        entries = sink.scan(log_filter.start, log_filter.end)
+        try:
+            size = 0
+            first = True
+            if fmt == 'har':
+                self.write(head)
+            while True:
+                # The files and the database are read off the IOLoop, a batch of records scanned at a time
+                batch = await IOLoop.current().run_in_executor(None, take_entries, entries, self.batch_size)
+                if batch is None:
+                    break
+                for entry in batch:
+                    line = '%s%s\n' % (',' if fmt == 'har' and not first else '', entry)
+                    first = False
+                    self.write(line)
+                    size += len(line)
+                if size >= STREAM_CHUNK_SIZE:
+                    await self.flush()
+                    size = 0
+            if fmt == 'har':
+                self.write(tail)
+        except StreamClosedError:
+            logging.debug('Client closed the connection while exporting the traffic log.')
+        finally:
+            entries.close()
+
+
+class ManagementEventsHandler(ManagementBaseHandler):
+    """Pushes the changes of the statistics, the traffic log and the async actors as server-sent events."""
+
+    def initialize(self, hub):
+        self.hub = hub
+        self.subscriber = None
+
+    async def get(self):
+        topics = self.get_query_argument('topics', ','.join(self.hub.topics)).split(',')
+        unknown = [topic for topic in topics if topic not in self.hub.topics]
+        if unknown:
+            self.set_status(400)
+            self.write('Unknown topics: %s' % ', '.join(unknown))
+            return
+        since = self.get_query_argument('since', None)
+        try:
+            LogFilter(since=since)
+        except ValueError:
+            self.set_status(400)
+            self.write('Invalid traffic log cursor: %s' % since)
+            return
+
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.subscriber = Subscriber(self.request, topics, since=since)
+        self.hub.subscribe(self.subscriber)
+        try:
+            self.write(': connected\n\n')
+            await self.flush()
+            while True:
+                try:
+                    message = await asyncio.wait_for(self.subscriber.queue.get(), KEEP_ALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    message = b': keep-alive\n\n'
+                if message is None:
+                    break
+                self.write(message)
+                await self.flush()
+        except StreamClosedError:
+            logging.debug('Management UI disconnected from the events.')
+        finally:
+            self.hub.unsubscribe(self.subscriber)
+
+    def on_connection_close(self):
+        if self.subscriber is not None:
+            self.hub.unsubscribe(self.subscriber)
 
 
 class ManagementResetIteratorsHandler(ManagementBaseHandler):
@@ -300,6 +533,53 @@ class ManagementResetIteratorsHandler(ManagementBaseHandler):
             _reset_iterators(app)
         for app in AsyncService.services:
             _reset_iterators(app)
+        await self.replay_on_workers()
+        self.set_status(204)
+
+
+class ManagementFallbackCacheHandler(ManagementBaseHandler):
+    """Exports, preloads and flushes the record-and-replay caches of the `fallbackTo` upstreams."""
+
+    async def get(self):
+        data = {'upstreams': {}}
+        for name, upstream in upstreams.named().items():
+            if upstream.cache is not None:
+                data['upstreams'][name] = await IOLoop.current().run_in_executor(None, upstream.cache.export)
+
+        for response in await self.replay_on_workers():
+            for name, entries in response.json()['upstreams'].items():
+                keys = set(entry['key'] for entry in data['upstreams'].setdefault(name, []))
+                data['upstreams'][name] += [entry for entry in entries if entry['key'] not in keys]
+        self.write(data)
+
+    async def post(self):
+        try:
+            data = json.loads(self.request.body)
+            recordings = data['upstreams']
+        except (ValueError, KeyError, TypeError):
+            self.set_status(400)
+            self.write('Body must be a JSON object with the recordings of each upstream under "upstreams"!')
+            return
+
+        caches = {name: upstream.cache for name, upstream in upstreams.named().items() if upstream.cache is not None}
+        for name in recordings:
+            if name not in caches:
+                self.set_status(400)
+                self.write('No upstream with a cache is named: %s' % name)
+                return
+
+        for name, entries in recordings.items():
+            count = caches[name].preload(entries)
+            logging.info('Preloaded %d recordings of: %s', count, name)
+        await self.replay_on_workers()
+        self.set_status(204)
+
+    async def delete(self):
+        for upstream in upstreams.named().values():
+            if upstream.cache is not None:
+                # Waits for the queued writes of the persistent caches
+                await IOLoop.current().run_in_executor(None, upstream.cache.flush)
+        await self.replay_on_workers()
         self.set_status(204)
 
 
@@ -321,6 +601,9 @@ class ManagementUnhandledHandler(ManagementBaseHandler):
             new_service['endpoints'] = endpoints
             data['services'].append(new_service)
 
+        responses = await self.replay_on_workers(query={'format': 'json'})
+        merge_unhandled(data, [response.json() for response in responses], UNHANDLED_SERVICE_KEYS)
+
         if data['services'] and not self.validate(data):  # pragma: no cover
             return
 
@@ -336,6 +619,7 @@ class ManagementUnhandledHandler(ManagementBaseHandler):
                     if unhandled_data_enabled:
                         break_parent = True
                         break
+        unhandled_data_enabled = unhandled_data_enabled or self.is_unhandled_data_enabled_on_workers(responses)
 
         self.set_header('x-%s-unhandled-data' % PROGRAM.lower(), 'true' if unhandled_data_enabled else 'false')
 
@@ -356,14 +640,20 @@ class ManagementUnhandledHandler(ManagementBaseHandler):
         for service in AsyncService.services:
             service.tags = data
 
+        await self.replay_on_workers()
         self.set_status(204)
 
     async def delete(self):
         for i, _ in enumerate(self.http_server.unhandled_data.requests):
             for key, _ in self.http_server.unhandled_data.requests[i].items():
                 self.http_server.unhandled_data.requests[i][key] = []
+        await self.replay_on_workers()
         self.set_status(204)
 
+    def is_unhandled_data_enabled_on_workers(self, responses: list) -> bool:
+        header = 'x-%s-unhandled-data' % PROGRAM.lower()
+        return any(response.headers.get(header, None) == 'true' for response in responses)
+
     def build_unhandled_requests_headers(self, config_template: dict, request: Request, requests: dict) -> None:
         for key, value in request.headers._dict.items():
             continue_parent = False
@@ -623,6 +913,7 @@ class ManagementTagHandler(ManagementBaseHandler):
         for service in AsyncService.services:
             service.tags = data
 
+        await self.replay_on_workers()
         self.set_status(204)
 
 
@@ -690,6 +981,8 @@ class ManagementResourcesHandler(ManagementBaseHandler):
         self.write(data)
 
     async def post(self):
+        if self.drop_cached_files():
+            return
         cwd = self.http_server.definition.source_dir
         path = self.get_body_argument('path', default=None)
         orig_path = path
@@ -726,11 +1019,15 @@ class ManagementResourcesHandler(ManagementBaseHandler):
                 os.makedirs(os.path.dirname(path), exist_ok=True)
                 with open(path, 'w') as _file:
                     _file.write(file)
+            file_cache.invalidate()
+            await self.replay_on_workers()
             self.set_status(204)
         except InternalResourcePathCheckError:
             return
 
     async def delete(self):
+        if self.drop_cached_files():
+            return
         cwd = self.http_server.definition.source_dir
         path = self.get_query_argument('path', default=None)
         keep = self.get_query_argument('keep', default=False)
@@ -757,7 +1054,17 @@ class ManagementResourcesHandler(ManagementBaseHandler):
                     ref = os.path.dirname(ref)
         elif os.path.isdir(path):
             shutil.rmtree(path)
+        file_cache.invalidate()
+        await self.replay_on_workers()
+        self.set_status(204)
+
+    def drop_cached_files(self) -> bool:
+        """Answers the replay of a change by another worker, which has already written the shared files."""
+        if not workers.is_enabled() or not workers.is_local_request(self.request):
+            return False
+        file_cache.invalidate()
         self.set_status(204)
+        return True
 
     def check_path_empty(self, path: str) -> None:
         if not path:
@@ -799,9 +1106,8 @@ class ManagementResourcesHandler(ManagementBaseHandler):
 class ManagementServiceRootHandler(ManagementBaseHandler):
 
     async def get(self):
-        with open(os.path.join(__location__, 'res/management.html'), 'r') as file:
-            html = file.read()
-            self.write(html)
+        html, _ = file_cache.read_text(os.path.join(__location__, 'res/management.html'))
+        self.write(html)
 
 
 class ManagementServiceRootRedirectHandler(ManagementBaseHandler):
@@ -863,6 +1169,7 @@ class ManagementServiceConfigHandler(ManagementConfigHandler):
 
         self.update_service(definition.services[self.service_id], self.service_id)
 
+        await self.replay_on_workers()
         self.set_status(204)
 
 
@@ -873,10 +1180,14 @@ class ManagementServiceStatsHandler(ManagementBaseHandler):
         self.service_id = service_id
 
     async def get(self):
-        self.write(self.stats.services[self.service_id].json())
+        histograms = self.wants_histograms()
+        data = self.stats.services[self.service_id].json(histograms=histograms or workers.is_enabled())
+        responses = await self.replay_on_workers()
+        self.write(merge_stats(data, [response.json() for response in responses], histograms=histograms))
 
     async def delete(self):
         self.stats.services[self.service_id].reset()
+        await self.replay_on_workers()
         self.set_status(204)
 
 
@@ -887,17 +1198,33 @@ class ManagementServiceLogsHandler(ManagementBaseHandler):
         self.service_id = service_id
 
     async def get(self):
-        self.write(self.logs.services[self.service_id].json())
+        log_filter = self.get_log_filter()
+        if log_filter is None:
+            return
+        data = await self.logs.services[self.service_id].json_async(log_filter)
+        responses = await self.replay_on_workers()
+        self.write(merge_logs(data, [response.json() for response in responses]))
 
     async def post(self):
+        try:
+            sampling = _parse_sampling(self.get_body_argument('sampling', default=None))
+        except ValueError:
+            self.set_status(400)
+            self.write('Sampling rate must be a positive integer!')
+            return
         self.logs.services[self.service_id].enabled = not (
             self.get_body_argument('enable', default=True) in ('false', 'False', '0')
         )
+        if sampling is not None:
+            self.logs.services[self.service_id].sampling = sampling
+        await self.replay_on_workers()
         self.set_status(204)
 
     async def delete(self):
-        self.write(self.logs.services[self.service_id].json())
-        self.logs.services[self.service_id].reset()
+        data = await self.logs.services[self.service_id].json_async()
+        await self.logs.services[self.service_id].reset_async()
+        responses = await self.replay_on_workers()
+        self.write(merge_logs(data, [response.json() for response in responses]))
 
 
 class ManagementServiceResetIteratorsHandler(ManagementBaseHandler):
@@ -915,6 +1242,7 @@ class ManagementServiceResetIteratorsHandler(ManagementBaseHandler):
         app = self.http_server._apps.apps[service.internal_http_service_id]
 
         _reset_iterators(app)
+        await self.replay_on_workers()
         self.set_status(204)
 
 
@@ -933,6 +1261,9 @@ class ManagementServiceUnhandledHandler(ManagementUnhandledHandler):
         data['services'].append(dict((k, getattr(service, k)) for k in UNHANDLED_SERVICE_KEYS if getattr(service, k) is not None))
         data['services'][0]['endpoints'] = self.build_unhandled_requests(self.service_id)
 
+        responses = await self.replay_on_workers(query={'format': 'json'})
+        merge_unhandled(data, [response.json() for response in responses], UNHANDLED_SERVICE_KEYS)
+
         imaginary_config = copy.deepcopy(self.http_server.definition.data)
         imaginary_config['services'] = data['services']
 
@@ -943,6 +1274,7 @@ class ManagementServiceUnhandledHandler(ManagementUnhandledHandler):
                 if rule.target_kwargs['unhandled_data']:
                     unhandled_data_enabled = True
                 break
+        unhandled_data_enabled = unhandled_data_enabled or self.is_unhandled_data_enabled_on_workers(responses)
 
         self.set_header('x-%s-unhandled-data' % PROGRAM.lower(), 'true' if unhandled_data_enabled else 'false')
 
@@ -963,11 +1295,13 @@ class ManagementServiceUnhandledHandler(ManagementUnhandledHandler):
             if rule.target == GenericHandler:
                 rule.target_kwargs['unhandled_data'] = unhandled_data
 
+        await self.replay_on_workers()
         self.set_status(204)
 
     async def delete(self):
         for key, _ in self.http_server.unhandled_data.requests[self.service_id].items():
             self.http_server.unhandled_data.requests[self.service_id][key] = []
+        await self.replay_on_workers()
         self.set_status(204)
 
 
@@ -1017,6 +1351,7 @@ class ManagementServiceTagHandler(ManagementBaseHandler):
             if rule.target == GenericHandler:
                 rule.target_kwargs['tags'] = data
 
+        await self.replay_on_workers()
         self.set_status(204)
 
 
@@ -1031,18 +1366,9 @@ class ManagementAsyncHandler(ManagementBaseHandler):
         self.http_server = http_server
 
     async def get(self):
-        data = {
-            'producers': [],
-            'consumers': []
-        }
-
-        for producer in AsyncProducer.producers:
-            data['producers'].append(producer.info())
-
-        for consumer in AsyncConsumer.consumers:
-            data['consumers'].append(consumer.info())
-
-        self.dump(data)
+        if await self.forward_to_async_actors():
+            return
+        self.dump(_async_actors())
 
     def dump(self, data) -> None:
         _format = self.get_query_argument('format', default='json')
@@ -1059,6 +1385,8 @@ class ManagementAsyncProducersHandler(ManagementBaseHandler):
         self.http_server = http_server
 
     async def post(self, value):
+        if await self.forward_to_async_actors():
+            return
         if value.isnumeric():
             try:
                 index = int(value)
@@ -1128,6 +1456,8 @@ class ManagementAsyncConsumersHandler(ManagementBaseHandler):
         self.http_server = http_server
 
     async def get(self, value):
+        if await self.forward_to_async_actors():
+            return
         if value.isnumeric():
             try:
                 index = int(value)
@@ -1155,6 +1485,8 @@ class ManagementAsyncConsumersHandler(ManagementBaseHandler):
                 self.write(consumer.single_log_service.json())
 
     async def delete(self, value):
+        if await self.forward_to_async_actors():
+            return
         if value.isnumeric():
             try:
                 index = int(value)
@@ -7,11 +7,13 @@
 """
 
 import random
-import time
 from typing import (
-    Union
+    Union,
+    Tuple
 )
 
+from mockintosh.helpers import _delay, _delay_async
+
 
 class PerformanceProfile():
 
@@ -25,13 +27,25 @@ class PerformanceProfile():
         self.delay = delay
         self.faults = {} if faults is None else faults
 
+    def choose(self, status_code: int) -> Tuple[bool, Union[int, str]]:
+        """Decides whether the profile hits this request and which status code it ends up with."""
+        if random.uniform(0, 1) > self.ratio:
+            return False, status_code
+        if self.faults:
+            chosen = random.choices(list(self.faults.keys()), weights=self.faults.values(), k=1)[0]
+            if chosen != 'PASS':
+                return True, int(chosen) if chosen not in ('RST', 'FIN') else chosen
+        return True, status_code
+
     def trigger(self, status_code: int) -> Union[int, str]:
-        if random.uniform(0, 1) <= self.ratio:
-            time.sleep(self.delay)
-            if self.faults:
-                chosen = random.choices(list(self.faults.keys()), weights=self.faults.values(), k=1)[0]
-                if chosen == 'PASS':
-                    return status_code
-                else:
-                    return int(chosen) if chosen not in ('RST', 'FIN') else chosen
+        hit, status_code = self.choose(status_code)
+        if hit:
+            _delay(self.delay)
+        return status_code
+
+    async def trigger_async(self, status_code: int) -> Union[int, str]:
+        """Same as `trigger()` but the delay is awaited instead of blocking the IOLoop."""
+        hit, status_code = self.choose(status_code)
+        if hit:
+            await _delay_async(self.delay)
         return status_code
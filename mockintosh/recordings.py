@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: __init__
+    :synopsis: module that contains the record-and-replay cache of the `fallbackTo` responses.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import base64
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+from typing import (
+    List,
+    Tuple,
+    Union
+)
+
+from tornado.httputil import HTTPHeaders
+from tornado.ioloop import IOLoop
+
+FALLBACK_TO_CACHE_QUEUE_SIZE = int(os.environ.get('MOCKINTOSH_FALLBACK_TO_CACHE_QUEUE_SIZE', 1000))
+
+
+class CachedResponse:
+
+    def __init__(
+        self,
+        method: str,
+        path: str,
+        status: int,
+        headers: List[Tuple[str, str]],
+        body: bytes,
+        stored_at: Union[float, None] = None
+    ):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = time.time() if stored_at is None else stored_at
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(key) + len(value) for key, value in self.headers)
+
+    def json(self, key: str) -> dict:
+        return {
+            'key': key,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'headers': [list(header) for header in self.headers],
+            'body': base64.b64encode(self.body).decode(),
+            'storedAt': self.stored_at
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> Tuple[str, 'CachedResponse']:
+        return data['key'], cls(
+            data['method'],
+            data['path'],
+            int(data['status']),
+            [tuple(header) for header in data['headers']],
+            base64.b64decode(data['body']),
+            data.get('storedAt', None)
+        )
+
+
+class ResponseCache:
+    """Records the responses of an upstream to answer the identical requests locally.
+
+    Requests are identified by the method, the path, the query string with sorted parameters and,
+    if configured, the values of some headers and the hash of the body. The entries expire after
+    `ttl` seconds (never if `0`) and are kept in an LRU bounded to `max_size` bytes. With a `path`,
+    the entries are also written to an SQLite database that outlives the process and backs the LRU.
+
+    The request path never waits for the database: the writes are queued to a background thread, like
+    the traffic sinks do, and dropped and counted while the queue is full, and `get_async()` looks up
+    the database in an executor.
+    """
+
+    batch_size = 100
+
+    def __init__(
+        self,
+        ttl: float,
+        max_size: int,
+        key_headers: List[str],
+        key_body: bool,
+        path: Union[str, None] = None,
+        queue_size: int = FALLBACK_TO_CACHE_QUEUE_SIZE
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.key_headers = [header.lower() for header in key_headers]
+        self.key_body = key_body
+        self.path = path
+        self.queue_size = queue_size
+        self.entries = OrderedDict()
+        self.size = 0
+        # The LRU and the database are locked separately, a slow read does not hold up the LRU
+        self.lock = threading.Lock()
+        self.connection_lock = threading.Lock()
+        self.connection = None
+        self.queue = None
+        self.thread = None
+        if path is not None:
+            self.connection = self._connect()
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS recordings (key TEXT PRIMARY KEY, method TEXT NOT NULL, path TEXT NOT NULL, '
+                'status INTEGER NOT NULL, headers TEXT NOT NULL, body BLOB NOT NULL, stored_at REAL NOT NULL)'
+            )
+        self.reset()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def key(self, method: str, path: str, query: str, headers: HTTPHeaders, body: bytes) -> str:
+        hasher = hashlib.sha1()
+        hasher.update(method.upper().encode())
+        hasher.update(b'\0' + path.encode())
+        hasher.update(b'\0' + urlencode(sorted(parse_qsl(query, keep_blank_values=True))).encode())
+        for header in self.key_headers:
+            hasher.update(b'\0' + header.encode() + b':' + ','.join(headers.get_list(header)).encode())
+        if self.key_body:
+            hasher.update(b'\0' + hashlib.sha1(body).digest())
+        return hasher.hexdigest()
+
+    def _is_fresh(self, response: CachedResponse) -> bool:
+        return self.ttl <= 0 or time.time() - response.stored_at < self.ttl
+
+    def _store(self, key: str, response: CachedResponse) -> None:
+        if response.size > self.max_size:
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = response
+            self.size += response.size
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        response = self.entries.pop(key, None)
+        if response is not None:
+            self.size -= response.size
+
+    def _load(self, key: str) -> Union[CachedResponse, None]:
+        with self.connection_lock:
+            row = self.connection.execute(
+                'SELECT method, path, status, headers, body, stored_at FROM recordings WHERE key = ?',
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        method, path, status, headers, body, stored_at = row
+        return CachedResponse(method, path, status, [tuple(header) for header in json.loads(headers)], body, stored_at)
+
+    def _lookup(self, key: str) -> Union[CachedResponse, None]:
+        with self.lock:
+            response = self.entries.get(key, None)
+            if response is not None:
+                self.entries.move_to_end(key)
+        return response
+
+    def _count(self, key: str, response: Union[CachedResponse, None]) -> Union[CachedResponse, None]:
+        if response is not None and not self._is_fresh(response):
+            with self.lock:
+                self._remove(key)
+            response = None
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response
+
+    def get(self, key: str) -> Union[CachedResponse, None]:
+        response = self._lookup(key)
+        if response is None and self.connection is not None:
+            response = self._load(key)
+            if response is not None:
+                self._store(key, response)
+        return self._count(key, response)
+
+    async def get_async(self, key: str) -> Union[CachedResponse, None]:
+        """Same as `get()` but the database is looked up in an executor instead of the IOLoop."""
+        response = self._lookup(key)
+        if response is None and self.connection is not None:
+            response = await IOLoop.current().run_in_executor(None, self._load, key)
+            if response is not None:
+                self._store(key, response)
+        return self._count(key, response)
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        self._store(key, response)
+        if self.connection is None:
+            return
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait((key, response))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.thread = threading.Thread(target=self._run, name='fallback-to-cache', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def _run(self) -> None:
+        writer = self._connect()
+        running = True
+        while running:
+            items = [self.queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            puts = []
+            for item in items + [None]:
+                if isinstance(item, tuple):
+                    puts.append(item)
+                    continue
+                # The writes queued before a flush or the end are stored first
+                if puts:
+                    try:
+                        self._write(writer, puts)
+                        self.written += len(puts)
+                    except Exception as e:  # pragma: no cover
+                        self.errors += 1
+                        logging.error('Could not store %d recorded responses: %s', len(puts), e)
+                    puts = []
+                if isinstance(item, threading.Event):
+                    writer.execute('DELETE FROM recordings')
+                    item.set()
+            running = None not in items
+        writer.close()
+
+    def _write(self, writer: sqlite3.Connection, puts: List[Tuple[str, CachedResponse]]) -> None:
+        writer.execute('BEGIN IMMEDIATE')
+        try:
+            writer.executemany(
+                'INSERT OR REPLACE INTO recordings (key, method, path, status, headers, body, stored_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (key, response.method, response.path, response.status, json.dumps(response.headers), response.body, response.stored_at)
+                    for key, response in puts
+                ]
+            )
+            writer.execute('COMMIT')
+        except BaseException:
+            writer.execute('ROLLBACK')
+            raise
+
+    def close(self) -> None:
+        """Stores the queued writes and stops the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def flush(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        if self.connection is None:
+            return
+        # Through the writer, so that the writes queued before cannot bring the entries back
+        if self.thread is None:
+            self.start()
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def export(self) -> List[dict]:
+        """Returns the fresh entries, including the ones that are only on disk."""
+        entries = OrderedDict()
+        if self.connection is not None:
+            with self.connection_lock:
+                rows = self.connection.execute(
+                    'SELECT key, method, path, status, headers, body, stored_at FROM recordings'
+                ).fetchall()
+            for key, method, path, status, headers, body, stored_at in rows:
+                entries[key] = CachedResponse(method, path, status, [tuple(header) for header in json.loads(headers)], body, stored_at)
+        with self.lock:
+            entries.update(self.entries)
+        return [response.json(key) for key, response in entries.items() if self._is_fresh(response)]
+
+    def preload(self, data: List[dict]) -> int:
+        count = 0
+        for item in data:
+            try:
+                key, response = CachedResponse.from_json(item)
+            except (KeyError, TypeError, ValueError) as e:
+                logging.warning('Skipping an invalid recording: %s', e)
+                continue
+            self.put(key, response)
+            count += 1
+        return count
+
+    def json(self) -> dict:
+        data = {
+            'entries': len(self.entries),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+        if self.connection is not None:
+            data['queued'] = 0 if self.queue is None else self.queue.qsize()
+            data['written'] = self.written
+            data['dropped'] = self.dropped
+            data['errors'] = self.errors
+        return data
+
+    def reset(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
@@ -20,6 +20,7 @@ from typing import (
 
 import tornado.ioloop
 import tornado.web
+from tornado.netutil import bind_sockets, bind_unix_socket
 from tornado.routing import Rule, RuleRouter, HostMatches
 
 from mockintosh.config import ConfigService, ConfigExternalFilePath
@@ -31,7 +32,10 @@ from mockintosh.management import (
     ManagementConfigHandler,
     ManagementStatsHandler,
     ManagementLogsHandler,
+    ManagementLogsExportHandler,
+    ManagementEventsHandler,
     ManagementResetIteratorsHandler,
+    ManagementFallbackCacheHandler,
     ManagementUnhandledHandler,
     ManagementOasHandler,
     ManagementTagHandler,
@@ -48,15 +52,19 @@ from mockintosh.management import (
     ManagementServiceUnhandledHandler,
     ManagementServiceOasHandler,
     ManagementServiceTagHandler,
-    UnhandledData
+    UnhandledData,
+    create_event_hub
 )
 from mockintosh.services.asynchronous._looping import run_loops as async_run_loops, stop_loops as async_stop_loops
 from mockintosh.services.http import (
     HttpService,
     HttpPath,
-    HttpAlternative
+    HttpAlternative,
+    HttpRouteIndex
 )
 from mockintosh.stats import Stats
+from mockintosh.upstreams import upstreams
+from mockintosh.workers import workers
 
 __location__ = path.abspath(path.dirname(__file__))
 
@@ -72,6 +80,10 @@ class Impl:
     ):
         raise NotImplementedError
 
+    @abstractmethod
+    def listen(self, server, port: int, address: str):
+        raise NotImplementedError
+
     @abstractmethod
     def serve(self):
         raise NotImplementedError
@@ -101,6 +113,15 @@ class TornadoImpl(Impl):
         self.servers.append(server)
         return server
 
+    def listen(self, server: tornado.web.HTTPServer, port: int, address: str) -> None:
+        if not workers.is_enabled():
+            server.listen(port, address=address)
+            return
+
+        # Workers share the public port and each of them is reachable by the others on its own Unix socket
+        server.add_sockets(bind_sockets(port, address=address, reuse_port=True))
+        server.add_socket(bind_unix_socket(workers.socket_path(port)))
+
     def serve(self) -> None:
         self.ioloop = tornado.ioloop.IOLoop.current()
         logging.debug("Starting ioloop: %s", self.ioloop)
@@ -228,7 +249,7 @@ class HttpServer:
         if service.hostname is None:
             server = self.impl.get_server(app, ssl, ssl_options)
             logging.debug('Will listen: %s:%d', address_str, service.port)
-            server.listen(service.port, address=self.address)
+            self.impl.listen(server, service.port, self.address)
             self.services_log.append('Serving at %s://%s:%s%s' % (
                 protocol,
                 address_str,
@@ -279,7 +300,7 @@ class HttpServer:
                 router = RuleRouter(rules)
                 server = self.impl.get_server(router, ssl, ssl_options)
                 logging.debug('Listening on port: %s:%d', self.address, service.port)
-                server.listen(services[0].port, address=self.address)
+                self.impl.listen(server, services[0].port, self.address)
 
         self.load_management_api()
 
@@ -308,7 +329,11 @@ class HttpServer:
                 endpoint.response,
                 endpoint.multi_responses_looped,
                 endpoint.dataset_looped,
-                i
+                i,
+                matchers=endpoint.matchers,
+                internal_service_id=service.internal_service_id,
+                compress=endpoint.compress,
+                weak_etag=endpoint.weak_etag
             )
 
             if identifier not in new_endpoints:
@@ -333,7 +358,8 @@ class HttpServer:
             logging.info(service_log)
 
         logging.info('Mock server is ready!')
-        async_run_loops()
+        if workers.runs_async_actors():
+            async_run_loops()
         self.impl.serve()
 
     def make_app(
@@ -361,12 +387,13 @@ class HttpServer:
                     config_dir=self.definition.source_dir,
                     service_id=service.internal_service_id,
                     path_methods=path_methods,
+                    route_index=HttpRouteIndex(path_methods),
                     _globals=_globals,
                     definition_engine=self.definition.template_engine,
                     rendering_queue=self.definition.rendering_queue,
                     interceptors=self.interceptors,
                     unhandled_data=None,
-                    fallback_to=service.fallback_to,
+                    fallback_to=upstreams.get(service.fallback_to),
                     tags=self.tags
                 )
             )
@@ -509,6 +536,20 @@ class HttpServer:
                     logs=self.definition.logs
                 )
             ),
+            (
+                '/traffic-log/export',
+                ManagementLogsExportHandler,
+                dict(
+                    logs=self.definition.logs
+                )
+            ),
+            (
+                '/events',
+                ManagementEventsHandler,
+                dict(
+                    hub=create_event_hub(self)
+                )
+            ),
             (
                 '/reset-iterators',
                 ManagementResetIteratorsHandler,
@@ -523,6 +564,11 @@ class HttpServer:
                     http_server=self
                 )
             ),
+            (
+                '/fallback-cache',
+                ManagementFallbackCacheHandler,
+                dict()
+            ),
             (
                 '/oas',
                 ManagementOasHandler,
@@ -568,7 +614,7 @@ class HttpServer:
         ])
         logging.debug("Listening on port %s:%s", self.address, config_management.port)
         server = self.impl.get_server(app, ssl, ssl_options)
-        server.listen(config_management.port, address=self.address)
+        self.impl.listen(server, config_management.port, self.address)
         self.services_log.append('Serving management UI+API at %s://%s:%s' % (
             protocol,
             self.address if self.address else 'localhost',
@@ -28,6 +28,7 @@ from mockintosh.config import (
     ConfigExternalFilePath
 )
 from mockintosh.helpers import _delay
+from mockintosh.files import file_cache
 from mockintosh.handlers import AsyncHandler
 from mockintosh.replicas import Consumed
 from mockintosh.logs import Logs
@@ -145,14 +146,13 @@ class AsyncConsumer(AsyncConsumerProducerBase):
         json_schema = self.schema.payload
         if isinstance(json_schema, ConfigExternalFilePath):
             json_schema_path, _ = async_handler.resolve_relative_path(json_schema.path)
-            with open(json_schema_path, 'r') as file:
-                logging.info('Reading JSON schema file from path: %s', json_schema_path)
-                try:
-                    json_schema = json.load(file)
-                except json.decoder.JSONDecodeError:
-                    logging.warning('JSON decode error of the JSON schema file: %s', json_schema)
-                    return False
-                logging.debug('JSON schema: %s', json_schema)
+            logging.debug('Reading JSON schema file from path: %s', json_schema_path)
+            try:
+                json_schema = file_cache.read_json(json_schema_path)
+            except json.decoder.JSONDecodeError:
+                logging.warning('JSON decode error of the JSON schema file: %s', json_schema)
+                return False
+            logging.debug('JSON schema: %s', json_schema)
 
         try:
             json_data = json.loads(value)
@@ -201,7 +201,7 @@ class AsyncConsumer(AsyncConsumerProducerBase):
 
     def init_single_log_service(self) -> None:
         logs = Logs()
-        logs.add_service(self.actor.service.name if self.actor.service.name is not None else '')
+        logs.add_service(self.actor.service.name if self.actor.service.name is not None else '', capacity=max(self.capture_limit, 0))
         self.single_log_service = logs.services[0]
         self.single_log_service.enabled = True
 
@@ -245,9 +245,6 @@ class AsyncConsumerGroup:
         if len(matched_consumer.log) > matched_consumer.capture_limit:
             matched_consumer.log.pop(0)
 
-        if len(matched_consumer.single_log_service.records) > matched_consumer.capture_limit:
-            matched_consumer.single_log_service.records.pop(0)
-
         if matched_consumer.actor.producer is not None:
             consumed = Consumed()
             consumed.key = key
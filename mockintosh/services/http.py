@@ -6,21 +6,61 @@
     :synopsis: module that contains HTTP related classes.
 """
 
+import re
 import json
+import time
+import hashlib
+import email.utils
 from collections import OrderedDict
 from os import environ
 from typing import (
     Dict,
+    List,
+    Tuple,
     Union
 )
 
 from mockintosh.config import (
     ConfigSchema,
     ConfigExternalFilePath,
+    ConfigFallbackTo,
+    ConfigFallbackToGroup,
     ConfigResponse,
     ConfigMultiResponse,
     ConfigDataset
 )
+from mockintosh.state import Cursor
+
+TEMPLATE_MARKERS = ('{{', '{%', '{#')
+REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+class HttpMatcher:
+    """Precompiled `^value$` matcher of a header, query string, form, multipart or GraphQL variable value."""
+
+    def __init__(self, value: Union[str, int, float]):
+        self.text = str(value)
+        self.regex = '^%s$' % value
+        self.is_literal = re.escape(self.text) == self.text
+        self.pattern = None
+        if not self.is_literal:
+            try:
+                self.pattern = re.compile(self.regex)
+            except re.error:
+                # Reported at request time, as it used to be
+                pass
+
+    def match(self, text: str) -> bool:
+        if text == self.text:
+            return True
+        if self.is_literal:
+            return False
+        pattern = self.pattern if self.pattern is not None else re.compile(self.regex)
+        return pattern.search(text) is not None
+
+    @classmethod
+    def build_all(cls, values: Union[Dict[str, str], None]) -> Dict[str, 'HttpMatcher']:
+        return {} if values is None else {key: cls(value) for key, value in values.items()}
 
 
 class HttpBody:
@@ -40,6 +80,12 @@ class HttpBody:
         self.multipart = multipart
         self.graphql_variables = graphql_variables
         self.is_graphql_query = is_grapql_query
+        self.text_pattern = None
+        if self.text is not None:
+            try:
+                self.text_pattern = re.compile(self.text)
+            except re.error:
+                pass
 
     def oas(self, handler) -> Union[dict, None]:
         request_body = None
@@ -76,6 +122,77 @@ class HttpBody:
         return request_body
 
 
+class HttpStaticResponse:
+    """Pre-encoded status, headers and body of a response that renders the same on every request.
+
+    A `200` response with a body also carries a strong `Etag` hashed from the body and the time of its
+    build as `Last-Modified`, unless the configured headers define them.
+    """
+
+    def __init__(
+        self,
+        status: int,
+        headers: List[Tuple[str, str]],
+        text: Union[str, None]
+    ):
+        self.status = status
+        self.headers = headers
+        self.text = text
+        self.body = None if text is None else text.encode()
+        self.etag = None
+        self.last_modified = None
+        if status == 200 and self.body is not None:
+            self._set_validators()
+
+    def _set_validators(self) -> None:
+        configured = {key.title(): value for key, value in self.headers}
+        self.etag = configured.get('Etag', '"%s"' % hashlib.sha1(self.body).hexdigest())
+        if 'Etag' not in configured:
+            self.headers.append(('Etag', self.etag))
+
+        if 'Last-Modified' in configured:
+            try:
+                self.last_modified = email.utils.parsedate_to_datetime(configured['Last-Modified']).timestamp()
+            except (TypeError, ValueError):
+                pass
+        else:
+            self.last_modified = int(time.time())
+            self.headers.append(('Last-Modified', email.utils.formatdate(self.last_modified, usegmt=True)))
+
+    @staticmethod
+    def _is_template_free(text: str) -> bool:
+        # Jinja2 drops a single trailing newline, so such text is not rendered as is
+        return not any(marker in text for marker in TEMPLATE_MARKERS) and not text.endswith('\n')
+
+    @classmethod
+    def build(cls, response: Union[ConfigResponse, str, None]) -> Union['HttpStaticResponse', None]:
+        """Returns the pre-encoded form of `response` or `None` if it needs per-request work."""
+        if isinstance(response, str):
+            response = ConfigResponse(body=response)
+        if not isinstance(response, ConfigResponse):
+            return None
+
+        if response.trigger_async_producer is not None or not isinstance(response.status, int):
+            return None
+
+        text = response.body
+        if text is not None:
+            if not isinstance(text, str):
+                return None
+            if response.use_templating and not cls._is_template_free(text):
+                return None
+
+        headers = []
+        if response.headers is not None:
+            for key, value in response.headers.payload.items():
+                value = value[-1] if isinstance(value, list) and value else value
+                if not isinstance(value, str) or not cls._is_template_free(value) or key.title() == 'Set-Cookie':
+                    return None
+                headers.append((key, value))
+
+        return cls(response.status, headers, text)
+
+
 class HttpAlternativeBase:
 
     def __init__(
@@ -91,7 +208,10 @@ class HttpAlternativeBase:
         dataset: Union[ConfigDataset, None],
         response: Union[ConfigResponse, ConfigExternalFilePath, str, ConfigMultiResponse, None],
         multi_responses_looped: bool,
-        dataset_looped: bool
+        dataset_looped: bool,
+        matchers: Union[Dict[str, Dict[str, HttpMatcher]], None] = None,
+        compress: bool = False,
+        weak_etag: bool = False
     ):
         self.id = _id
         self.orig_path = orig_path
@@ -105,6 +225,9 @@ class HttpAlternativeBase:
         self.response = response
         self.multi_responses_looped = multi_responses_looped
         self.dataset_looped = dataset_looped
+        self.matchers = {} if matchers is None else matchers
+        self.compress = compress
+        self.weak_etag = weak_etag
 
 
 class HttpEndpoint(HttpAlternativeBase):
@@ -127,6 +250,9 @@ class HttpEndpoint(HttpAlternativeBase):
         response: Union[ConfigResponse, ConfigExternalFilePath, str, ConfigMultiResponse, None],
         multi_responses_looped: bool,
         dataset_looped: bool,
+        matchers: Union[Dict[str, Dict[str, HttpMatcher]], None] = None,
+        compress: bool = False,
+        weak_etag: bool = False
     ):
         super().__init__(
             _id,
@@ -140,7 +266,10 @@ class HttpEndpoint(HttpAlternativeBase):
             dataset,
             response,
             multi_responses_looped,
-            dataset_looped
+            dataset_looped,
+            matchers,
+            compress,
+            weak_etag
         )
         self.priority = priority
         self.path = path
@@ -163,7 +292,7 @@ class HttpService:
         management_root: Union[str, None],
         oas: Union[str, ConfigExternalFilePath, None],
         performance_profile: Union[str, None],
-        fallback_to: Union[str, None],
+        fallback_to: Union[ConfigFallbackTo, ConfigFallbackToGroup, None],
         internal_service_id: int,
         internal_http_service_id: Union[int, None] = None
     ):
@@ -209,6 +338,97 @@ class HttpPath:
         return 'priority: %s, methods: %s' % (self.priority, self.methods)
 
 
+class HttpRouteIndex:
+    """Compiled lookup structure for the `(path, methods)` list of a service.
+
+    Paths without regex metacharacters go into a dictionary. The other paths go into a trie keyed
+    by their leading literal segments, and the patterns stored on a trie node are combined into a
+    single regex. A lookup returns the same entry as a `re.fullmatch()` scan of the list in its
+    original (priority) order would.
+    """
+
+    def __init__(self, path_methods: List[Tuple[str, dict]]):
+        self.entries = []
+        self.literals = {}
+        self.root = _HttpRouteNode()
+
+        for order, (path, methods) in enumerate(path_methods):
+            self.entries.append((
+                re.compile(path),
+                {key.lower(): value for key, value in methods.items()}
+            ))
+            if not REGEX_METACHARACTERS.intersection(path):
+                self.literals.setdefault(path, order)
+                continue
+
+            node = self.root
+            for segment in path.split('/')[:-1]:
+                if REGEX_METACHARACTERS.intersection(segment):
+                    break
+                node = node.children.setdefault(segment, _HttpRouteNode())
+            node.orders.append(order)
+
+        self.root.compile(self.entries)
+
+    def lookup(self, request_path: str) -> Union[Tuple[dict, tuple], None]:
+        """Returns the lowercased methods and the captured path arguments of the matching path."""
+        order = self.literals.get(request_path, None)
+
+        node = self.root
+        segments = request_path.split('/')[:-1]
+        i = 0
+        while node is not None:
+            candidate = node.match(request_path, self.entries)
+            if candidate is not None and (order is None or candidate < order):
+                order = candidate
+            if i == len(segments):
+                break
+            node = node.children.get(segments[i], None)
+            i += 1
+
+        if order is None:
+            return None
+
+        pattern, methods = self.entries[order]
+        custom_args = ()
+        groups = pattern.findall(request_path)
+        if isinstance(groups[0], tuple):
+            custom_args = groups[0]
+        elif groups:
+            custom_args = tuple(groups)
+        return methods, custom_args
+
+
+class _HttpRouteNode:
+
+    def __init__(self):
+        self.children = {}
+        self.orders = []
+        self.combined = None
+
+    def compile(self, entries: list) -> None:
+        patterns = [entries[order][0].pattern for order in self.orders]
+        # Numbered backreferences and named groups would not survive the renumbering
+        if len(patterns) > 1 and not any(re.search(r'\\[1-9]|\(\?P', pattern) for pattern in patterns):
+            try:
+                self.combined = re.compile('|'.join(
+                    '(?P<_%d>%s)' % (order, pattern) for order, pattern in zip(self.orders, patterns)
+                ))
+            except re.error:  # pragma: no cover
+                self.combined = None
+        for child in self.children.values():
+            child.compile(entries)
+
+    def match(self, request_path: str, entries: list) -> Union[int, None]:
+        if self.combined is not None:
+            match = self.combined.fullmatch(request_path)
+            return None if match is None else int(match.lastgroup[1:])
+        for order in self.orders:
+            if entries[order][0].fullmatch(request_path):
+                return order
+        return None
+
+
 class HttpAlternative(HttpAlternativeBase):
 
     def __init__(
@@ -225,7 +445,11 @@ class HttpAlternative(HttpAlternativeBase):
         response: Union[ConfigResponse, ConfigExternalFilePath, str, ConfigMultiResponse, None],
         multi_responses_looped: bool,
         dataset_looped: bool,
-        internal_endpoint_id: int
+        internal_endpoint_id: int,
+        matchers: Union[Dict[str, Dict[str, HttpMatcher]], None] = None,
+        internal_service_id: int = 0,
+        compress: bool = False,
+        weak_etag: bool = False
     ):
         super().__init__(
             _id,
@@ -239,12 +463,34 @@ class HttpAlternative(HttpAlternativeBase):
             dataset,
             response,
             multi_responses_looped,
-            dataset_looped
+            dataset_looped,
+            matchers,
+            compress,
+            weak_etag
         )
-        self.multi_responses_index = None
-        self.dataset_index = None
         self.internal_endpoint_id = internal_endpoint_id
+        self.multi_responses_cursor = Cursor('%d:%d:multi_responses' % (internal_service_id, internal_endpoint_id))
+        self.dataset_cursor = Cursor('%d:%d:dataset' % (internal_service_id, internal_endpoint_id))
         self.counters = {}
+        self.static_responses = self.build_static_responses()
+
+    def build_static_responses(self) -> list:
+        """Pre-encodes the responses of this alternative, aligned with the multi-response cursor."""
+        if self.dataset is not None or self.performance_profile is not None or self.response is None:
+            return []
+        if isinstance(self.response, ConfigMultiResponse):
+            return [HttpStaticResponse.build(response) for response in self.response.payload]
+        return [HttpStaticResponse.build(self.response)]
+
+    def get_static_response(self, index: int = 0) -> Union[HttpStaticResponse, None]:
+        """Returns the pre-encoded form of the response at `index`, if there is one."""
+        if not self.static_responses:
+            return None
+        return self.static_responses[index]
+
+    def reset_cursors(self) -> None:
+        self.multi_responses_cursor.reset()
+        self.dataset_cursor.reset()
 
     def oas(self, path_params: list, query_string: dict, handler) -> dict:
         method_data = {'responses': {}}
@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: __init__
+    :synopsis: module that contains the backends that keep the counters and the response cursors.
+"""
+
+import os
+import mmap
+import struct
+import sqlite3
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import (
+    Dict,
+    Union
+)
+
+from mockintosh.constants import PROGRAM
+from mockintosh.workers import workers
+
+STATE_BACKEND = os.environ.get('MOCKINTOSH_STATE_BACKEND', '')
+STATE_PATH = os.environ.get('MOCKINTOSH_STATE_PATH', '')
+STATE_MMAP_SLOTS = int(os.environ.get('MOCKINTOSH_STATE_MMAP_SLOTS', 4096))
+
+
+class StateBackend:
+    """Integer key-value store behind the counters and the response cursors.
+
+    `increment()` must be atomic for every process that shares the backend.
+    """
+
+    def get(self, key: str) -> int:
+        raise NotImplementedError
+
+    def set(self, key: str, value: int) -> None:
+        raise NotImplementedError
+
+    def increment(self, key: str, amount: int = 1) -> int:
+        """Adds `amount` to the value of `key` (0 if unset) and returns the new value."""
+        raise NotImplementedError
+
+    def items(self, prefix: str = '') -> Dict[str, int]:
+        raise NotImplementedError
+
+
+class DictStateBackend(StateBackend):
+    """Keeps the values in a plain dictionary.
+
+    The templates are rendered on the serving thread, the rendering thread pool and the threads of
+    the asynchronous actors, so the read-modify-write of `increment()` and the iteration of `items()`
+    are guarded by a lock.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> int:
+        return self.data.get(key, 0)
+
+    def set(self, key: str, value: int) -> None:
+        with self.lock:
+            self.data[key] = value
+
+    def increment(self, key: str, amount: int = 1) -> int:
+        with self.lock:
+            value = self.data.get(key, 0) + amount
+            self.data[key] = value
+        return value
+
+    def items(self, prefix: str = '') -> Dict[str, int]:
+        with self.lock:
+            return {key: value for key, value in self.data.items() if key.startswith(prefix)}
+
+
+class MmapStateBackend(StateBackend):
+    """Keeps the values in a memory-mapped file that all the `--workers` processes map.
+
+    The file starts with the number of used slots, followed by fixed size slots that each hold a signed
+    64-bit value and the UTF-8 encoded key. Slots are appended and never freed, so every process caches
+    the offsets of the keys it has seen. Writers take an exclusive `lockf()` lock on the file.
+    """
+
+    HEADER = struct.Struct('<q')
+    SLOT = struct.Struct('<qH118s')
+    VALUE = struct.Struct('<q')
+
+    def __init__(self, path: str, slots: int = STATE_MMAP_SLOTS):
+        import fcntl
+        self._fcntl = fcntl
+
+        self.path = path
+        self.slots = slots
+        self.thread_lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.HEADER.size + self.slots * self.SLOT.size
+        with self._locked():
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.offsets = {}
+
+    @contextmanager
+    def _locked(self):
+        with self.thread_lock:
+            self._fcntl.lockf(self.fd, self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.lockf(self.fd, self._fcntl.LOCK_UN)
+
+    def _scan(self):
+        used = self.HEADER.unpack_from(self.map, 0)[0]
+        for i in range(used):
+            offset = self.HEADER.size + i * self.SLOT.size
+            value, length, name = self.SLOT.unpack_from(self.map, offset)
+            yield offset, name[:length].decode(), value
+
+    def _find(self, key: str, create: bool) -> Union[int, None]:
+        """Returns the offset of the slot of `key`, must be called with the lock held when `create` is set."""
+        if key in self.offsets:
+            return self.offsets[key]
+
+        for offset, name, _ in self._scan():
+            self.offsets[name] = offset
+        if key in self.offsets or not create:
+            return self.offsets.get(key, None)
+
+        encoded = key.encode()
+        if len(encoded) > self.SLOT.size - self.VALUE.size - 2:
+            raise ValueError('State key is too long: %r' % key)
+        used = self.HEADER.unpack_from(self.map, 0)[0]
+        if used >= self.slots:
+            raise RuntimeError('The state file %s is full, increase MOCKINTOSH_STATE_MMAP_SLOTS.' % self.path)
+
+        offset = self.HEADER.size + used * self.SLOT.size
+        self.SLOT.pack_into(self.map, offset, 0, len(encoded), encoded)
+        self.HEADER.pack_into(self.map, 0, used + 1)
+        self.offsets[key] = offset
+        return offset
+
+    def get(self, key: str) -> int:
+        offset = self._find(key, False)
+        return 0 if offset is None else self.VALUE.unpack_from(self.map, offset)[0]
+
+    def set(self, key: str, value: int) -> None:
+        with self._locked():
+            self.VALUE.pack_into(self.map, self._find(key, True), value)
+
+    def increment(self, key: str, amount: int = 1) -> int:
+        with self._locked():
+            offset = self._find(key, True)
+            value = self.VALUE.unpack_from(self.map, offset)[0] + amount
+            self.VALUE.pack_into(self.map, offset, value)
+        return value
+
+    def items(self, prefix: str = '') -> Dict[str, int]:
+        return {name: value for _, name, value in self._scan() if name.startswith(prefix)}
+
+
+class SqliteStateBackend(StateBackend):
+    """Keeps the values in an SQLite database so that they survive restarts.
+
+    The counters are read on every templated render, so `items()` caches its results per prefix. The
+    cache is updated by the writes of this process and dropped once `PRAGMA data_version` tells that
+    another connection has changed the database.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.data_version = None
+        self.cache = {}
+
+    def _cache(self, key: str, value: int) -> None:
+        for prefix, values in self.cache.items():
+            if key.startswith(prefix):
+                values[key] = value
+
+    def get(self, key: str) -> int:
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def set(self, key: str, value: int) -> None:
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                (key, value)
+            )
+            self._cache(key, value)
+
+    def increment(self, key: str, amount: int = 1) -> int:
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.execute(
+                    'INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = value + excluded.value',
+                    (key, amount)
+                )
+                value = self.connection.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()[0]
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+            self._cache(key, value)
+        return value
+
+    def items(self, prefix: str = '') -> Dict[str, int]:
+        with self.lock:
+            data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.cache.clear()
+            if prefix not in self.cache:
+                self.cache[prefix] = dict(self.connection.execute(
+                    'SELECT key, value FROM state WHERE substr(key, 1, ?) = ?',
+                    (len(prefix), prefix)
+                ).fetchall())
+            return dict(self.cache[prefix])
+
+
+def create_backend(name: str = STATE_BACKEND, path: str = STATE_PATH) -> StateBackend:
+    """Creates the backend selected by `MOCKINTOSH_STATE_BACKEND`.
+
+    Without a selection, the `--workers` mode shares an `mmap` backend and a single process uses `dict`.
+    """
+    if not name:
+        name = 'mmap' if workers.is_enabled() else 'dict'
+
+    if name == 'dict':
+        return DictStateBackend()
+    elif name == 'mmap':
+        if not path:
+            directory = workers.socket_dir if workers.socket_dir is not None else tempfile.mkdtemp(prefix='%s-' % PROGRAM)
+            path = os.path.join(directory, 'state.mmap')
+        return MmapStateBackend(path)
+    elif name == 'sqlite':
+        return SqliteStateBackend(path or '%s-state.db' % PROGRAM)
+    raise ValueError('Unknown state backend: %r' % name)
+
+
+class State:
+    """Lazily created state backend, so that the `--workers` processes create theirs after the fork."""
+
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def backend(self) -> StateBackend:
+        if self._backend is None:
+            self._backend = create_backend()
+            logging.debug('Using the %s state backend.', self._backend.__class__.__name__)
+        return self._backend
+
+    @backend.setter
+    def backend(self, value: StateBackend) -> None:
+        self._backend = value
+
+
+state = State()
+
+
+class Counters:
+    """The `counter` template helper values, stored in the state backend."""
+
+    PREFIX = 'counter:'
+
+    def increment(self, name: str) -> int:
+        return state.backend.increment(self.PREFIX + name)
+
+    @property
+    def data(self) -> Dict[str, int]:
+        return {key[len(self.PREFIX):]: value for key, value in state.backend.items(self.PREFIX).items()}
+
+
+class Cursor:
+    """Position of a multi-response or dataset iteration, stored in the state backend.
+
+    `advance()` hands out the positions 0, 1, 2, ... atomically, so the processes sharing the backend
+    never select the same item for two requests.
+    """
+
+    PREFIX = 'cursor:'
+
+    def __init__(self, key: str):
+        self.key = self.PREFIX + key
+
+    def advance(self) -> int:
+        return state.backend.increment(self.key) - 1
+
+    def reset(self) -> None:
+        state.backend.set(self.key, 0)
+
+
+counters = Counters()
@@ -6,7 +6,86 @@
     :synopsis: module that contains statistics tracking classes.
 """
 
+import os
 from collections import Counter
+from typing import Union
+
+STATS_HISTOGRAM_PRECISION = int(os.environ.get('MOCKINTOSH_STATS_HISTOGRAM_PRECISION', 7))
+PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+
+class LatencyHistogram:
+    """Counts the response times in microseconds in log-linear buckets, like an HDR histogram.
+
+    Every power of two is split into `2 ** precision` buckets of the same width, so a percentile is
+    off by less than `2 ** -precision` of its value (0.8% by default) and the number of buckets is
+    bounded whatever the number of recorded values: less than 3400 for the response times up to an
+    hour. The buckets are kept sparse and two histograms are merged by summing their counters.
+    """
+
+    def __init__(self, precision: int = STATS_HISTOGRAM_PRECISION):
+        self.precision = precision
+        self.buckets = Counter()
+        self.count = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        shift = max(0, value.bit_length() - self.precision - 1)
+        return (shift << self.precision) + (value >> shift)
+
+    def _highest(self, index: int) -> int:
+        # The highest value that falls into the bucket
+        shift = max(0, (index >> self.precision) - 1)
+        return ((index - (shift << self.precision) + 1) << shift) - 1
+
+    def record(self, elapsed_time_in_seconds: Union[int, float]) -> None:
+        value = max(0, int(elapsed_time_in_seconds * 1000000))
+        self.buckets[self._index(value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, quantile: float) -> float:
+        """Returns the response time in seconds under which `quantile` of the recorded ones fall."""
+        if self.count == 0:
+            return 0
+        rank = max(1, quantile * self.count)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self._highest(index), self.max) / 1000000
+        return self.max / 1000000  # pragma: no cover
+
+    def percentiles(self) -> dict:
+        data = {name: self.percentile(quantile) for name, quantile in PERCENTILES}
+        data['max'] = self.max / 1000000
+        return data
+
+    def json(self) -> dict:
+        return {
+            'precision': self.precision,
+            'max_value': self.max,
+            'buckets': {str(index): count for index, count in sorted(self.buckets.items())}
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'LatencyHistogram':
+        histogram = cls(data['precision'])
+        histogram.buckets.update({int(index): count for index, count in data['buckets'].items()})
+        histogram.count = sum(histogram.buckets.values())
+        histogram.max = data['max_value']
+        return histogram
+
+    def reset(self) -> None:
+        self.buckets = Counter()
+        self.count = 0
+        self.max = 0
 
 
 class BaseStats:
@@ -17,6 +96,7 @@ class BaseStats:
         self.request_counter = 0
         self.status_code_distribution = Counter()
         self.total_resp_time = 0
+        self.resp_time_histogram = LatencyHistogram()
 
     def increase_request_counter(self) -> None:
         self.request_counter += 1
@@ -27,6 +107,7 @@ class BaseStats:
 
     def add_request_elapsed_time(self, elapsed_time_in_seconds: int) -> None:
         self.total_resp_time += elapsed_time_in_seconds
+        self.resp_time_histogram.record(elapsed_time_in_seconds)
 
         method = getattr(self.parent, "add_request_elapsed_time", None)
         if callable(method):
@@ -39,22 +120,30 @@ class BaseStats:
         if callable(method):
             method(status_code)
 
-    def json(self) -> dict:
+    def _json(self, histograms: bool = False) -> dict:
+        data = {
+            'request_counter': self.request_counter,
+            'avg_resp_time': self.total_resp_time / self.request_counter if self.request_counter != 0 else 0,
+            'resp_time_percentiles': self.resp_time_histogram.percentiles()
+        }
+        if histograms:
+            data['resp_time_histogram'] = self.resp_time_histogram.json()
+        data['status_code_distribution'] = dict(self.status_code_distribution)
+        return data
+
+    def json(self, histograms: bool = False) -> dict:
+        """Returns the counters, with the histograms of the response times only if `histograms` is set."""
         data = {}
 
         if hasattr(self, 'hint'):
             data['hint'] = self.hint
 
-        data.update({
-            'request_counter': self.request_counter,
-            'avg_resp_time': self.total_resp_time / self.request_counter if self.request_counter != 0 else 0,
-            'status_code_distribution': dict(self.status_code_distribution)
-        })
+        data.update(self._json(histograms))
 
         if hasattr(self, 'endpoints'):
             data['endpoints'] = []
             for endpoint in self.endpoints:
-                data['endpoints'].append(endpoint.json())
+                data['endpoints'].append(endpoint.json(histograms))
 
         return data
 
@@ -62,6 +151,7 @@ class BaseStats:
         self.request_counter = 0
         self.status_code_distribution = Counter()
         self.total_resp_time = 0
+        self.resp_time_histogram.reset()
 
         if hasattr(self, 'services'):
             for child in self.services:
@@ -95,8 +185,13 @@ class Stats(ServiceStats):
 
     def __init__(self):
         self.services = []
+        self.components = {}
         super().__init__(None)
 
+    def add_component(self, name: str, component) -> None:
+        """Registers an object with `json()` and `reset()` methods to be reported under `name`."""
+        self.components[name] = component
+
     def add_service(self, hint: str) -> None:
         service_stats = ServiceStats(hint)
         service_stats.parent = self
@@ -107,17 +202,22 @@ class Stats(ServiceStats):
         service_stats.hint = hint
         service_stats.reset()
 
-    def json(self) -> dict:
+    def json(self, histograms: bool = False) -> dict:
         data = {
-            'global': {
-                'request_counter': self.request_counter,
-                'avg_resp_time': self.total_resp_time / self.request_counter if self.request_counter != 0 else 0,
-                'status_code_distribution': dict(self.status_code_distribution)
-            },
+            'global': self._json(histograms),
             'services': []
         }
 
         for service in self.services:
-            data['services'].append(service.json())
+            data['services'].append(service.json(histograms))
+
+        for name, component in self.components.items():
+            data[name] = component.json()
 
         return data
+
+    def reset(self) -> None:
+        super().reset()
+
+        for component in self.components.values():
+            component.reset()
@@ -10,28 +10,113 @@ import copy
 import logging
 import os
 import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
 
 from faker import Faker
+from tornado.ioloop import IOLoop
 from jinja2 import Environment, StrictUndefined
 from jinja2.exceptions import TemplateSyntaxError, UndefinedError
 from pybars import Compiler, PybarsError
 
-from mockintosh.constants import PYBARS, JINJA, JINJA_VARNAME_DICT, SPECIAL_CONTEXT
+from mockintosh.constants import PROGRAM, PYBARS, JINJA, JINJA_VARNAME_DICT, SPECIAL_CONTEXT
 from mockintosh.hbs.methods import HbsFaker, tojson, fromjson, array, replace
 from mockintosh.helpers import _to_camel_case
 from mockintosh.j2.meta import find_undeclared_variables_in_order
 
-cov_no_import = environ.get('COVERAGE_NO_IMPORT', False)
-if not cov_no_import:
-    import queue
-
 compiler = Compiler()
+compiler_lock = threading.Lock()
 faker_locale = os.getenv('MOCKINTOSH_FAKER_LOCALE', None)
 faker = Faker(faker_locale)
 hbs_faker = HbsFaker(faker_locale)
 
 debug_mode = environ.get('MOCKINTOSH_DEBUG', False)
+rendering_workers = int(environ.get('MOCKINTOSH_RENDERING_WORKERS', 0))
+template_cache_size = int(environ.get('MOCKINTOSH_TEMPLATE_CACHE_SIZE', 1024))
+
+
+class TemplateCache:
+    """Bounded LRU cache of compiled templates keyed by the template source."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text: str, compile_callback):
+        with self.lock:
+            if text in self.entries:
+                self.entries.move_to_end(text)
+                self.hits += 1
+                return self.entries[text]
+            self.misses += 1
+
+        compiled = compile_callback(text)
+
+        if self.max_size > 0:
+            with self.lock:
+                self.entries[text] = compiled
+                self.entries.move_to_end(text)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return compiled
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def json(self) -> dict:
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def reset(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class TemplateCaches:
+    """Holds a `TemplateCache` per templating engine."""
+
+    def __init__(self, max_size: int):
+        self.engines = {
+            PYBARS: TemplateCache(max_size),
+            JINJA: TemplateCache(max_size)
+        }
+
+    def __getitem__(self, engine: str) -> TemplateCache:
+        return self.engines[engine]
+
+    def json(self) -> dict:
+        return {engine: cache.json() for engine, cache in self.engines.items()}
+
+    def reset(self) -> None:
+        for cache in self.engines.values():
+            cache.reset()
+
+
+template_caches = TemplateCaches(template_cache_size)
+jinja_compile_env = Environment(undefined=StrictUndefined, autoescape=False)
+
+
+def _compile_handlebars(text: str):
+    with compiler_lock:
+        return compiler.compile(text)
+
+
+def _compile_jinja(text: str) -> tuple:
+    ast = jinja_compile_env.parse(text)
+    return jinja_compile_env.compile(ast), find_undeclared_variables_in_order(ast)
 
 
 class RenderingTask:
@@ -54,27 +139,28 @@ class RenderingTask:
         self.counters = counters
         self.keys_to_delete = []
         self.one_and_only_var = None
-        self.result_queue = queue.Queue()
+        self.result = None
 
     def render(self):
         self.update_counters()
 
         if self.engine == PYBARS:
-            self.result_queue.put(self.render_handlebars())
+            self.result = self.render_handlebars()
         elif self.engine == JINJA:
-            self.result_queue.put(self.render_jinja())
+            self.result = self.render_jinja()
+        return self.result
 
     def update_counters(self) -> None:
         if self.counters is None:
             return
 
-        for key, value in self.counters.data.items():
+        for key, value in list(self.counters.data.items()):
             self.inject_objects[key] = value
 
     def render_handlebars(self):
         context, helpers = self.add_globals(compiler._compiler, helpers={})
         try:
-            template = compiler.compile(self.text)
+            template = template_caches[PYBARS].get(self.text, _compile_handlebars)
             compiled = template(context, helpers=helpers)
         except (PybarsError, TypeError, SyntaxError) as e:
             if self.fill_undefineds_with is not None and str(e).startswith('Could not find variable'):
@@ -100,19 +186,20 @@ class RenderingTask:
             env.globals[JINJA_VARNAME_DICT] = {}
 
         try:
-            ast = env.parse(self.text)
+            code, variables = template_caches[JINJA].get(self.text, _compile_jinja)
+            undeclared_variables = [var for var in variables if var not in env.globals]
             if self.fill_undefineds_with is not None:
-                for var in find_undeclared_variables_in_order(ast):
+                for var in undeclared_variables:
                     env.globals[var] = self.fill_undefineds_with
                     self.keys_to_delete.append(var)
                     if self.one_and_only_var is None:
                         self.one_and_only_var = var
             else:
-                for var in find_undeclared_variables_in_order(ast):
+                for var in undeclared_variables:
                     logging.warning('Jinja2: Could not find variable `%s`', var)
                     env.globals[var] = '{{%s}}' % var
 
-            template = env.from_string(self.text)
+            template = env.template_class.from_code(env, code, env.make_globals(None), None)
             compiled = template.render()
         except (TemplateSyntaxError, TypeError, UndefinedError) as e:
             if debug_mode:
@@ -167,40 +254,40 @@ class RenderingTask:
 
 
 class RenderingQueue:
-
-    def __init__(self):
-        if cov_no_import:
-            self._in = None
-        else:
-            self._in = queue.Queue()
+    """The rendering engine shared by all the services.
+
+    Renders the tasks directly on the calling thread. If `workers` is greater than zero,
+    `push_async()` offloads the tasks into a thread pool of that size so that the IOLoop
+    is not blocked by heavy templates.
+
+    The tasks of the HTTP handlers, of the pool and of the asynchronous actors' threads run
+    concurrently: the compiled templates cache and the state backends behind the `counter`
+    helper are thread-safe, everything else a task touches is its own.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = rendering_workers if workers is None else workers
+        self.executor = None
+        if self.workers > 0:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix='%s-rendering' % PROGRAM
+            )
 
     def push(self, task: RenderingTask) -> None:
-        self._in.put(task)
-
-    def pop(self) -> RenderingTask:
-        return self._in.get(block=True)
-
-
-class RenderingJob(threading.Thread):
-
-    def __init__(self, _queue: RenderingQueue):
-        threading.Thread.__init__(self)
-        self.queue = _queue
-        self.stop = False
-
-    def run(self):
-        while True:
-            if self.stop:
-                break
-
-            task = self.queue.pop()
+        task.render()
 
+    async def push_async(self, task: RenderingTask) -> None:
+        if self.executor is None:
             task.render()
+            return
 
-    def kill(self):
-        self.stop = True
-        # To pass `task = self.queue.pop()` line, send a dummy task
-        self.queue.push(RenderingTask(PYBARS, 'dummy'))
+        await IOLoop.current().run_in_executor(self.executor, task.render)
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
 
 
 class TemplateRenderer:
@@ -231,10 +318,35 @@ class TemplateRenderer:
         )
         _queue.push(task)
 
-        while True:
-            result = task.result_queue.get(block=True)
+        return self.collect(task)
+
+    async def render_async(
+            self,
+            engine,
+            text,
+            _queue,
+            inject_objects=None,
+            inject_methods=None,
+            add_params_callback=None,
+            fill_undefineds_with=None,
+            counters=None
+    ):
+        """Awaitable version of `render()` that lets the rendering engine offload the task."""
+        task = RenderingTask(
+            engine,
+            text,
+            inject_objects=inject_objects if inject_objects else {},
+            inject_methods=inject_methods if inject_methods else [],
+            add_params_callback=add_params_callback,
+            fill_undefineds_with=fill_undefineds_with,
+            counters=counters
+        )
+        await _queue.push_async(task)
+
+        return self.collect(task)
 
-            self.keys_to_delete = task.keys_to_delete
-            self.one_and_only_var = task.one_and_only_var
+    def collect(self, task: RenderingTask):
+        self.keys_to_delete = task.keys_to_delete
+        self.one_and_only_var = task.one_and_only_var
 
-            return result
+        return task.result
@@ -0,0 +1,523 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: __init__
+    :synopsis: module that contains the HTTP clients of the `fallbackTo` upstreams.
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import ipaddress
+from collections import deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Union
+)
+
+import httpx
+
+from mockintosh.config import (
+    ConfigFallbackTo,
+    ConfigFallbackToCache,
+    ConfigFallbackToCircuitBreaker,
+    ConfigFallbackToGroup
+)
+from mockintosh.recordings import ResponseCache
+from mockintosh.exceptions import UpstreamCircuitOpen
+
+FALLBACK_TO_TIMEOUT = int(os.environ.get('MOCKINTOSH_FALLBACK_TO_TIMEOUT', 30))
+
+
+def _create_cache(config: Union[ConfigFallbackToCache, None]) -> Union[ResponseCache, None]:
+    if config is None:
+        return None
+    return ResponseCache(config.ttl, config.max_size, config.key_headers, config.key_body, config.path)
+
+
+def _coalesce_key(method: str, path: str, headers: dict) -> tuple:
+    return method, path, tuple(sorted((name.lower(), value) for name, value in headers.items()))
+
+
+async def _coalesce(pending: dict, key: Hashable, call: Callable[[], Awaitable]) -> Any:
+    """Awaits `call()`, or the outcome of the identical call already in flight in `pending`."""
+    future = pending.get(key, None)
+    if future is not None:
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    pending[key] = future
+    try:
+        result = await call()
+    except Exception as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved in case there is no one waiting for it
+        future.exception()
+        raise
+    except BaseException:
+        future.cancel()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del pending[key]
+
+
+def _is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class DnsCache:
+    """Resolves host names on the event loop and keeps the first address for `ttl` seconds."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, host: str, port: int) -> str:
+        key = (host, port)
+        now = time.monotonic()
+        entry = self.entries.get(key, None)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        self.entries[key] = (now + self.ttl, address)
+        return address
+
+    def json(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def reset(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+
+class CircuitBreaker:
+    """Stops sending requests to an unreachable upstream for a while.
+
+    The circuit opens after `failure_threshold` consecutive connection failures or timeouts, or once
+    the failures reach `error_rate` of at least `min_requests` requests in the last `window` seconds.
+    While it is open the requests fail fast. After `open_duration` seconds a single probe request is
+    let through (half-open) and its outcome closes or reopens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, url: str, config: ConfigFallbackToCircuitBreaker):
+        self.url = url
+        self.config = config
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.consecutive_failures = 0
+        self.outcomes = deque()
+        self.reset()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.config.open_duration - time.monotonic())
+
+    def allow(self) -> bool:
+        """Tells whether a request can be sent, letting one probe through once the open duration is over."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.retry_after() > 0:
+            self.rejected += 1
+            return False
+        self.state = self.HALF_OPEN
+        if self.probing:
+            self.rejected += 1
+            return False
+        self.probing = True
+        return True
+
+    def is_available(self) -> bool:
+        """Tells whether `allow()` would let a request through, without taking the probe."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return self.retry_after() <= 0
+        return not self.probing
+
+    def record(self, failed: bool, probe: bool = False) -> None:
+        now = time.monotonic()
+        while self.outcomes and self.outcomes[0][0] <= now - self.config.window:
+            self.outcomes.popleft()
+        self.outcomes.append((now, failed))
+        self.consecutive_failures = self.consecutive_failures + 1 if failed else 0
+
+        if probe:
+            self.probing = False
+            if failed:
+                self._open(now)
+            else:
+                self._close()
+            return
+
+        # The late outcomes of the requests sent before the circuit opened do not change its state
+        if self.state != self.CLOSED or not failed:
+            return
+        failures = sum(1 for _, outcome in self.outcomes if outcome)
+        if self.consecutive_failures >= self.config.failure_threshold or (
+            len(self.outcomes) >= self.config.min_requests and failures / len(self.outcomes) >= self.config.error_rate
+        ):
+            self._open(now)
+
+    def release(self, probe: bool) -> None:
+        """Lets another request probe the upstream if the probe ended without an outcome."""
+        if probe:
+            self.probing = False
+
+    def _open(self, now: float) -> None:
+        if self.state != self.OPEN:
+            logging.warning('Circuit breaker of %s is opened for %g seconds.', self.url, self.config.open_duration)
+        self.state = self.OPEN
+        self.opened_at = now
+        self.trips += 1
+
+    def _close(self) -> None:
+        logging.info('Circuit breaker of %s is closed.', self.url)
+        self.state = self.CLOSED
+        self.outcomes.clear()
+
+    def json(self) -> dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'window_requests': len(self.outcomes),
+            'window_failures': sum(1 for _, outcome in self.outcomes if outcome),
+            'trips': self.trips,
+            'rejected': self.rejected
+        }
+
+    def reset(self) -> None:
+        self.trips = 0
+        self.rejected = 0
+
+
+class Upstream:
+    """HTTP client of a `fallbackTo` upstream with its own connection pool, limits and timeouts."""
+
+    def __init__(self, config: ConfigFallbackTo):
+        self.config = config
+        self.url = config.url.rstrip('/')
+        self.stream = config.stream
+        self.coalesce = config.coalesce
+        self.http2 = config.http2
+        if self.http2:
+            try:
+                import h2  # noqa: F401
+            except ModuleNotFoundError:
+                logging.warning('HTTP/2 for %s requires the h2 package (pip install httpx[http2]), using HTTP/1.1.', self.url)
+                self.http2 = False
+        self.dns_cache = DnsCache(config.dns_cache_ttl) if config.dns_cache_ttl > 0 else None
+        self.pending = {}
+        self.circuit_breaker = None
+        if config.circuit_breaker is not None:
+            self.circuit_breaker = CircuitBreaker(self.url, config.circuit_breaker)
+        self.cache = _create_cache(config.cache)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry
+            ),
+            timeout=httpx.Timeout(
+                FALLBACK_TO_TIMEOUT,
+                connect=FALLBACK_TO_TIMEOUT if config.connect_timeout is None else config.connect_timeout,
+                read=FALLBACK_TO_TIMEOUT if config.read_timeout is None else config.read_timeout
+            ),
+            http2=self.http2
+        )
+        self.reset()
+
+    def choose(self) -> 'Upstream':
+        return self
+
+    def is_healthy(self) -> bool:
+        return self.circuit_breaker is None or self.circuit_breaker.is_available()
+
+    async def request(self, method: str, path: str, headers: dict, stream: bool = False, **kwargs) -> httpx.Response:
+        """Sends the request to the `path` (including the query string) on the upstream.
+
+        With a DNS cache the URL is pointed at the cached address while the `Host` header and the TLS
+        server name keep the host name. A `stream` response is returned as soon as its headers arrive
+        and must be closed by the caller. While the circuit breaker is open `UpstreamCircuitOpen` is
+        raised without contacting the upstream.
+        """
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return await self._send(method, path, headers, stream, **kwargs)
+
+        if not breaker.allow():
+            raise UpstreamCircuitOpen(self.url, breaker.retry_after())
+        probe = breaker.state == CircuitBreaker.HALF_OPEN
+        try:
+            resp = await self._send(method, path, headers, stream, **kwargs)
+        except httpx.TransportError:
+            breaker.record(True, probe=probe)
+            raise
+        except BaseException:
+            breaker.release(probe)
+            raise
+        breaker.record(False, probe=probe)
+        return resp
+
+    async def _send(self, method: str, path: str, headers: dict, stream: bool, **kwargs) -> httpx.Response:
+        url = httpx.URL(self.url + path)
+        extensions = {}
+        if self.dns_cache is not None and not _is_ip_address(url.host):
+            try:
+                address = await self.dns_cache.resolve(url.host, url.port or (443 if url.scheme == 'https' else 80))
+            except socket.gaierror as e:
+                raise httpx.ConnectError(str(e))
+            headers = dict(headers)
+            headers['Host'] = url.netloc.decode()
+            if url.scheme == 'https':
+                extensions['sni_hostname'] = url.host
+            url = url.copy_with(host=address)
+
+        self.request_counter += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.perf_counter()
+        try:
+            request = self.client.build_request(method, url, headers=headers, extensions=extensions, **kwargs)
+            return await self.client.send(request, stream=stream)
+        except httpx.TimeoutException:
+            self.timeouts += 1
+            raise
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight -= 1
+            self.total_resp_time += elapsed
+            self.max_resp_time = max(self.max_resp_time, elapsed)
+
+    async def request_coalesced(self, method: str, path: str, headers: dict, **kwargs) -> httpx.Response:
+        """Same as `request()` but the concurrent identical requests share a single upstream call.
+
+        The first request is sent and the ones that arrive while it is in flight wait for its
+        response (or its error) instead. Only meant for the idempotent methods without a body.
+        """
+        if not self.coalesce:
+            return await self.request(method, path, headers, **kwargs)
+
+        key = _coalesce_key(method, path, headers)
+        if key in self.pending:
+            self.saved_calls += 1
+        return await _coalesce(self.pending, key, lambda: self.request(method, path, headers, **kwargs))
+
+    def pool_json(self) -> dict:
+        # httpx does not expose its connection pool, a missing attribute only hides the connection counts
+        pool = getattr(getattr(self.client, '_transport', None), '_pool', None)
+        connections = list(getattr(pool, 'connections', []))
+        return {
+            'connections': len(connections),
+            'idle_connections': sum(1 for connection in connections if connection.is_idle()),
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'max_connections': self.config.max_connections,
+            'max_keepalive_connections': self.config.max_keepalive_connections
+        }
+
+    def json(self) -> dict:
+        data = {
+            'request_counter': self.request_counter,
+            'avg_resp_time': self.total_resp_time / self.request_counter if self.request_counter != 0 else 0,
+            'max_resp_time': self.max_resp_time,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'saved_calls': self.saved_calls,
+            'http2': self.http2,
+            'pool': self.pool_json()
+        }
+        if self.dns_cache is not None:
+            data['dns_cache'] = self.dns_cache.json()
+        if self.cache is not None:
+            data['cache'] = self.cache.json()
+        if self.circuit_breaker is not None:
+            data['circuit_breaker'] = self.circuit_breaker.json()
+        return data
+
+    def reset(self) -> None:
+        self.request_counter = 0
+        self.in_flight = getattr(self, 'in_flight', 0)
+        self.max_in_flight = self.in_flight
+        self.total_resp_time = 0
+        self.max_resp_time = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.saved_calls = 0
+        if self.dns_cache is not None:
+            self.dns_cache.reset()
+        if self.cache is not None:
+            self.cache.reset()
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.reset()
+
+
+class UpstreamGroup:
+    """Balances the unhandled requests of a service across several upstreams.
+
+    A target is picked among the healthy ones, whose circuit breakers let requests through, in turn
+    (`roundRobin`), by the fewest requests in flight (`leastOutstanding`) or in proportion to the
+    weights (`weighted`, smooth weighted round-robin). If none of them is healthy, all of them are
+    considered and the request fails fast on an open circuit.
+
+    The cache and the coalescing belong to the group, they are looked up before a target is picked so
+    that the recordings and the calls in flight are shared by all the targets.
+    """
+
+    def __init__(
+        self,
+        targets: List[Upstream],
+        weights: List[int],
+        strategy: str,
+        coalesce: bool = True,
+        cache: Union[ConfigFallbackToCache, None] = None
+    ):
+        self.targets = targets
+        self.weights = weights
+        self.strategy = strategy
+        self.url = ', '.join(target.url for target in targets)
+        # The streamed targets relay the responses to each client, they cannot be shared
+        self.stream = any(target.stream for target in targets)
+        self.coalesce = coalesce
+        self.pending = {}
+        self.cache = _create_cache(cache)
+        self.counter = 0
+        self.current_weights = [0] * len(targets)
+        self.reset()
+
+    def choose(self) -> Upstream:
+        indexes = [i for i, target in enumerate(self.targets) if target.is_healthy()] or list(range(len(self.targets)))
+
+        if self.strategy == 'weighted':
+            total = 0
+            best = None
+            for i in indexes:
+                self.current_weights[i] += self.weights[i]
+                total += self.weights[i]
+                if best is None or self.current_weights[i] > self.current_weights[best]:
+                    best = i
+            self.current_weights[best] -= total
+            return self.targets[best]
+
+        offset = self.counter % len(indexes)
+        self.counter += 1
+        if self.strategy == 'leastOutstanding':
+            # Rotating the candidates spreads the requests among the targets with equally many in flight
+            indexes = indexes[offset:] + indexes[:offset]
+            return self.targets[min(indexes, key=lambda i: self.targets[i].in_flight)]
+        return self.targets[indexes[offset]]
+
+    async def request_coalesced(self, method: str, path: str, headers: dict, **kwargs) -> httpx.Response:
+        """Sends the request to a target picked by `choose()`, sharing the call like `Upstream.request_coalesced()`.
+
+        Only the first of the concurrent identical requests picks a target.
+        """
+        if not self.coalesce:
+            return await self.choose().request(method, path, headers, **kwargs)
+
+        key = _coalesce_key(method, path, headers)
+        if key in self.pending:
+            self.saved_calls += 1
+        return await _coalesce(self.pending, key, lambda: self.choose().request(method, path, headers, **kwargs))
+
+    def json(self) -> dict:
+        data = {
+            'saved_calls': self.saved_calls
+        }
+        if self.cache is not None:
+            data['cache'] = self.cache.json()
+        return data
+
+    def reset(self) -> None:
+        self.saved_calls = 0
+        if self.cache is not None:
+            self.cache.reset()
+
+
+class Upstreams:
+    """Registry of the upstream clients, shared by the services with the same `fallbackTo` configuration."""
+
+    def __init__(self):
+        self.upstreams = {}
+        self.groups = {}
+
+    def get(
+        self,
+        config: Union[ConfigFallbackTo, ConfigFallbackToGroup, None]
+    ) -> Union[Upstream, UpstreamGroup, None]:
+        if config is None:
+            return None
+        if isinstance(config, ConfigFallbackToGroup):
+            # The group keeps its cache across the reloads of the services, like the upstreams their pools
+            key = json.dumps(config.model_dump(), sort_keys=True)
+            if key not in self.groups:
+                self.groups[key] = UpstreamGroup(
+                    [self.get(target) for target in config.targets],
+                    [target.weight for target in config.targets],
+                    config.strategy,
+                    coalesce=config.coalesce,
+                    cache=config.cache
+                )
+            return self.groups[key]
+        # The weight belongs to the group, the targets with different weights still share the client
+        key = json.dumps(config.model_dump(exclude={'weight'}), sort_keys=True)
+        if key not in self.upstreams:
+            self.upstreams[key] = Upstream(config)
+        return self.upstreams[key]
+
+    def named(self) -> Dict[str, Union[Upstream, UpstreamGroup]]:
+        """Returns the upstreams and the groups by URL, numbering the ones that share the URL with different settings.
+
+        The URL of a group is the list of the URLs of its targets.
+        """
+        data = {}
+        for upstream in list(self.upstreams.values()) + list(self.groups.values()):
+            name = upstream.url
+            i = 2
+            while name in data:
+                name = '%s #%d' % (upstream.url, i)
+                i += 1
+            data[name] = upstream
+        return data
+
+    def json(self) -> dict:
+        return {name: upstream.json() for name, upstream in self.named().items()}
+
+    def reset(self) -> None:
+        for upstream in list(self.upstreams.values()) + list(self.groups.values()):
+            upstream.reset()
+
+
+upstreams = Upstreams()
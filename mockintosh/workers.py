@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: __init__
+    :synopsis: module that contains the multi-process worker mode.
+"""
+
+import os
+import sys
+import heapq
+import signal
+import shutil
+import asyncio
+import logging
+import tempfile
+from urllib.parse import urlencode
+from typing import (
+    Awaitable,
+    List,
+    Union
+)
+
+import httpx
+from tornado.httputil import HTTPServerRequest
+
+from mockintosh.constants import PROGRAM
+from mockintosh.stats import LatencyHistogram
+
+WORKER_LOCAL_HEADER = 'x-%s-worker-local' % PROGRAM.lower()
+WORKER_MAX_RESTARTS = int(os.environ.get('MOCKINTOSH_WORKER_MAX_RESTARTS', 100))
+WORKER_FAN_OUT_TIMEOUT = int(os.environ.get('MOCKINTOSH_WORKER_FAN_OUT_TIMEOUT', 10))
+ASYNC_ACTORS_WORKER = 0
+
+
+class Workers:
+    """Describes the worker process that this interpreter runs as.
+
+    Every worker listens on the public ports with `SO_REUSEPORT` and additionally on one Unix socket
+    per port, which the other workers use to collect the management data of the whole instance.
+    """
+
+    def __init__(self):
+        self.count = 1
+        self.index = 0
+        self.socket_dir = None
+        self.clients = {}
+
+    def is_enabled(self) -> bool:
+        return self.count > 1
+
+    def runs_async_actors(self) -> bool:
+        # Async actors would produce and consume once per worker otherwise
+        return self.index == ASYNC_ACTORS_WORKER
+
+    def socket_path(self, port: int, index: Union[int, None] = None) -> str:
+        return os.path.join(self.socket_dir, '%d-%d.sock' % (port, self.index if index is None else index))
+
+    def is_local_request(self, request: HTTPServerRequest) -> bool:
+        """Tells whether the request should be answered from this worker's data only."""
+        return not self.is_enabled() or WORKER_LOCAL_HEADER in request.headers
+
+    def get_client(self, path: str) -> httpx.AsyncClient:
+        if path not in self.clients:
+            self.clients[path] = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=path, verify=False),
+                timeout=WORKER_FAN_OUT_TIMEOUT
+            )
+        return self.clients[path]
+
+    def _replay(
+        self,
+        request: HTTPServerRequest,
+        index: int,
+        query: Union[dict, None] = None,
+        path: Union[str, None] = None
+    ) -> Awaitable[httpx.Response]:
+        port = request.connection.stream.socket.getsockname()[1]
+
+        uri = request.path if path is None else path
+        query_arguments = {key: [value.decode() for value in values] for key, values in request.query_arguments.items()}
+        if query is not None:
+            query_arguments.update({key: [value] for key, value in query.items()})
+        if query_arguments:
+            uri += '?' + urlencode(query_arguments, doseq=True)
+
+        headers = {
+            key: value for key, value in request.headers.get_all()
+            if key.lower() not in ('content-length', 'transfer-encoding', 'connection')
+        }
+        headers[WORKER_LOCAL_HEADER] = str(self.index)
+
+        return self.get_client(self.socket_path(port, index)).request(
+            request.method,
+            '%s://%s%s' % (request.protocol, request.host, uri),
+            headers=headers,
+            content=request.body
+        )
+
+    async def fan_out(
+        self,
+        request: HTTPServerRequest,
+        query: Union[dict, None] = None,
+        path: Union[str, None] = None
+    ) -> List[httpx.Response]:
+        """Replays a management request, optionally on another `path`, on the other workers and returns their responses."""
+        results = await asyncio.gather(*[
+            self._replay(request, index, query=query, path=path)
+            for index in range(self.count) if index != self.index
+        ], return_exceptions=True)
+
+        responses = []
+        for result in results:
+            if isinstance(result, Exception):
+                # A worker that is being restarted is simply left out
+                logging.warning('Could not reach a worker: %s', result)
+                continue
+            responses.append(result)
+        return responses
+
+    async def forward(
+        self,
+        request: HTTPServerRequest,
+        index: int = 0,
+        path: Union[str, None] = None
+    ) -> Union[httpx.Response, None]:
+        """Replays a management request on the worker `index` only, returns `None` if it cannot be reached."""
+        try:
+            return await self._replay(request, index, path=path)
+        except Exception as e:
+            logging.warning('Could not reach worker #%d: %s', index, e)
+            return None
+
+    async def fan_out_json(
+        self,
+        request: HTTPServerRequest,
+        query: Union[dict, None] = None,
+        path: Union[str, None] = None
+    ) -> List[httpx.Response]:
+        """Same as `fan_out()` but keeps only the successful JSON responses."""
+        return [
+            response for response in await self.fan_out(request, query=query, path=path)
+            if response.status_code == 200 and response.headers.get('Content-Type', '').startswith('application/json')
+        ]
+
+
+workers = Workers()
+
+
+def _merge_stats(target: dict, source: dict) -> None:
+    if 'request_counter' in target and 'avg_resp_time' in target:
+        total = target['request_counter'] + source.get('request_counter', 0)
+        target['avg_resp_time'] = (
+            target['avg_resp_time'] * target['request_counter'] + source.get('avg_resp_time', 0) * source.get('request_counter', 0)
+        ) / total if total != 0 else 0
+
+    for key, value in source.items():
+        if key in ('avg_resp_time', 'ratio', 'resp_time_percentiles'):
+            continue
+        if key == 'resp_time_histogram' and key in target:
+            histogram = LatencyHistogram.from_json(target[key])
+            histogram.merge(LatencyHistogram.from_json(value))
+            target[key] = histogram.json()
+            target['resp_time_percentiles'] = histogram.percentiles()
+            continue
+        if key not in target:
+            target[key] = value
+        elif isinstance(value, bool) or isinstance(value, str):
+            continue
+        elif key.startswith('max_') and isinstance(value, (int, float)):
+            target[key] = max(target[key], value)
+        elif isinstance(value, (int, float)):
+            target[key] += value
+        elif isinstance(value, dict):
+            _merge_stats(target[key], value)
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                if i < len(target[key]):
+                    _merge_stats(target[key][i], item)
+                else:
+                    target[key].append(item)
+
+    if 'ratio' in target and 'bytes_in' in target:
+        target['ratio'] = target['bytes_out'] / target['bytes_in'] if target['bytes_in'] != 0 else 0
+
+
+def _str_keys(data):
+    # The local `/stats` output keys the status codes by `int`, the JSON of the other workers by `str`
+    if isinstance(data, dict):
+        return {str(key): _str_keys(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_str_keys(item) for item in data]
+    return data
+
+
+def _drop_histograms(data):
+    if isinstance(data, dict):
+        data.pop('resp_time_histogram', None)
+        for value in data.values():
+            _drop_histograms(value)
+    elif isinstance(data, list):
+        for item in data:
+            _drop_histograms(item)
+
+
+def merge_stats(data: dict, others: List[dict], histograms: bool = True) -> dict:
+    """Sums the counters of the `/stats` outputs of several workers, weighting the average response times.
+
+    The percentiles of the response times are recomputed from the merged histograms, which are then
+    dropped from the result unless `histograms` is set.
+    """
+    data.update(_str_keys(data))
+    for other in others:
+        _merge_stats(data, other)
+    if not histograms:
+        _drop_histograms(data)
+    return data
+
+
+def _merge_cursors(cursors: List[str]) -> str:
+    # Every worker returns the given cursor with its own part advanced, the others can only lag behind
+    parts = [[int(part) for part in cursor.split('.')] for cursor in cursors]
+    length = max(len(part) for part in parts)
+    return '.'.join(
+        str(max(part[i] if i < len(part) else 0 for part in parts)) for i in range(length)
+    )
+
+
+def merge_logs(data: dict, others: List[dict]) -> dict:
+    """Interleaves the HAR entries of the `/traffic-log` outputs of several workers by their start time."""
+    for other in others:
+        data['log']['_enabled'] = data['log']['_enabled'] or other['log']['_enabled']
+    logs = [data] + others
+    data['log']['entries'] = list(heapq.merge(
+        *[log['log']['entries'] for log in logs],
+        key=lambda x: x['startedDateTime']
+    ))
+    cursors = [log['log']['_cursor'] for log in logs if '_cursor' in log['log']]
+    if cursors:
+        data['log']['_cursor'] = _merge_cursors(cursors)
+    return data
+
+
+def merge_unhandled(data: dict, others: List[dict], keys: tuple) -> dict:
+    """Unites the `/unhandled` outputs of several workers, one endpoint per method and path."""
+    services = {}
+    for service in data['services']:
+        services[tuple(service.get(key, None) for key in keys)] = service
+
+    for other in others:
+        for service in other['services']:
+            identifier = tuple(service.get(key, None) for key in keys)
+            if identifier not in services:
+                services[identifier] = service
+                data['services'].append(service)
+                continue
+            endpoints = services[identifier]['endpoints']
+            seen = set((endpoint['method'], endpoint['path']) for endpoint in endpoints)
+            for endpoint in service['endpoints']:
+                if (endpoint['method'], endpoint['path']) not in seen:
+                    endpoints.append(endpoint)
+    return data
+
+
+def _set_cpu_affinity(index: int) -> None:
+    if not hasattr(os, 'sched_setaffinity'):  # pragma: no cover
+        logging.warning('CPU affinity is not supported on this platform.')
+        return
+    cpus = sorted(os.sched_getaffinity(0))
+    cpu = cpus[index % len(cpus)]
+    os.sched_setaffinity(0, {cpu})
+    logging.debug('Worker #%d is pinned to CPU %d', index, cpu)
+
+
+def fork_workers(count: int, cpu_affinity: bool = False) -> int:
+    """Forks `count` worker processes and supervises them.
+
+    Returns the index of the worker in the child processes. The parent process never returns; it
+    restarts the workers that crash and exits once all of them have stopped.
+    """
+    socket_dir = tempfile.mkdtemp(prefix='%s-workers-' % PROGRAM)
+    children = {}
+    stopping = [False]
+
+    def start_child(index: int) -> Union[int, None]:
+        pid = os.fork()
+        if pid == 0:
+            for signum in (signal.SIGTERM, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            workers.count = count
+            workers.index = index
+            workers.socket_dir = socket_dir
+            if cpu_affinity:
+                _set_cpu_affinity(index)
+            return index
+        children[pid] = index
+        return None
+
+    for index in range(count):
+        if start_child(index) is not None:
+            return index
+
+    def forward(signum: int, frame) -> None:
+        if signum in (signal.SIGTERM, signal.SIGINT):
+            stopping[0] = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM if signum == signal.SIGINT else signum)
+            except ProcessLookupError:  # pragma: no cover
+                pass
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward)
+
+    logging.info('Started %d workers.', count)
+
+    restarts = 0
+    exit_status = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:  # pragma: no cover
+            break
+        if pid not in children:  # pragma: no cover
+            continue
+        index = children.pop(pid)
+
+        if stopping[0]:
+            continue
+        if os.WIFSIGNALED(status):
+            logging.warning('Worker #%d (pid %d) was killed by signal %d, restarting it.', index, pid, os.WTERMSIG(status))
+        elif os.WEXITSTATUS(status) != 0:
+            logging.warning('Worker #%d (pid %d) exited with status %d, restarting it.', index, pid, os.WEXITSTATUS(status))
+        else:
+            logging.info('Worker #%d (pid %d) has exited.', index, pid)
+            continue
+
+        restarts += 1
+        if restarts > WORKER_MAX_RESTARTS:
+            logging.error('Too many worker restarts, giving up.')
+            exit_status = 1
+            stopping[0] = True
+            forward(signal.SIGTERM, None)
+            continue
+        if start_child(index) is not None:
+            return index
+
+    shutil.rmtree(socket_dir, ignore_errors=True)
+    sys.exit(exit_status)
@@ -85,6 +85,9 @@ setup(
             'google-cloud-pubsub>=2.5.0',
             'boto3>=1.17.97'
         ],
+        'http2': [
+            'httpx[http2]'
+        ],
         'dev': [
             'flake8',
             'psutil',
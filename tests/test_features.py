@@ -8,6 +8,7 @@
 
 import os
 import random
+import asyncio
 import re
 import time
 import json
@@ -996,6 +997,164 @@ class TestCore():
 
         del os.environ['%s_DATA_DIR' % PROGRAM.upper()]
 
+    @pytest.mark.parametrize(('config'), [
+        'configs/yaml/hbs/core/large_body.yaml'
+    ])
+    def test_large_body_streaming(self, config):
+        self.mock_server_process = run_mock_server(get_config_path(config))
+        expected = ''.join('%064d' % n for n in range(20000))
+
+        with httpx.stream('GET', SRV_8001 + '/large') as resp:
+            assert 200 == resp.status_code
+            assert resp.headers['Content-Length'] == str(len(expected))
+            assert 'Transfer-Encoding' not in resp.headers
+            chunks = list(resp.iter_raw())
+        assert len(chunks) > 1
+        assert b''.join(chunks).decode() == expected
+
+        resp = httpx.get(SRV_8001 + '/small')
+        assert 200 == resp.status_code
+        assert resp.headers['Content-Length'] == '5'
+        assert resp.text == 'small'
+
+        resp = httpx.get(SRV_8000 + '/stats')
+        assert 200 == resp.status_code
+        assert resp.json()['services'][0]['endpoints'][0]['request_counter'] == 1
+
+    @pytest.mark.parametrize(('config'), [
+        'configs/json/hbs/core/binary_response.json'
+    ])
+    def test_byte_ranges(self, config):
+        self.mock_server_process = run_mock_server(get_config_path(config))
+        with open(get_config_path('configs/json/hbs/core/image.png'), 'rb') as file:
+            image_file = file.read()
+        size = len(image_file)
+
+        resp = httpx.get(SRV_8001 + '/image')
+        assert 200 == resp.status_code
+        assert resp.headers['Accept-Ranges'] == 'bytes'
+        assert resp.content == image_file
+
+        resp = httpx.get(SRV_8001 + '/image', headers={'Range': 'bytes=0-9'})
+        assert 206 == resp.status_code
+        assert resp.headers['Content-Range'] == 'bytes 0-9/%d' % size
+        assert resp.headers['Content-Type'] == 'image/png'
+        assert resp.content == image_file[:10]
+
+        resp = httpx.get(SRV_8001 + '/image', headers={'Range': 'bytes=-10'})
+        assert 206 == resp.status_code
+        assert resp.headers['Content-Range'] == 'bytes %d-%d/%d' % (size - 10, size - 1, size)
+        assert resp.content == image_file[-10:]
+
+        resp = httpx.get(SRV_8001 + '/image', headers={'Range': 'bytes=0-1,100-101'})
+        assert 206 == resp.status_code
+        assert resp.headers['Content-Type'].startswith('multipart/byteranges; boundary=')
+        assert b'Content-Range: bytes 0-1/%d' % size in resp.content
+        assert b'Content-Range: bytes 100-101/%d' % size in resp.content
+        assert image_file[100:102] in resp.content
+
+        resp = httpx.get(SRV_8001 + '/image', headers={'Range': 'bytes=%d-' % size})
+        assert 416 == resp.status_code
+        assert resp.headers['Content-Range'] == 'bytes */%d' % size
+
+        resp = httpx.get(SRV_8001 + '/image', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        assert 200 == resp.status_code
+        assert resp.content == image_file
+
+        resp = httpx.get(SRV_8001 + '/hello', headers={'Range': 'bytes=0-9'})
+        assert 200 == resp.status_code
+        assert 'Accept-Ranges' not in resp.headers
+        assert isinstance(resp.json()['hello'], str)
+
+    @pytest.mark.parametrize(('config'), [
+        'configs/yaml/hbs/core/conditional.yaml'
+    ])
+    def test_conditional_requests(self, config):
+        self.mock_server_process = run_mock_server(get_config_path(config))
+
+        for path in ('/static', '/file'):
+            resp = httpx.get(SRV_8001 + path)
+            assert 200 == resp.status_code
+            etag = resp.headers['ETag']
+            last_modified = resp.headers['Last-Modified']
+            assert etag.startswith('"')
+
+            resp = httpx.get(SRV_8001 + path, headers={'If-None-Match': etag})
+            assert 304 == resp.status_code
+            assert resp.content == b''
+            assert resp.headers['ETag'] == etag
+
+            resp = httpx.get(SRV_8001 + path, headers={'If-None-Match': 'W/%s' % etag})
+            assert 304 == resp.status_code
+
+            resp = httpx.get(SRV_8001 + path, headers={'If-None-Match': '"other", %s' % etag})
+            assert 304 == resp.status_code
+
+            resp = httpx.get(SRV_8001 + path, headers={'If-None-Match': '"other"'})
+            assert 200 == resp.status_code
+            assert resp.content != b''
+
+            resp = httpx.get(SRV_8001 + path, headers={'If-Modified-Since': last_modified})
+            assert 304 == resp.status_code
+
+            resp = httpx.get(SRV_8001 + path, headers={'If-None-Match': '"other"', 'If-Modified-Since': last_modified})
+            assert 200 == resp.status_code
+
+        resp = httpx.get(SRV_8001 + '/templated')
+        assert 200 == resp.status_code
+        assert resp.text == '/templated'
+        assert 'ETag' not in resp.headers
+
+        resp = httpx.get(SRV_8001 + '/weak')
+        assert 200 == resp.status_code
+        etag = resp.headers['ETag']
+        assert etag.startswith('W/"')
+        resp = httpx.get(SRV_8001 + '/weak', headers={'If-None-Match': etag})
+        assert 304 == resp.status_code
+        assert resp.content == b''
+
+    @pytest.mark.parametrize(('config'), [
+        'configs/json/hbs/core/compression.json'
+    ])
+    def test_compression(self, config):
+        self.mock_server_process = run_mock_server(get_config_path(config))
+        expected = ''.join('%016d' % n for n in range(1000))
+        with open(get_config_path('configs/json/hbs/core/templates/faker.json.hbs'), 'rb') as file:
+            faker_file = file.read()
+
+        for path, content in (('/templated', expected.encode()), ('/file', faker_file), ('/file', faker_file)):
+            resp = httpx.get(SRV_8001 + path, headers={'Accept-Encoding': 'gzip'})
+            assert 200 == resp.status_code
+            assert resp.headers['Content-Encoding'] == 'gzip'
+            assert 'Accept-Encoding' in resp.headers['Vary']
+            assert int(resp.headers['Content-Length']) < len(content)
+            assert resp.content == content
+
+            resp = httpx.get(SRV_8001 + path, headers={'Accept-Encoding': 'identity'})
+            assert 200 == resp.status_code
+            assert 'Content-Encoding' not in resp.headers
+            assert resp.content == content
+
+        resp = httpx.get(SRV_8001 + '/templated', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        assert 'Content-Encoding' not in resp.headers
+        assert resp.text == expected
+
+        resp = httpx.get(SRV_8001 + '/small', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in resp.headers
+        assert resp.text == 'small'
+
+        resp = httpx.get(SRV_8001 + '/uncompressed', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in resp.headers
+        assert 'Vary' not in resp.headers
+        assert resp.text == expected
+
+        resp = httpx.get(SRV_8000 + '/stats')
+        assert 200 == resp.status_code
+        data = resp.json()['compression']
+        assert data['gzip']['count'] == 2
+        assert 0 < data['gzip']['ratio'] < 1
+        assert data['cache']['hits'] == 1
+
 
 @pytest.mark.parametrize(('config'), [
     'configs/json/hbs/status/status_code.json'
@@ -2162,6 +2321,59 @@ class TestManagement():
             resp = httpx.delete(SRV_8002 + '/__admin/stats', headers={'Host': SRV_8002_HOST}, verify=False)
             assert 204 == resp.status_code
 
+    @pytest.mark.parametrize(('config'), [
+        'configs/json/hbs/management/workers.json'
+    ])
+    def test_get_stats_workers(self, config):
+        self.mock_server_process = run_mock_server(get_config_path(config), '--workers', '2')
+        param = str(int(time.time()))
+
+        # Every request opens a connection of its own, so that the workers share them
+        for _ in range(10):
+            resp = httpx.get(SRV_8001 + '/service1', headers={'Host': SRV_8001_HOST})
+            assert 200 == resp.status_code
+
+        for _ in range(6):
+            resp = httpx.get(SRV_8001 + '/service1-second/%s' % param, headers={'Host': SRV_8001_HOST})
+            assert 201 == resp.status_code
+
+        for _ in range(2):
+            resp = httpx.get(_MGMT + '/stats')
+            assert 200 == resp.status_code
+
+            data = resp.json()
+            assert data['global']['request_counter'] == 16
+            assert data['global']['status_code_distribution'] == {'200': 10, '201': 6}
+            assert data['services'][0]['request_counter'] == 16
+            assert data['services'][0]['endpoints'][0]['request_counter'] == 10
+            assert data['services'][0]['endpoints'][0]['status_code_distribution'] == {'200': 10}
+            assert data['services'][0]['endpoints'][1]['request_counter'] == 6
+            assert data['services'][0]['endpoints'][1]['status_code_distribution'] == {'201': 6}
+            assert data['services'][1]['request_counter'] == 0
+            assert data['global']['resp_time_percentiles']['max'] >= data['global']['resp_time_percentiles']['p50'] > 0
+            assert 'resp_time_histogram' not in resp.text
+
+        resp = httpx.get(_MGMT + '/stats?histogram=true')
+        assert 200 == resp.status_code
+        data = resp.json()
+        assert sum(data['global']['resp_time_histogram']['buckets'].values()) == 16
+        assert sum(data['services'][0]['endpoints'][1]['resp_time_histogram']['buckets'].values()) == 6
+
+        resp = httpx.get(SRV_8001 + '/__admin/stats', headers={'Host': SRV_8001_HOST})
+        assert 200 == resp.status_code
+        data = resp.json()
+        assert data['request_counter'] == 16
+        assert data['status_code_distribution'] == {'200': 10, '201': 6}
+
+        resp = httpx.delete(_MGMT + '/stats')
+        assert 204 == resp.status_code
+
+        resp = httpx.get(_MGMT + '/stats')
+        assert 200 == resp.status_code
+        data = resp.json()
+        assert data['global']['request_counter'] == 0
+        assert data['services'][0]['endpoints'][0]['request_counter'] == 0
+
     @pytest.mark.parametrize(('config, level'), [
         ('configs/json/hbs/management/multiresponse.json', 'global'),
         ('configs/json/hbs/management/multiresponse.json', 'service'),
@@ -3509,6 +3721,16 @@ class TestPerformanceProfile():
             status_code = profile.trigger(201)
             assert str(status_code) in faults or status_code == 201
 
+    def test_trigger_async_does_not_block(self):
+        profile = PerformanceProfile(1.0, delay=0.2)
+
+        async def trigger_many():
+            return await asyncio.gather(*[profile.trigger_async(201) for _ in range(20)])
+
+        start = time.time()
+        assert asyncio.run(trigger_many()) == [201] * 20
+        assert time.time() - start < 1.0
+
 
 class TestGraphQL():
 
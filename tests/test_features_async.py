@@ -363,7 +363,7 @@ class AsyncBase:
 
         value_json_decode_error = 'JSON Decode Error'
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, PYBARS, queue)
@@ -451,7 +451,7 @@ class AsyncBase:
         assert consumers[0]['captured'] == 1
         assert consumers[0]['consumedMessages'] == 2 if async_service_type not in ('redis', 'mqtt') else 3
 
-        job.kill()
+        queue.shutdown()
 
     def assert_get_async_produce_consume_loop(self, key, value, headers):
         resp = httpx.get(MGMT + '/async/consumers/1', verify=False)
@@ -492,7 +492,7 @@ class AsyncBase:
         value = 'value10'
         headers = {}
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, JINJA, queue)
@@ -515,7 +515,7 @@ class AsyncBase:
             headers
         )
 
-        job.kill()
+        queue.shutdown()
 
     def assert_get_async_consume_capture_limit_part1(self, value10_1, value10_2):
         resp = httpx.get(MGMT + '/async/consumers/4', verify=False)
@@ -546,7 +546,7 @@ class AsyncBase:
         value11_1 = 'value11_1'
         value11_2 = 'value11_2'
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, PYBARS, queue)
@@ -615,7 +615,7 @@ class AsyncBase:
         data = resp.json()
         assert not data['log']['entries']
 
-        job.kill()
+        queue.shutdown()
 
     def test_get_async_bad_requests(self):
         resp = httpx.get(MGMT + '/async/consumers/99', verify=False)
@@ -648,7 +648,7 @@ class AsyncBase:
             'global-hdr2': 'globalval2'
         }
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, PYBARS, queue)
@@ -679,7 +679,7 @@ class AsyncBase:
 
         async_consumer_group._stop()
         t.join()
-        job.kill()
+        queue.shutdown()
 
     def test_post_async_binary_produce(self):
         resp = httpx.post(MGMT + '/async/producers/Binary%20Producer', verify=False)
@@ -703,7 +703,7 @@ class AsyncBase:
             'global-hdr2': 'globalval2'
         }
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, JINJA, queue)
@@ -734,7 +734,7 @@ class AsyncBase:
 
         async_consumer_group._stop()
         t.join()
-        job.kill()
+        queue.shutdown()
 
     def assert_post_async_reactive_consumer(
         self,
@@ -790,7 +790,7 @@ class AsyncBase:
             'global-hdr2': 'globalval2'
         }
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, PYBARS, queue)
@@ -833,7 +833,7 @@ class AsyncBase:
 
         async_consumer_group._stop()
         t.join()
-        job.kill()
+        queue.shutdown()
 
     def test_post_async_bad_requests(self):
         actor99 = 'actor99'
@@ -877,7 +877,7 @@ class AsyncBase:
     def test_post_async_producer_templated(self):
         global async_service_type
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, PYBARS, queue)
@@ -906,12 +906,12 @@ class AsyncBase:
 
         async_consumer_group._stop()
         t.join()
-        job.kill()
+        queue.shutdown()
 
     def test_async_producer_list_has_no_payloads_matching_tags(self):
         global async_service_type
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, PYBARS, queue)
@@ -927,7 +927,7 @@ class AsyncBase:
         )
         async_actor.set_producer(async_producer)
         async_producer.produce()
-        job.kill()
+        queue.shutdown()
 
     def assert_post_async_multiproducer_part1(self):
         resp = httpx.get(MGMT + '/async/consumers/consumer-for-multiproducer', verify=False)
@@ -1425,7 +1425,7 @@ class AsyncBase:
 
         time.sleep(ASYNC_CONSUME_WAIT)
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, PYBARS, queue)
@@ -1453,7 +1453,7 @@ class AsyncBase:
 
         async_consumer_group._stop()
         t.join()
-        job.kill()
+        queue.shutdown()
 
     def test_management_get_resources(self):
         global async_service_type
@@ -1494,7 +1494,7 @@ class AsyncBase:
     def test_trigger_async_producer(self, topic, key, value, headers, endpoint):
         global async_service_type
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
         async_service = getattr(sys.modules[__name__], '%sService' % async_service_type.capitalize())(
             ASYNC_ADDR[async_service_type],
             definition=DefinitionMockForAsync(None, PYBARS, queue)
@@ -1525,7 +1525,7 @@ class AsyncBase:
 
         async_consumer_group._stop()
         t.join()
-        job.kill()
+        queue.shutdown()
 
     def test_trigger_async_producer_bad_requests(self):
         resp = httpx.get(SRV_8001 + '/endp3', headers={'Host': SRV_8001_HOST})
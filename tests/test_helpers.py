@@ -5,23 +5,53 @@
 .. module:: __init__
     :synopsis: Contains classes that tests the helpers.
 """
+import asyncio
+import gzip
+import hashlib
+import json
 import logging
+import mmap
+import os
 import re
+import sqlite3
+import threading
+import time
 import unittest
 import uuid
+from datetime import datetime
 
 import graphql
+import httpx
 import pytest
+from tornado.httputil import HTTPHeaders
 
 from mockintosh import start_render_queue
 from mockintosh.config import (
-    ConfigAsyncService
+    ConfigAsyncService,
+    ConfigHeaders,
+    ConfigResponse
 )
-from mockintosh.constants import JINJA, PYBARS
-from mockintosh.hbs.methods import reg_ex
-from mockintosh.helpers import _urlsplit
-from mockintosh.j2.methods import env
-from mockintosh.templating import RenderingTask
+from mockintosh.constants import BASE64, JINJA, PYBARS
+from mockintosh.hbs.methods import reg_ex, counter as hbs_counter
+from mockintosh.helpers import _urlsplit, _parse_byte_ranges
+from mockintosh.j2.methods import env, counter as j2_counter
+from mockintosh.services.http import HttpStaticResponse, HttpRouteIndex, HttpMatcher
+from mockintosh.workers import merge_stats, merge_logs, merge_unhandled
+from mockintosh.state import DictStateBackend, MmapStateBackend, SqliteStateBackend, counters
+from mockintosh.files import FileCache
+from mockintosh.logs import (
+    FileTrafficSink, Logs, LogFilter, LogRecord, ServiceLogs, SqliteTrafficSink, take_entries
+)
+from mockintosh.replicas import Request, Response
+from mockintosh.compression import Compressor, choose_encoding
+from mockintosh.events import EventHub, Subscriber, diff
+from mockintosh.config import (
+    ConfigFallbackTo, ConfigFallbackToCache, ConfigFallbackToCircuitBreaker, ConfigFallbackToGroup
+)
+from mockintosh.upstreams import CircuitBreaker, DnsCache, Upstreams
+from mockintosh.stats import LatencyHistogram, Stats
+from mockintosh.recordings import CachedResponse, ResponseCache
+from mockintosh.templating import RenderingTask, RenderingQueue, TemplateRenderer, TemplateCache
 
 
 class TestHelpers:
@@ -38,11 +68,22 @@ class TestHelpers:
         with pytest.raises(ValueError, match=r"Invalid IPv6 URL"):
             _urlsplit('https://[::1/path/resource.txt?a=b&c=d#fragment')
 
+    def test_parse_byte_ranges(self):
+        assert _parse_byte_ranges('bytes=0-9', 100) == [(0, 10)]
+        assert _parse_byte_ranges('bytes=-10', 100) == [(90, 100)]
+        assert _parse_byte_ranges('bytes=90-', 100) == [(90, 100)]
+        assert _parse_byte_ranges('bytes=50-200', 100) == [(50, 100)]
+        assert _parse_byte_ranges('bytes=20-29, 0-9, 5-14', 100) == [(0, 15), (20, 30)]
+        assert _parse_byte_ranges('bytes=100-', 100) == []
+        assert _parse_byte_ranges('bytes=9-0', 100) is None
+        assert _parse_byte_ranges('items=0-9', 100) is None
+        assert _parse_byte_ranges('bytes=a-b', 100) is None
+
     def test_jinja_env_helper(self):
         assert env('TESTING_ENV', 'someothervalue') == 'somevalue'
         assert env('TESTING_NOT_ENV', 'someothervalue') == 'someothervalue'
 
-        queue, job = start_render_queue()
+        queue = start_render_queue()
 
         config_async_service = ConfigAsyncService(
             type='kafka',
@@ -64,7 +105,1021 @@ class TestHelpers:
         )
         assert config_async_service.address == 'someothervalue'
 
-        job.kill()
+        queue.shutdown()
+
+
+class TestRendering:
+
+    def test_render_on_calling_thread(self):
+        queue = RenderingQueue(workers=0)
+        renderer = TemplateRenderer()
+        compiled, _ = renderer.render(PYBARS, 'Hello {{name}}', queue, inject_objects={'name': 'world'})
+        assert compiled == 'Hello world'
+
+    def test_render_async_on_thread_pool(self):
+        queue = RenderingQueue(workers=2)
+        renderer = TemplateRenderer()
+        compiled, _ = asyncio.run(
+            renderer.render_async(JINJA, 'Hello {{ name }}', queue, inject_objects={'name': 'world'})
+        )
+        queue.shutdown()
+        assert compiled == 'Hello world'
+
+    def test_concurrent_counters(self):
+        queue = RenderingQueue(workers=4)
+        renderer = TemplateRenderer()
+        counters.increment('concurrent')
+        start = counters.data['concurrent']
+
+        async def render_on_pool():
+            await asyncio.gather(*[
+                renderer.render_async(PYBARS, "{{counter 'concurrent'}}", queue, inject_methods=[hbs_counter])
+                for _ in range(200)
+            ])
+
+        def render_on_thread():
+            for _ in range(200):
+                renderer.render(JINJA, "{{ counter('concurrent') }}", queue, inject_methods=[j2_counter], counters=counters)
+
+        threads = [threading.Thread(target=render_on_thread) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        asyncio.run(render_on_pool())
+        for thread in threads:
+            thread.join()
+        queue.shutdown()
+        assert counters.data['concurrent'] == start + 600
+
+
+class TestTemplateCache:
+
+    def test_hits_misses_and_evictions(self):
+        cache = TemplateCache(2)
+        assert cache.get('a', str.upper) == 'A'
+        assert cache.get('a', str.upper) == 'A'
+        cache.get('b', str.upper)
+        cache.get('c', str.upper)
+        assert list(cache.entries) == ['b', 'c']
+        assert cache.json() == {'size': 2, 'max_size': 2, 'hits': 1, 'misses': 3, 'evictions': 1}
+
+
+class TestStaticResponse:
+
+    def test_static_response_is_pre_encoded(self):
+        static_response = HttpStaticResponse.build(ConfigResponse(
+            status=201,
+            headers=ConfigHeaders(payload={'Content-Type': 'text/plain', 'X-Multi': ['a', 'b']}),
+            body='hello ü',
+            use_templating=True
+        ))
+        assert static_response.status == 201
+        assert static_response.headers == [('Content-Type', 'text/plain'), ('X-Multi', 'b')]
+        assert static_response.body == 'hello ü'.encode()
+
+    def test_templated_response_is_not_static(self):
+        assert HttpStaticResponse.build(ConfigResponse(body='hello {{name}}', use_templating=True)) is None
+        assert HttpStaticResponse.build(ConfigResponse(
+            headers=ConfigHeaders(payload={'X-Name': '{{name}}'}),
+            body='hello'
+        )) is None
+        assert HttpStaticResponse.build(ConfigResponse(body='hello {{name}}')).text == 'hello {{name}}'
+
+    def test_validators(self):
+        static_response = HttpStaticResponse.build('hello')
+        assert static_response.etag == '"%s"' % hashlib.sha1(b'hello').hexdigest()
+        assert ('Etag', static_response.etag) in static_response.headers
+        assert [key for key, _ in static_response.headers] == ['Etag', 'Last-Modified']
+
+        static_response = HttpStaticResponse.build(ConfigResponse(
+            headers=ConfigHeaders(payload={'ETag': '"v1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}),
+            body='hello'
+        ))
+        assert static_response.etag == '"v1"'
+        assert static_response.last_modified == 1445412480
+        assert len(static_response.headers) == 2
+
+        assert HttpStaticResponse.build(ConfigResponse(status=404, body='hello')).etag is None
+
+
+class TestRouteIndex:
+
+    def test_lookup_keeps_priority_order(self):
+        route_index = HttpRouteIndex([
+            ('/users/me', {'GET': 'me'}),
+            ('/users/([^/]+)', {'GET': 'user'}),
+            ('/users/(.*)/(.*)', {'POST': 'nested'}),
+            ('/x.y', {'GET': 'dot'}),
+            ('(.*)', {'GET': 'any'})
+        ])
+        assert route_index.lookup('/users/me') == ({'get': 'me'}, ('/users/me',))
+        assert route_index.lookup('/users/5') == ({'get': 'user'}, ('5',))
+        assert route_index.lookup('/users/5/6') == ({'post': 'nested'}, ('5', '6'))
+        assert route_index.lookup('/xzy')[0] == {'get': 'dot'}
+        assert route_index.lookup('/other')[0] == {'get': 'any'}
+        assert HttpRouteIndex([('/users', {'GET': None})]).lookup('/other') is None
+
+
+class TestMatcher:
+
+    def test_literal_and_regex_values(self):
+        literal = HttpMatcher('application/json')
+        assert literal.is_literal and literal.pattern is None
+        assert literal.match('application/json')
+        assert not literal.match('application/jsonp')
+
+        regex = HttpMatcher('v[0-9]+')
+        assert not regex.is_literal
+        assert regex.match('v12')
+        assert not regex.match('xv12')
+        assert regex.regex == '^v[0-9]+$'
+
+        assert HttpMatcher(5).match('5')
+
+
+class TestWorkers:
+
+    def test_merge_stats(self):
+        data = merge_stats(
+            {
+                'global': {'request_counter': 1, 'avg_resp_time': 1.0, 'status_code_distribution': {'200': 1}},
+                'services': [{'hint': 'a', 'request_counter': 1, 'avg_resp_time': 1.0, 'status_code_distribution': {'200': 1}}]
+            },
+            [{
+                'global': {'request_counter': 3, 'avg_resp_time': 3.0, 'status_code_distribution': {'200': 2, '404': 1}},
+                'services': [{'hint': 'a', 'request_counter': 3, 'avg_resp_time': 3.0, 'status_code_distribution': {'200': 2, '404': 1}}]
+            }]
+        )
+        assert data['global'] == {'request_counter': 4, 'avg_resp_time': 2.5, 'status_code_distribution': {'200': 3, '404': 1}}
+        assert data['services'][0]['hint'] == 'a'
+        assert data['services'][0]['request_counter'] == 4
+
+        data = merge_stats(
+            {'upstreams': {'u': {'request_counter': 1, 'avg_resp_time': 1.0, 'max_resp_time': 1.0, 'errors': 1}}},
+            [{'upstreams': {'u': {'request_counter': 1, 'avg_resp_time': 3.0, 'max_resp_time': 3.0, 'errors': 0}}}]
+        )
+        assert data['upstreams']['u'] == {'request_counter': 2, 'avg_resp_time': 2.0, 'max_resp_time': 3.0, 'errors': 1}
+
+    def test_merge_local_stats_with_json(self):
+        stats = Stats()
+        stats.add_service('service')
+        stats.services[0].add_endpoint('endpoint')
+        stats.services[0].endpoints[0].add_status_code(200)
+        stats.services[0].endpoints[0].add_status_code(404)
+
+        data = merge_stats(stats.json(), [json.loads(json.dumps(stats.json()))])
+        assert data['global']['status_code_distribution'] == {'200': 2, '404': 2}
+        assert data['services'][0]['endpoints'][0]['status_code_distribution'] == {'200': 2, '404': 2}
+        assert json.loads(json.dumps(data)) == data
+
+    def test_latency_histograms(self):
+        histogram = LatencyHistogram()
+        for i in range(1, 100001):
+            histogram.record(i / 1000000)
+        for name, expected in (('p50', 0.05), ('p90', 0.09), ('p99', 0.099), ('p999', 0.0999)):
+            assert abs(histogram.percentiles()[name] - expected) / expected < 2 ** -7
+        assert histogram.percentiles()['max'] == 0.1
+        assert len(histogram.buckets) < 2048
+        histogram.record(3600)
+        assert len(histogram.buckets) < 3400
+
+        workers = []
+        for times in ([0.001] * 98, [0.5, 2.0]):
+            stats = Stats()
+            stats.add_service('service')
+            stats.services[0].add_endpoint('endpoint')
+            for elapsed in times:
+                stats.services[0].endpoints[0].add_request_elapsed_time(elapsed)
+                stats.services[0].endpoints[0].increase_request_counter()
+            workers.append(stats.json(histograms=True))
+        assert abs(workers[1]['global']['resp_time_percentiles']['p50'] - 0.5) < 0.5 * 2 ** -7
+        assert 'resp_time_histogram' not in stats.json()['services'][0]['endpoints'][0]
+
+        data = merge_stats(workers[0], workers[1:])
+        for level in (data['global'], data['services'][0], data['services'][0]['endpoints'][0]):
+            assert level['request_counter'] == 100
+            assert level['resp_time_histogram']['precision'] == 7
+            assert sum(level['resp_time_histogram']['buckets'].values()) == 100
+            assert abs(level['resp_time_percentiles']['p50'] - 0.001) < 0.001 * 2 ** -7
+            assert abs(level['resp_time_percentiles']['p99'] - 0.5) < 0.5 * 2 ** -7
+            assert level['resp_time_percentiles']['max'] == 2.0
+
+        data = merge_stats(stats.json(histograms=True), [json.loads(json.dumps(stats.json(histograms=True)))], histograms=False)
+        assert 'resp_time_histogram' not in json.dumps(data)
+        assert data['global']['resp_time_percentiles']['max'] == 2.0
+
+        stats.reset()
+        assert stats.json()['global']['resp_time_percentiles'] == {'p50': 0, 'p90': 0, 'p99': 0, 'p999': 0, 'max': 0}
+
+    def test_merge_logs_and_unhandled(self):
+        data = merge_logs(
+            {'log': {'_enabled': False, 'entries': [{'startedDateTime': '2'}]}},
+            [{'log': {'_enabled': True, 'entries': [{'startedDateTime': '1'}]}}]
+        )
+        assert data['log']['_enabled']
+        assert [entry['startedDateTime'] for entry in data['log']['entries']] == ['1', '2']
+        assert '_cursor' not in data['log']
+
+        data = merge_logs(
+            {'log': {'_enabled': True, 'entries': [{'startedDateTime': '1'}, {'startedDateTime': '3'}], '_cursor': '7.2'}},
+            [{'log': {'_enabled': True, 'entries': [{'startedDateTime': '2'}], '_cursor': '5.4.1'}}]
+        )
+        assert [entry['startedDateTime'] for entry in data['log']['entries']] == ['1', '2', '3']
+        assert data['log']['_cursor'] == '7.4.1'
+
+        data = merge_unhandled(
+            {'services': [{'port': 1, 'endpoints': [{'method': 'GET', 'path': '/a'}]}]},
+            [{'services': [{'port': 1, 'endpoints': [{'method': 'GET', 'path': '/a'}, {'method': 'GET', 'path': '/b'}]}]}],
+            ('name', 'port', 'hostname')
+        )
+        assert data['services'][0]['endpoints'] == [{'method': 'GET', 'path': '/a'}, {'method': 'GET', 'path': '/b'}]
+
+
+class TestState:
+
+    @pytest.mark.parametrize('backend', ['dict', 'mmap', 'sqlite'])
+    def test_backend(self, backend, tmp_path):
+        if backend == 'dict':
+            store = DictStateBackend()
+        elif backend == 'mmap':
+            store = MmapStateBackend(str(tmp_path / 'state.mmap'), slots=4)
+        else:
+            store = SqliteStateBackend(str(tmp_path / 'state.db'))
+
+        assert store.get('counter:a') == 0
+        assert store.increment('counter:a') == 1
+        assert store.increment('counter:a', 2) == 3
+        store.set('cursor:b', 5)
+        assert store.get('cursor:b') == 5
+        assert store.items('counter:') == {'counter:a': 3}
+
+    def test_mmap_is_shared(self, tmp_path):
+        path = str(tmp_path / 'state.mmap')
+        first = MmapStateBackend(path, slots=2)
+        second = MmapStateBackend(path, slots=2)
+
+        assert first.increment('a') == 1
+        assert second.increment('a') == 2
+        assert second.increment('b') == 1
+        assert first.items() == {'a': 2, 'b': 1}
+        with pytest.raises(RuntimeError):
+            first.increment('c')
+
+    def test_sqlite_items_cache(self, tmp_path):
+        path = str(tmp_path / 'state.db')
+        first = SqliteStateBackend(path)
+        second = SqliteStateBackend(path)
+
+        assert first.increment('counter:a') == 1
+        assert first.items('counter:') == {'counter:a': 1}
+        assert first.increment('counter:b') == 1
+        assert first.items('counter:') == {'counter:a': 1, 'counter:b': 1}
+        assert second.increment('counter:a') == 2
+        assert first.items('counter:') == {'counter:a': 2, 'counter:b': 1}
+
+    def test_dict_is_thread_safe(self):
+        store = DictStateBackend()
+
+        def run():
+            for i in range(2000):
+                store.increment('counter:%d' % (i % 50))
+                store.items('counter:')
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sum(store.items('counter:').values()) == 8000
+
+
+class TestFileCache:
+
+    def test_revalidation_and_eviction(self, tmp_path):
+        cache = FileCache(8, 0, 0)
+        first = tmp_path / 'first.txt'
+        second = tmp_path / 'second.json'
+        first.write_text('hello')
+        second.write_text('[1]')
+
+        assert cache.read_text(str(first)) == ('hello', False)
+        assert cache.read_text(str(first)) == ('hello', False)
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        first.write_text('hello world')
+        assert cache.read_text(str(first)) == ('hello world', False)
+        assert cache.size == 0
+
+        assert cache.read_json(str(second)) == [1]
+        assert cache.read_text(str(first))[0] == 'hello world'
+        assert cache.size == 3
+
+        first.write_text('hi')
+        cache.read_text(str(first))
+        assert cache.size == 5
+        cache.invalidate(str(first))
+        assert cache.size == 3
+
+    def test_mmap(self, tmp_path):
+        cache = FileCache(8, 4, 60)
+        path = tmp_path / 'image.bin'
+        path.write_bytes(b'\xff\xfe\x00\x01\x02')
+
+        data, is_binary = cache.read_text(str(path))
+        assert is_binary
+        assert data[:] == b'\xff\xfe\x00\x01\x02'
+        assert cache.size == 0
+        assert cache.read_text(str(path))[0] is data
+
+    def test_mmap_entries(self, tmp_path):
+        cache = FileCache(8, 4, 60, mmap_max_entries=2)
+        paths = []
+        for i in range(3):
+            path = tmp_path / ('%d.bin' % i)
+            path.write_bytes(b'\xff\xfe\x00\x01\x02')
+            paths.append(str(path))
+            cache.read_bytes(str(path))
+        assert cache.mapped == 2
+        assert [key[0] for key in cache.entries] == paths[1:]
+        assert cache.json()['evictions'] == 1
+
+    def test_is_file(self, tmp_path, monkeypatch):
+        cache = FileCache(64, 0, 60)
+        path = tmp_path / 'body.txt'
+        path.write_text('hello')
+        assert cache.is_file(str(path))
+        assert not cache.is_file(str(tmp_path))
+        assert not cache.is_file(str(tmp_path / 'missing.txt'))
+
+        def fail(*args, **kwargs):
+            raise AssertionError('no system call is expected')
+
+        monkeypatch.setattr(os, 'stat', fail)
+        assert cache.is_file(str(path))
+
+    def test_etag(self, tmp_path):
+        cache = FileCache(64, 0, 0)
+        path = tmp_path / 'body.txt'
+        path.write_text('hello')
+
+        assert cache.etag(str(path)) is None
+        cache.read_bytes(str(path))
+        etag = cache.etag(str(path))
+        assert etag == '"%s"' % hashlib.sha1(b'hello').hexdigest()
+        assert cache.last_modified(str(path)) == path.stat().st_mtime_ns / 1e9
+
+        path.write_text('hello world')
+        cache.read_bytes(str(path))
+        assert cache.etag(str(path)) != etag
+
+
+class TestCompression:
+
+    def test_choose_encoding(self):
+        assert choose_encoding(None) is None
+        assert choose_encoding('identity') is None
+        assert choose_encoding('gzip, deflate') == 'gzip'
+        assert choose_encoding('deflate, *;q=0.5') in ('br', 'gzip')
+        assert choose_encoding('gzip;q=0') is None
+        assert choose_encoding('*, gzip;q=0') in ('br', None)
+        assert choose_encoding('gzip;q=0.8, br;q=0.1') == 'gzip'
+
+    def test_cache_and_stats(self):
+        compressor = Compressor(0, 6, 1024)
+        data = 'hello world ' * 100
+
+        first = compressor.compress(data, 'gzip', cache_key='key')
+        assert compressor.compress(data, 'gzip', cache_key='key') is first
+        assert gzip.decompress(first) == data.encode()
+        assert (compressor.hits, compressor.misses) == (1, 1)
+
+        compressor.compress(data.encode(), 'gzip')
+        stats = compressor.json()
+        assert stats['gzip']['count'] == 2
+        assert stats['gzip']['bytes_in'] == 2 * len(data)
+        assert stats['gzip']['ratio'] < 0.1
+        assert stats['cache'] == {
+            'entries': 1, 'size': len(first), 'max_size': 1024, 'hits': 1, 'misses': 1, 'coalesced': 0
+        }
+
+        compressor.reset()
+        assert compressor.json()['gzip']['count'] == 0
+        assert len(compressor.entries) == 1
+
+    def test_offload_mapped_file(self, tmp_path):
+        compressor = Compressor(0, 6, 1024 * 1024, offload_threshold=1024)
+        path = tmp_path / 'large.json'
+        path.write_bytes(b'[' + b'1, ' * 100000 + b'1]')
+        cache = FileCache(1024, 1024, 0)
+        body = cache.read_bytes(str(path))
+        assert isinstance(body, mmap.mmap)
+
+        threads = []
+
+        def compress(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return Compressor.compress(compressor, *args, **kwargs)
+
+        compressor.compress = compress
+        first = asyncio.run(compressor.compress_async(body, 'gzip', cache_key=(str(path), 1.0)))
+        assert gzip.decompress(first) == path.read_bytes()
+        assert threads and threads[0] is not threading.main_thread()
+        assert asyncio.run(compressor.compress_async(body, 'gzip', cache_key=(str(path), 1.0))) is first
+        assert len(threads) == 1
+        assert (compressor.hits, compressor.misses) == (1, 1)
+
+    def test_coalesce_and_max_size(self):
+        compressor = Compressor(16, 6, 1024 * 1024, offload_threshold=0, max_size=4096)
+        data = b'a' * 4096
+        assert compressor.compressible(data)
+        assert not compressor.compressible(data + b'a')
+        assert not compressor.compressible(b'a' * 15)
+
+        async def compress():
+            # The concurrent requests of the same file share a single compression
+            return await asyncio.gather(*[compressor.compress_async(data, 'gzip', cache_key='key') for _ in range(5)])
+
+        results = asyncio.run(compress())
+        assert all(result is results[0] for result in results)
+        assert compressor.json()['gzip']['count'] == 1
+        assert compressor.coalesced == 4 and not compressor.pending
+
+
+class TestUpstreams:
+
+    def test_registry(self):
+        registry = Upstreams()
+        first = registry.get(ConfigFallbackTo(url='http://localhost:8002/'))
+        assert registry.get(ConfigFallbackTo(url='http://localhost:8002/')) is first
+        second = registry.get(ConfigFallbackTo(url='http://localhost:8002', max_connections=4))
+        assert second is not first
+        assert registry.get(None) is None
+
+        data = registry.json()
+        assert list(data.keys()) == ['http://localhost:8002', 'http://localhost:8002 #2']
+        assert data['http://localhost:8002 #2']['pool']['max_connections'] == 4
+        assert data['http://localhost:8002']['request_counter'] == 0
+        assert 'dns_cache' not in data['http://localhost:8002']
+
+    def test_group(self):
+        registry = Upstreams()
+        single = registry.get(ConfigFallbackTo(url='http://localhost:8002'))
+        assert single.choose() is single
+
+        targets = [
+            ConfigFallbackTo(url='http://localhost:8002', weight=3),
+            ConfigFallbackTo(url='http://localhost:8003'),
+            ConfigFallbackTo(url='http://localhost:8004', circuit_breaker=ConfigFallbackToCircuitBreaker(failure_threshold=1))
+        ]
+        group = registry.get(ConfigFallbackToGroup(targets=targets))
+        assert group.targets[0] is single
+        urls = [target.url[-4:] for target in group.targets]
+        assert [group.choose().url[-4:] for _ in range(6)] == urls * 2
+
+        group.targets[2].circuit_breaker.record(True)
+        assert [group.choose().url[-4:] for _ in range(4)] == ['8002', '8003'] * 2
+
+        group = registry.get(ConfigFallbackToGroup(targets=targets[:2], strategy='weighted'))
+        assert [group.choose().url[-4:] for _ in range(8)] == ['8002', '8002', '8003', '8002'] * 2
+
+        group = registry.get(ConfigFallbackToGroup(targets=targets[:2], strategy='leastOutstanding'))
+        group.targets[0].in_flight = 2
+        assert [group.choose().url[-4:] for _ in range(2)] == ['8003', '8003']
+        group.targets[0].in_flight = 0
+        assert sorted(group.choose().url[-4:] for _ in range(2)) == ['8002', '8003']
+
+    def test_dns_cache(self):
+        cache = DnsCache(60)
+
+        async def resolve():
+            return [await cache.resolve('localhost', 80) for _ in range(3)]
+
+        addresses = asyncio.run(resolve())
+        assert addresses[0] in ('127.0.0.1', '::1')
+        assert len(set(addresses)) == 1
+        assert cache.json() == {'entries': 1, 'hits': 2, 'misses': 1}
+
+    def test_coalescing(self):
+        upstream = Upstreams().get(ConfigFallbackTo(url='http://localhost:8002'))
+        calls = []
+
+        async def request(method, path, headers, **kwargs):
+            calls.append(path)
+            await asyncio.sleep(0.01)
+            if path == '/error':
+                raise httpx.ConnectError('down')
+            return path
+
+        upstream.request = request
+
+        async def send():
+            return await asyncio.gather(
+                *[upstream.request_coalesced('GET', '/a', {'X-A': '1'}) for _ in range(5)],
+                upstream.request_coalesced('GET', '/a', {'X-A': '2'}),
+                *[upstream.request_coalesced('GET', '/error', {}) for _ in range(2)],
+                return_exceptions=True
+            )
+
+        results = asyncio.run(send())
+        assert results[:6] == ['/a'] * 6
+        assert all(isinstance(result, httpx.ConnectError) for result in results[6:])
+        assert sorted(calls) == ['/a', '/a', '/error']
+        assert upstream.json()['saved_calls'] == 5
+        assert upstream.pending == {}
+
+    def test_group_cache_and_coalescing(self):
+        registry = Upstreams()
+        config = ConfigFallbackToGroup(
+            targets=[ConfigFallbackTo(url='http://localhost:8002'), ConfigFallbackTo(url='http://localhost:8003')],
+            cache=ConfigFallbackToCache()
+        )
+        group = registry.get(config)
+        assert registry.get(config) is group
+        assert group.targets[0].cache is None and group.cache is not None
+        assert registry.named()['http://localhost:8002, http://localhost:8003'] is group
+
+        calls = []
+        for target in group.targets:
+            async def request(method, path, headers, url=target.url, **kwargs):
+                calls.append(url)
+                await asyncio.sleep(0.01)
+                return path
+            target.request = request
+
+        async def send():
+            return await asyncio.gather(*[group.request_coalesced('GET', '/a', {}) for _ in range(4)])
+
+        # The identical requests share the call of a single target, the next ones go on to the next target
+        assert asyncio.run(send()) == ['/a'] * 4
+        assert asyncio.run(send()) == ['/a'] * 4
+        assert calls == ['http://localhost:8002', 'http://localhost:8003']
+        assert group.json()['saved_calls'] == 6 and group.pending == {}
+        assert 'cache' in registry.json()['http://localhost:8002, http://localhost:8003']
+
+        with pytest.raises(ValueError):
+            ConfigFallbackToGroup(targets=[ConfigFallbackTo(url='http://localhost:8002', cache=ConfigFallbackToCache())])
+        with pytest.raises(ValueError):
+            ConfigFallbackToGroup(targets=[ConfigFallbackTo(url='http://localhost:8002', coalesce=False)])
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker('http://localhost:8002', ConfigFallbackToCircuitBreaker(failure_threshold=3, open_duration=0.05))
+        for failed in (True, True, False, True, True):
+            assert breaker.allow()
+            breaker.record(failed)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+        breaker.record(True)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+        assert 0 < breaker.retry_after() <= 0.05
+
+        time.sleep(0.06)
+        assert breaker.allow()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert not breaker.allow()
+        breaker.record(True, probe=True)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        time.sleep(0.06)
+        assert breaker.allow()
+        breaker.release(True)
+        assert breaker.allow()
+        breaker.record(False, probe=True)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.json()['trips'] == 2
+        assert breaker.json()['rejected'] == 2
+
+    def test_circuit_breaker_error_rate(self):
+        breaker = CircuitBreaker('http://localhost:8002', ConfigFallbackToCircuitBreaker(error_rate=0.5, min_requests=4))
+        for failed in (True, False, True):
+            breaker.record(failed)
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record(True)
+        assert breaker.state == CircuitBreaker.OPEN
+
+
+class TestRecordings:
+
+    def test_key(self):
+        cache = ResponseCache(0, 1024, ['X-User'], True)
+        headers = HTTPHeaders({'X-User': 'a', 'X-Other': 'b'})
+        key = cache.key('GET', '/p', 'a=1&b=2', headers, b'')
+        assert cache.key('get', '/p', 'b=2&a=1', HTTPHeaders({'X-User': 'a'}), b'') == key
+        assert cache.key('GET', '/p', 'a=1&b=2', HTTPHeaders({'X-User': 'c'}), b'') != key
+        assert cache.key('GET', '/p', 'a=1&b=2', headers, b'x') != key
+        assert ResponseCache(0, 1024, [], False).key('GET', '/p', '', headers, b'x') == \
+            ResponseCache(0, 1024, [], False).key('GET', '/p', '', headers, b'y')
+
+    def test_lru(self):
+        cache = ResponseCache(0, 250, [], True)
+        for key in ('a', 'b'):
+            cache.put(key, CachedResponse('GET', '/' + key, 200, [], b'x' * 100))
+        assert cache.get('a') is not None
+        cache.put('c', CachedResponse('GET', '/c', 200, [], b'x' * 100))
+        assert cache.get('b') is None
+        assert cache.get('a').body == b'x' * 100
+        cache.put('d', CachedResponse('GET', '/d', 200, [], b'x' * 1000))
+        assert cache.get('d') is None
+        assert cache.json() == {'entries': 2, 'size': 200, 'max_size': 250, 'hits': 2, 'misses': 2, 'evictions': 1}
+
+    def test_ttl(self):
+        cache = ResponseCache(60, 1024, [], True)
+        cache.put('a', CachedResponse('GET', '/a', 200, [], b'a', stored_at=time.time() - 120))
+        cache.put('b', CachedResponse('GET', '/b', 200, [], b'b'))
+        assert cache.get('a') is None
+        assert cache.get('b') is not None
+        assert [entry['key'] for entry in cache.export()] == ['b']
+
+    def test_persistence(self, tmp_path):
+        path = str(tmp_path / 'recordings.db')
+        cache = ResponseCache(0, 1024, [], True, path=path)
+        cache.put('a', CachedResponse('GET', '/a', 201, [('Content-Type', 'text/plain'), ('Set-Cookie', 'x=1')], b'\x00a'))
+        cache.close()
+
+        response = ResponseCache(0, 1024, [], True, path=path).get('a')
+        assert response.status == 201
+        assert response.headers == [('Content-Type', 'text/plain'), ('Set-Cookie', 'x=1')]
+        assert response.body == b'\x00a'
+
+        cache.put('b', CachedResponse('GET', '/b', 200, [], b'b'))
+        cache.flush()
+        assert ResponseCache(0, 1024, [], True, path=path).get('a') is None
+        assert ResponseCache(0, 1024, [], True, path=path).get('b') is None
+        cache.close()
+
+    def test_persistence_off_loop(self, tmp_path):
+        path = str(tmp_path / 'recordings.db')
+        cache = ResponseCache(0, 1024, [], True, path=path)
+        unblock = threading.Event()
+        threads = []
+        write, load = cache._write, cache._load
+
+        def slow_write(*args):
+            unblock.wait(10)
+            write(*args)
+
+        def spy(key):
+            threads.append(threading.current_thread())
+            return load(key)
+
+        cache._write, cache._load = slow_write, spy
+
+        async def request():
+            # The disk is stuck, yet the recording is stored and the misses are looked up elsewhere
+            start = time.perf_counter()
+            cache.put('a', CachedResponse('GET', '/a', 200, [], b'a'))
+            assert (await cache.get_async('a')).body == b'a'
+            assert await cache.get_async('b') is None
+            return time.perf_counter() - start
+
+        assert asyncio.run(request()) < 1
+        assert threads and threading.main_thread() not in threads
+        assert cache.json()['written'] == 0
+        unblock.set()
+        cache.close()
+        assert cache.json()['written'] == 1
+        assert ResponseCache(0, 1024, [], True, path=path).get('a').body == b'a'
+
+    def test_export_preload(self):
+        cache = ResponseCache(0, 1024, [], True)
+        cache.put('a', CachedResponse('POST', '/a', 200, [('X-A', '1')], b'\xffa'))
+        data = cache.export()
+
+        other = ResponseCache(0, 1024, [], True)
+        assert other.preload(data + [{'key': 'b'}]) == 1
+        assert other.get('a').json('a') == data[0]
+
+
+class TestLogs:
+
+    @staticmethod
+    def _record(path='/p', body=b'\xff' * 10, service='service'):
+        request = Request()
+        request.method = 'POST'
+        request.protocol = 'http'
+        request.hostName = 'localhost'
+        request.port = 8001
+        request.set_path(path)
+        request.headers = {'Content-Type': 'x', 'content-type': 'x'}
+        request.queryString = {'a': ['1', '2']}
+        request.body = {'k': 'v', 'b': 'AAAA'}
+        request.bodyType = {'k': 'str', 'b': BASE64}
+        request.mimeType = 'application/x-www-form-urlencoded'
+        response = Response()
+        response.status = 200
+        response.headers = {'Content-Type': 'application/octet-stream'}
+        response.body = body
+        response.bodySize = len(body)
+        return LogRecord(service, datetime.now(), 1, request, response, None)
+
+    def test_record(self):
+        har = self._record().json()
+        assert har['request']['url'].startswith('http://localhost:8001/p?')
+        assert har['request']['headers'] == [{'name': 'Content-Type', 'value': 'x'}]
+        assert har['request']['queryString'] == [{'name': 'a', 'value': '1'}, {'name': 'a', 'value': '2'}]
+        assert har['request']['postData']['params'] == [{'name': 'k', 'value': 'v'}, {'name': 'b', 'value': 'AAAA', '_encoding': BASE64}]
+        assert har['response']['content']['encoding'] == BASE64
+        assert har['response']['content']['size'] == 10
+
+    def test_body_truncation(self, monkeypatch):
+        monkeypatch.setattr('mockintosh.logs.TRAFFIC_LOG_BODY_SIZE', 4)
+        har = self._record(body='ééé').json()
+        assert har['response']['content']['text'] == 'éé'
+        assert har['response']['content']['size'] == 3
+
+    def test_ring_buffer_and_sampling(self):
+        logs = ServiceLogs('service', capacity=2, sampling=2)
+        assert not logs.should_record()
+        logs.enabled = True
+        for i in range(6):
+            if logs.should_record():
+                logs.add_record(self._record('/%d' % i))
+        assert [entry['request']['url'].split('?')[0][-2:] for entry in logs.json()['log']['entries']] == ['/2', '/4']
+        logs.reset()
+        assert len(logs.records) == 0
+
+    def test_filter(self):
+        logs = Logs()
+        logs.add_service('first')
+        logs.add_service('second')
+        logs.services[0].add_record(self._record('/a/1'))
+        logs.services[1].add_record(self._record('/b/1'))
+        record = self._record('/a/2')
+        record._response = (404,) + record._response[1:]
+        logs.services[0].add_record(record)
+
+        data = logs.json()
+        assert [entry['request']['url'].split('?')[0][-4:] for entry in data['log']['entries']] == ['/a/1', '/b/1', '/a/2']
+        cursor = data['log']['_cursor']
+
+        data = logs.json(LogFilter.from_query({'limit': '1'}))
+        assert len(data['log']['entries']) == 1
+        data = logs.json(LogFilter.from_query({'since': data['log']['_cursor'], 'limit': '5'}))
+        assert len(data['log']['entries']) == 2
+        assert data['log']['_cursor'] == cursor
+        assert logs.json(LogFilter.from_query({'since': cursor}))['log']['entries'] == []
+        data = logs.json(LogFilter.from_query({'latest': '1'}))
+        assert len(data['log']['entries']) == 1 and data['log']['_cursor'] == cursor
+
+        def paths(query):
+            return [entry['request']['url'].split('?')[0][-4:] for entry in logs.json(LogFilter.from_query(query))['log']['entries']]
+
+        assert paths({'path': '^/a/'}) == ['/a/1', '/a/2']
+        assert paths({'status': '4xx'}) == ['/a/2']
+        assert paths({'status': '200', 'path': '1$'}) == ['/a/1', '/b/1']
+        assert paths({'method': 'get,put'}) == []
+        assert paths({'method': 'post'}) == ['/a/1', '/b/1', '/a/2']
+        assert paths({'from': str(time.time() + 60)}) == []
+        assert paths({'to': datetime.now().isoformat()}) == ['/a/1', '/b/1', '/a/2']
+
+        assert paths({'latest': '2'}) == ['/b/1', '/a/2']
+        assert paths({'latest': '5', 'path': '^/a/'}) == ['/a/1', '/a/2']
+
+        for query in ({'limit': '0'}, {'latest': '0'}, {'limit': '1', 'latest': '1'}, {'status': '600'}, {'path': '('}, {'since': 'x'}, {'from': 'yesterday'}):
+            with pytest.raises(ValueError):
+                LogFilter.from_query(query)
+
+    def test_sink_jsonl(self, tmp_path):
+        path = str(tmp_path / 'traffic.jsonl')
+        sink = FileTrafficSink(path, max_size=2000, backups=2, queue_size=1000)
+        logs = Logs(sink=sink)
+        logs.add_service('service')
+        for i in range(10):
+            logs.services[0].add_record(self._record('/p/%d' % i))
+        sink.close()
+
+        files = FileTrafficSink.files(path)
+        assert [os.path.basename(item) for item in files] == ['traffic.jsonl.2.gz', 'traffic.jsonl.1.gz', 'traffic.jsonl']
+        with gzip.open(files[0], 'rt') as f:
+            assert json.loads(f.readline())['_serviceName'] == 'service'
+        assert sink.json()['written'] == 10 and sink.json()['dropped'] == 0 and sink.json()['rotations'] > 2
+
+        entries = [json.loads(entry) for entry in sink.export()]
+        assert entries and entries[-1]['request']['url'].split('?')[0].endswith('/p/9')
+        assert list(sink.export(start=datetime.fromtimestamp(time.time() + 60))) == []
+        assert len(list(sink.export(end=datetime.now()))) == len(entries)
+
+        # The batches end after the records scanned, even when none of them are in the time range
+        scanned = sink.scan(end=datetime.fromtimestamp(0))
+        assert take_entries(scanned, 3) == []
+        assert take_entries(scanned, 100) is None
+        scanned = sink.scan()
+        assert len(take_entries(scanned, 3)) == 3
+        assert len(take_entries(scanned, 100)) == len(entries) - 3
+        assert take_entries(scanned, 100) is None
+
+    def test_sink_har(self, tmp_path):
+        path = str(tmp_path / 'traffic.har')
+        sink = FileTrafficSink(path, fmt='har', compress=False)
+        for i in range(3):
+            sink.write(self._record('/p/%d' % i))
+        sink.close()
+        with open(path) as f:
+            assert len(json.load(f)['log']['entries']) == 3
+
+        # A new run rotates the document of the previous one
+        sink = FileTrafficSink(path, fmt='har', compress=False)
+        sink.write(self._record('/p/3'))
+        sink.close()
+        with open(path + '.1') as f:
+            assert len(json.load(f)['log']['entries']) == 3
+        with open(path) as f:
+            assert len(json.load(f)['log']['entries']) == 1
+        assert len(list(sink.export())) == 4
+
+    def test_sink_sqlite(self, tmp_path):
+        path = str(tmp_path / 'traffic.db')
+        sink = SqliteTrafficSink(path)
+        logs = Logs(sink=sink)
+        logs.add_service('first')
+        logs.add_service('second')
+        logs.services[0].add_record(self._record('/a/1', service='first'))
+        logs.services[1].add_record(self._record('/b/1', service='second'))
+        record = self._record('/a/2', service='first')
+        record._response = (404,) + record._response[1:]
+        record.endpoint_id = 'missing'
+        logs.services[0].add_record(record)
+        sink.close()
+        assert not logs.services[0].records
+
+        data = logs.json()
+        assert [entry['request']['url'].split('?')[0][-4:] for entry in data['log']['entries']] == ['/a/1', '/b/1', '/a/2']
+        assert data['log']['entries'][0]['response']['content']['text'] == self._record().json()['response']['content']['text']
+        assert sink.connection.execute('SELECT COUNT(*) FROM bodies').fetchone()[0] == 1
+        cursor = data['log']['_cursor']
+
+        def paths(query, logs=logs):
+            return [entry['request']['url'].split('?')[0][-4:] for entry in logs.json(LogFilter.from_query(query))['log']['entries']]
+
+        assert paths({'limit': '2'}) == ['/a/1', '/b/1']
+        assert paths({'latest': '2'}) == ['/b/1', '/a/2']
+        assert logs.json(LogFilter.from_query({'latest': '1'}))['log']['_cursor'] == cursor
+        assert paths({'since': cursor}) == []
+        assert paths({'path': '^/a/'}) == ['/a/1', '/a/2']
+        assert paths({'status': '4xx'}) == ['/a/2']
+        assert paths({'status': '200', 'path': '1$'}) == ['/a/1', '/b/1']
+        assert paths({'endpoint': 'missing'}) == ['/a/2']
+        assert paths({'method': 'get'}) == []
+        assert paths({'from': str(time.time() + 60)}) == []
+        assert paths({}, logs=logs.services[1]) == ['/b/1']
+        first = logs.services[0].json(LogFilter.from_query({'limit': '1'}))['log']['_cursor']
+        assert paths({'since': first}, logs=logs.services[0]) == ['/a/2']
+        assert len(list(sink.export())) == 3
+
+        # The sequence continues from the stored records
+        sink = SqliteTrafficSink(path)
+        logs = Logs(sink=sink)
+        logs.add_service('first')
+        logs.add_service('second')
+        logs.services[1].add_record(self._record('/b/2', service='second'))
+        sink.close()
+        assert paths({'since': cursor}, logs=logs) == ['/b/2']
+
+        logs.services[1].reset()
+        assert paths({}, logs=logs) == ['/a/1', '/a/2']
+        logs.reset()
+        assert paths({}, logs=logs) == []
+        assert sink.connection.execute('SELECT COUNT(*) FROM bodies').fetchone()[0] == 0
+        assert logs.resets == 2
+
+    def test_sink_sqlite_off_loop(self, tmp_path):
+        sink = SqliteTrafficSink(str(tmp_path / 'traffic.db'))
+        logs = Logs(sink=sink)
+        logs.add_service('first')
+        logs.services[0].add_record(self._record('/a/1', service='first'))
+        sink.close()
+
+        threads = []
+        select, delete = sink.select, sink.delete
+
+        def spy(method):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return method(*args, **kwargs)
+            return wrapper
+
+        sink.select, sink.delete = spy(select), spy(delete)
+
+        async def clear():
+            data = await logs.json_async()
+            await logs.reset_async()
+            return data
+
+        assert len(asyncio.run(clear())['log']['entries']) == 1
+        assert len(threads) == 2
+        assert threading.main_thread() not in threads
+        assert logs.json()['log']['entries'] == []
+
+    def test_sink_sqlite_delete_rollback(self, tmp_path):
+        sink = SqliteTrafficSink(str(tmp_path / 'traffic.db'))
+        logs = Logs(sink=sink)
+        logs.add_service('first')
+        logs.services[0].add_record(self._record('/a/1', service='first'))
+        sink.close()
+        sink.start()
+        connection = sink.connection
+
+        class FailingConnection:
+            def execute(self, query, *args):
+                if query.startswith('DELETE FROM bodies'):
+                    raise sqlite3.OperationalError('database is locked')
+                return connection.execute(query, *args)
+
+        sink.connection = FailingConnection()
+        with pytest.raises(sqlite3.OperationalError):
+            sink.delete()
+        sink.connection = connection
+        assert not connection.in_transaction
+        assert len(logs.json()['log']['entries']) == 1
+        sink.delete()
+        assert logs.json()['log']['entries'] == []
+        sink.close()
+
+    def test_sink_drops(self, tmp_path):
+        sink = FileTrafficSink(str(tmp_path / 'traffic.jsonl'), queue_size=1)
+        unblock = threading.Event()
+        write = sink._write
+        sink._write = lambda record: unblock.wait() and write(record)
+        # The writer holds at most one record and the queue another one
+        for _ in range(3):
+            sink.write(self._record())
+        assert sink.json()['dropped'] >= 1
+        unblock.set()
+        sink.close()
+        assert sink.json()['written'] + sink.json()['dropped'] == 3
+
+
+class TestEvents:
+
+    def test_diff(self):
+        old = {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [{'f': 1}, {'f': 2}], 'g': [1], 'h': 0}
+        new = {'a': 1, 'b': {'c': 2, 'd': 4}, 'e': [{'f': 1}, {'f': 3}], 'g': [1, 2], 'i': {}}
+        assert diff(old, new) == {'b': {'d': 4}, 'e': {'1': {'f': 3}}, 'g': [1, 2], 'i': {}, 'h': None}
+        assert diff(new, new) is diff(old, old)
+
+    def test_hub(self):
+        stats = {'counter': 0}
+        records = []
+        resets = {'count': 0}
+
+        async def collect_stats(request):
+            return dict(stats)
+
+        async def collect_traffic(request, cursor, limit):
+            since = int(cursor) if cursor else 0
+            return {'log': {'_enabled': True, '_cursor': str(len(records)), 'entries': records[since:][-limit:]}}
+
+        def events(subscriber):
+            messages = []
+            while not subscriber.queue.empty():
+                messages.append(subscriber.queue.get_nowait().decode())
+            return messages
+
+        async def run():
+            hub = EventHub({'stats': collect_stats}, collect_traffic, traffic_limit=2, traffic_resets=lambda: resets['count'])
+            first = Subscriber(None, ['stats', 'traffic'])
+            second = Subscriber(None, ['traffic'], since='0')
+            hub.subscribers = [first, second]
+            records.append({'n': 1})
+            await hub.tick()
+            assert events(first) == [
+                'event: stats\ndata: {"snapshot": {"counter": 0}}\n\n',
+                'event: traffic\ndata: {"reset": true, "enabled": true, "limit": 2, "entries": [{"n": 1}]}\n\n'
+            ]
+            assert events(second) == ['event: traffic\ndata: {"reset": false, "enabled": true, "limit": 2, "entries": [{"n": 1}]}\n\n']
+
+            await hub.tick()
+            assert events(first) == [] and events(second) == []
+
+            stats['counter'] = 1
+            records.append({'n': 2})
+            await hub.tick()
+            message = 'event: traffic\ndata: {"reset": false, "enabled": true, "limit": 2, "entries": [{"n": 2}]}\n\n'
+            assert events(first) == ['event: stats\ndata: {"patch": {"counter": 1}}\n\n', message]
+            assert events(second) == [message]
+
+            # A new subscriber gets the most recent records only
+            third = Subscriber(None, ['traffic'])
+            hub.subscribers.append(third)
+            records.append({'n': 3})
+            await hub.tick()
+            assert events(third) == ['event: traffic\ndata: {"reset": true, "enabled": true, "limit": 2, "entries": [{"n": 2}, {"n": 3}]}\n\n']
+            events(first)
+            events(second)
+
+            # After a clean-up, every subscriber starts over
+            records.clear()
+            resets['count'] += 1
+            await hub.tick()
+            message = 'event: traffic\ndata: {"reset": true, "enabled": true, "limit": 2, "entries": []}\n\n'
+            assert events(first) == events(second) == events(third) == [message]
+            hub.subscribers.remove(third)
+
+            hub.unsubscribe(second)
+            assert second.closed and second.queue.get_nowait() is None and hub.subscribers == [first]
+
+        asyncio.run(run())
 
 
 class TemplateMapper(object):
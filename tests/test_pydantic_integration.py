@@ -105,6 +105,94 @@ class TestPydanticConfigurationIntegration:
         assert len(config.services[0].endpoints) == 1
         assert config.services[0].endpoints[0].path == "/test"
 
+    def test_builders_external_file_body(self):
+        """Test that a response body starting with `@` refers to an external file."""
+        builder = ConfigRootBuilder()
+
+        response = builder.build_config_response({"body": "@templates/large.bin"})
+        assert isinstance(response.body, ConfigExternalFilePath)
+        assert response.body.path == "@templates/large.bin"
+
+        response = builder.build_config_response("hello")
+        assert response.body == "hello"
+
+    def test_builders_fallback_to(self):
+        """Test that `fallbackTo` accepts a URL or an object with the client options."""
+        builder = ConfigRootBuilder()
+
+        assert builder.build_config_fallback_to(None) is None
+        fallback_to = builder.build_config_fallback_to("http://example.com/")
+        assert fallback_to.url == "http://example.com/"
+        assert fallback_to.max_connections == 100
+        assert fallback_to.read_timeout is None
+        assert fallback_to.coalesce
+
+        fallback_to = builder.build_config_fallback_to({
+            "url": "https://example.com",
+            "maxConnections": 4,
+            "readTimeout": 1.5,
+            "http2": True,
+            "dnsCacheTtl": 60,
+            "stream": True,
+            "coalesce": False
+        })
+        assert fallback_to.stream
+        assert not fallback_to.coalesce
+        assert fallback_to.max_connections == 4
+        assert fallback_to.read_timeout == 1.5
+        assert fallback_to.http2
+        assert fallback_to.dns_cache_ttl == 60
+        assert fallback_to.cache is None
+
+        fallback_to = builder.build_config_fallback_to({"url": "http://example.com", "cache": True})
+        assert fallback_to.cache.ttl == 0
+        assert fallback_to.cache.key_body
+        assert fallback_to.cache.path is None
+
+        fallback_to = builder.build_config_fallback_to({
+            "url": "http://example.com",
+            "cache": {"ttl": 60, "maxSize": 1024, "keyHeaders": ["Authorization"], "keyBody": False, "path": "recordings.db"}
+        })
+        assert fallback_to.cache.ttl == 60
+        assert fallback_to.cache.max_size == 1024
+        assert fallback_to.cache.key_headers == ["Authorization"]
+        assert not fallback_to.cache.key_body
+        assert fallback_to.cache.path == "recordings.db"
+
+        assert fallback_to.circuit_breaker is None
+        fallback_to = builder.build_config_fallback_to({"url": "http://example.com", "circuitBreaker": True})
+        assert fallback_to.circuit_breaker.failure_threshold == 5
+        assert fallback_to.circuit_breaker.open_duration == 30
+        fallback_to = builder.build_config_fallback_to({
+            "url": "http://example.com",
+            "circuitBreaker": {"failureThreshold": 2, "errorRate": 0.25, "minRequests": 8, "window": 5, "openDuration": 1}
+        })
+        assert fallback_to.circuit_breaker.failure_threshold == 2
+        assert fallback_to.circuit_breaker.error_rate == 0.25
+        assert fallback_to.circuit_breaker.min_requests == 8
+        assert fallback_to.circuit_breaker.window == 5
+        assert fallback_to.circuit_breaker.open_duration == 1
+
+    def test_builders_fallback_to_group(self):
+        """Test that `fallbackTo` accepts a list of upstreams or an object with the targets and the strategy."""
+        builder = ConfigRootBuilder()
+
+        fallback_to = builder.build_config_fallback_to(["http://a.example.com", {"url": "http://b.example.com", "weight": 2}])
+        assert fallback_to.strategy == "roundRobin"
+        assert [target.url for target in fallback_to.targets] == ["http://a.example.com", "http://b.example.com"]
+        assert [target.weight for target in fallback_to.targets] == [1, 2]
+        assert fallback_to.targets[0].circuit_breaker is not None
+
+        fallback_to = builder.build_config_fallback_to({
+            "strategy": "leastOutstanding",
+            "targets": [{"url": "http://a.example.com", "circuitBreaker": False}]
+        })
+        assert fallback_to.strategy == "leastOutstanding"
+        assert fallback_to.targets[0].circuit_breaker is None
+
+        with pytest.raises(ValueError):
+            builder.build_config_fallback_to({"strategy": "random", "targets": ["http://a.example.com"]})
+
     def test_definition_integration(self):
         """Test that the Definition class can work with the new configuration."""
         from mockintosh.definition import Definition